@@ -0,0 +1,438 @@
+"""Throughput benchmark for the document generators.
+
+Builds synthetic rosters and templates, drives the generators with the fake
+PDF converter and reports rows/sec, per-row latency (p50/p99), peak RSS and
+bytes written for every document type x output format. Each scenario runs
+in a fresh interpreter inside its own scratch directory, so caches and peak
+RSS never leak from one scenario into the next.
+
+    python benchmark.py --rows 500 --output bench.json
+    python benchmark.py --rows 500 --compare bench.json   # after a change
+    python benchmark.py --startup 5 --output startup.json # start-up only
+
+Per-row latency runs from when the batch engine takes a row off the roster
+to when the row reaches the generators' on_row callback, so it includes
+time spent queued for a worker and waiting on PDF batches. Peak RSS is
+sampled across the benchmark process and all of its descendants (pool
+workers, the forkserver, converter processes).
+
+The start-up benchmark imports the app in fresh interpreters and times the
+import, the first page request and the first DOCX, certificate and roster
+read, cold and after warm_up(); the median of the runs is reported.
+"""
+import argparse
+import json
+import statistics
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+DOCX_TYPES = ('transcript', 'associate')
+FORMATS = ('doc', 'pdf', 'both')
+
+# ---------------------- Fixtures ----------------------
+def make_docx_template(path, variables, table_variables=()):
+    import docx
+    document = docx.Document()
+    document.add_heading("Benchmark", 0)
+    for variable in variables:
+        document.add_paragraph(f"{variable}: {{{{ {variable} }}}}")
+    if table_variables:
+        table = document.add_table(rows=(len(table_variables) + 1) // 2, cols=2)
+        for i, variable in enumerate(table_variables):
+            table.cell(i // 2, i % 2).text = f"{{{{ {variable} }}}}"
+    document.save(path)
+
+def make_roster(path, header, rows):
+    if path.endswith('.csv'):
+        import csv
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            writer.writerows(rows)
+    else:
+        import openpyxl
+        workbook = openpyxl.Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(header)
+        for row in rows:
+            sheet.append(row)
+        workbook.save(path)
+
+def make_fixtures(directory, rows, roster_format):
+    """Write templates and rosters for every document type into `directory`"""
+    sys.path.insert(0, ROOT)
+    from docgen.rosters import TRANSCRIPT_COLUMNS, DOCUMENT_SCHEMAS
+    from PIL import Image
+
+    grades = TRANSCRIPT_COLUMNS[3:]
+    make_docx_template(os.path.join(directory, 'transcript.docx'),
+                       ['student_id', 'first_name', 'last_name', 'cur_date'], grades)
+    make_roster(os.path.join(directory, f'transcript.{roster_format}'), TRANSCRIPT_COLUMNS,
+                ([f"S{i:06d}", f"First{i}", f"Last{i}"] + [str((i + j) % 100) for j in range(len(grades))]
+                 for i in range(rows)))
+
+    associate_fields = sorted(DOCUMENT_SCHEMAS['associate']['fields'].items(), key=lambda item: item[1])
+    make_docx_template(os.path.join(directory, 'associate.docx'),
+                       [variable for variable, _ in associate_fields] + ['cur_date'])
+    make_roster(os.path.join(directory, f'associate.{roster_format}'), [variable for variable, _ in associate_fields],
+                ([f"K{i}", f"S{i}", f"ឈ្មោះ{i}", f"Student {i}", "ប្រុស", "Male", "១/១/២០០០", "1/1/2000",
+                  "ភ្នំពេញ", "Phnom Penh", "២០២៥", "2025"] for i in range(rows)))
+
+    Image.new("RGB", (2000, 1414), "white").save(os.path.join(directory, 'certificate.png'))
+    make_roster(os.path.join(directory, f'certificate.{roster_format}'), ['Name'],
+                ([f"Student Name {i}"] for i in range(rows)))
+
+# ---------------------- Scenarios ----------------------
+def scenarios(types, formats, individual):
+    for document_type in types:
+        if document_type == 'certificate':
+            yield {'name': 'certificate', 'document_type': 'certificate', 'format': None, 'individual': False}
+            if individual:
+                yield {'name': 'individual/certificate', 'document_type': 'certificate', 'format': None,
+                       'individual': True}
+            continue
+        for file_format in formats:
+            yield {'name': f'{document_type}/{file_format}', 'document_type': document_type,
+                   'format': file_format, 'individual': False}
+            if individual:
+                yield {'name': f'individual/{document_type}/{file_format}', 'document_type': document_type,
+                       'format': file_format, 'individual': True}
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+def directory_bytes(path):
+    total = 0
+    for directory, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(directory, filename))
+    return total
+
+def process_tree_rss_kb(root):
+    """Resident set of `root` and every process descended from it, in KiB (Linux only)"""
+    children = {}
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as f:
+                # The command name may hold spaces, so split after its closing parenthesis
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, ValueError, IndexError):
+            continue
+        children.setdefault(ppid, []).append(int(name))
+    total, pids = 0, [root]
+    while pids:
+        pid = pids.pop()
+        pids.extend(children.get(pid, ()))
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                total += next((int(line.split()[1]) for line in f if line.startswith('VmRSS:')), 0)
+        except OSError:
+            continue
+    return total
+
+class RssSampler:
+    """Background thread keeping the peak of process_tree_rss_kb() for this process"""
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while True:
+            self.peak_kb = max(self.peak_kb, process_tree_rss_kb(os.getpid()))
+            if self._stop.wait(self.interval):
+                return
+
+    def __enter__(self):
+        if os.path.isdir('/proc/self'):
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        # Where /proc can't be read, fall back to this process's own peak
+        self.peak_kb = self.peak_kb or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run_scenario(spec):
+    """Run one scenario in this process (cwd is a scratch directory)"""
+    sys.path.insert(0, ROOT)
+    from docgen import batch, generators
+    from docgen.cache import output_cache
+    from docgen.converters import FakePdfConverter, get_pdf_converter, set_pdf_converter
+
+    set_pdf_converter(FakePdfConverter())
+    output_cache.enabled = spec['cache']
+    fixtures = spec['fixtures']
+    document_type = spec['document_type']
+    roster = os.path.join(fixtures, f"{document_type}.{spec['roster_format']}")
+    template = os.path.join(fixtures, f"{document_type}.{'png' if document_type == 'certificate' else 'docx'}")
+    output_root = os.path.abspath('output')
+
+    # A row is submitted when the batch engine takes it off the roster
+    submitted = {}
+    iter_batch = batch.iter_batch
+    def timed_iter_batch(row_fn, rows, *args, **kwargs):
+        def stamped():
+            for index, row in rows:
+                submitted[index] = time.perf_counter()
+                yield index, row
+        return iter_batch(row_fn, stamped(), *args, **kwargs)
+    batch.iter_batch = timed_iter_batch
+
+    latencies = []
+    call_start = None
+    def on_row(index, files, error):
+        latencies.append(time.perf_counter() - submitted.pop(index, call_start))
+
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        if spec['individual']:
+            for i in range(spec['individual_count']):
+                student = {'student_name': f"Student Name {i}", 'student_id': f"S{i:06d}",
+                           'first_name': f"First{i}", 'last_name': f"Last{i}", 'name_kh': f"ឈ្មោះ{i}"}
+                call_start = time.perf_counter()
+                success, result = generators.generate_individual_document(document_type, template, output_root, student,
+                                                                 spec['format'] or 'both', on_row=on_row)
+                if not success:
+                    raise RuntimeError(result)
+        elif document_type == 'certificate':
+            success, result = generators.generate_certificates(roster, template, output_root, on_row=on_row)
+        elif document_type == 'transcript':
+            success, result = generators.generate_transcripts(roster, template, spec['format'], on_row=on_row,
+                                                     output_root=output_root)
+        else:
+            success, result = generators.generate_associate_documents(roster, template, spec['format'], on_row=on_row,
+                                                             output_root=output_root)
+        if not spec['individual'] and not success:
+            raise RuntimeError(result)
+        elapsed = time.perf_counter() - start
+
+    return {
+        'scenario': spec['name'],
+        'rows': len(latencies),
+        'seconds': round(elapsed, 4),
+        'rows_per_sec': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 3) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 3) if latencies else None,
+        'peak_rss_mb': round(rss.peak_kb / 1024, 1),
+        'bytes_written': directory_bytes(output_root) if os.path.isdir(output_root) else 0,
+        'pdf_conversions': len(get_pdf_converter().converted),
+    }
+
+def run_isolated(spec):
+    """Run a scenario in a fresh interpreter and scratch directory"""
+    workdir = tempfile.mkdtemp(prefix='docgen-bench-')
+    try:
+        completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-one', json.dumps(spec)],
+                                   cwd=workdir, capture_output=True, text=True, env=spec_environment(spec))
+        if completed.returncode != 0:
+            return {'scenario': spec['name'], 'error': completed.stderr.strip().splitlines()[-1:]}
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def spec_environment(spec):
+    env = dict(os.environ, PDF_CONVERTER='fake')
+    if spec.get('workers'):
+        env['BATCH_WORKERS'] = str(spec['workers'])
+    return env
+
+# ---------------------- Startup ----------------------
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'docxtpl', 'docx', 'PIL.Image')
+STARTUP_COLUMNS = ('import_ms', 'first_page_ms', 'warm_up_ms', 'first_docx_ms', 'first_certificate_ms',
+                   'first_roster_ms', 'total_ms')
+
+def timed_ms(fn):
+    start = time.perf_counter()
+    fn()
+    return round((time.perf_counter() - start) * 1000, 2)
+
+def register_startup_templates(fixtures):
+    """Register the fixture templates by name, as a deployment would have them (cwd is the scratch directory)"""
+    sys.path.insert(0, ROOT)
+    from docgen.store import template_registry
+    for name, filename in (('bench-transcript', 'transcript.docx'), ('bench-certificate', 'certificate.png')):
+        with open(os.path.join(fixtures, filename), 'rb') as f:
+            template_registry.register(f, filename, name)
+
+def run_startup(spec):
+    """Import the app in this fresh interpreter and time the first page and first documents"""
+    start = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    import app
+    from docgen.converters import FakePdfConverter, set_pdf_converter
+    from docgen.generators import get_certificate_renderer
+    from docgen.rendering import render_docx
+    from docgen.rosters import iter_roster_rows
+    from docgen.store import template_registry
+    result = {'scenario': 'startup/warm' if spec['warm'] else 'startup/cold',
+              'import_ms': round((time.perf_counter() - start) * 1000, 2),
+              'loaded_on_import': [module for module in HEAVY_MODULES if module in sys.modules]}
+    client = app.app.test_client()
+    result['first_page_ms'] = timed_ms(lambda: client.get('/upload'))
+    result['warm_up_ms'] = timed_ms(app.warm_up) if spec['warm'] else None
+
+    set_pdf_converter(FakePdfConverter())
+    context = {'student_id': 'S000000', 'first_name': 'First0', 'last_name': 'Last0', 'cur_date': 'January 1, 2025'}
+    os.makedirs('output', exist_ok=True)
+    result['first_docx_ms'] = timed_ms(
+        lambda: render_docx(template_registry.resolve('bench-transcript')['path'], context))
+    result['first_certificate_ms'] = timed_ms(
+        lambda: get_certificate_renderer(template_registry.resolve('bench-certificate')['path'])
+        .render_to_file(['Student Name 0'], 'output'))
+    roster = os.path.join(spec['fixtures'], f"transcript.{spec['roster_format']}")
+    result['first_roster_ms'] = timed_ms(lambda: list(iter_roster_rows(roster)))
+    result['total_ms'] = round((time.perf_counter() - start) * 1000, 2)
+    return result
+
+def startup_benchmark(fixtures, runs, roster_format):
+    """Median of `runs` cold and warmed start-ups, each in a fresh interpreter"""
+    workdir = tempfile.mkdtemp(prefix='docgen-startup-')
+    env = dict(os.environ, PDF_CONVERTER='fake')
+    env.pop('WARM_UP', None)
+    try:
+        subprocess.run([sys.executable, os.path.abspath(__file__), '--register-startup', fixtures],
+                       cwd=workdir, check=True, capture_output=True, env=env)
+        samples = {}
+        for _ in range(runs):
+            for warm in (False, True):
+                spec = {'warm': warm, 'fixtures': fixtures, 'roster_format': roster_format}
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--run-startup',
+                                            json.dumps(spec)], cwd=workdir, capture_output=True, text=True, env=env)
+                if completed.returncode != 0:
+                    return [{'scenario': 'startup', 'error': completed.stderr.strip().splitlines()[-1:]}]
+                sample = json.loads(completed.stdout.strip().splitlines()[-1])
+                samples.setdefault(sample['scenario'], []).append(sample)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    results = []
+    for scenario, runs_of in samples.items():
+        result = {'scenario': scenario, 'runs': len(runs_of), 'loaded_on_import': runs_of[0]['loaded_on_import']}
+        for column in STARTUP_COLUMNS:
+            values = [sample[column] for sample in runs_of if sample[column] is not None]
+            result[column] = round(statistics.median(values), 2) if values else None
+        results.append(result)
+    return results
+
+# ---------------------- Reporting ----------------------
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, baseline=None):
+    previous = {result['scenario']: result for result in (baseline or {}).get('results', [])}
+    print(f"{'scenario':<32}{'rows/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'RSS MB':>9}{'MB out':>9}"
+          + (f"{'vs base':>10}" if baseline else ""))
+    for result in results:
+        if 'error' in result:
+            print(f"{result['scenario']:<32}  failed: {' '.join(result['error'])}")
+            continue
+        line = (f"{result['scenario']:<32}{result['rows_per_sec']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                f"{result['peak_rss_mb']:>9}{result['bytes_written'] / (1024 * 1024):>9.1f}")
+        before = previous.get(result['scenario'])
+        if before and before.get('rows_per_sec'):
+            change = (result['rows_per_sec'] / before['rows_per_sec'] - 1) * 100
+            line += f"{change:>+9.1f}%"
+        print(line)
+
+def print_startup_table(results, baseline=None):
+    previous = {result['scenario']: result for result in (baseline or {}).get('results', [])}
+    print(f"{'scenario':<16}" + ''.join(f"{column[:-3]:>19}" for column in STARTUP_COLUMNS)
+          + (f"{'vs base':>10}" if baseline else ""))
+    for result in results:
+        if 'error' in result:
+            print(f"{result['scenario']:<16}  failed: {' '.join(result['error'])}")
+            continue
+        line = f"{result['scenario']:<16}" + ''.join(
+            f"{'-' if result[column] is None else result[column]:>19}" for column in STARTUP_COLUMNS)
+        before = previous.get(result['scenario'])
+        if before and before.get('total_ms'):
+            line += f"{(result['total_ms'] / before['total_ms'] - 1) * 100:>+9.1f}%"
+        print(line)
+        if result['loaded_on_import']:
+            print(f"{'':<16}loaded on import: {', '.join(result['loaded_on_import'])}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=200, help='students per synthetic roster')
+    parser.add_argument('--types', default='transcript,associate,certificate')
+    parser.add_argument('--formats', default=','.join(FORMATS), help='doc, pdf and/or both')
+    parser.add_argument('--roster-format', choices=('csv', 'xlsx'), default='xlsx')
+    parser.add_argument('--workers', type=int, help='BATCH_WORKERS for the run (default: the app default)')
+    parser.add_argument('--individual', type=int, default=20,
+                        help='generate_individual_document calls per scenario (0 to skip)')
+    parser.add_argument('--cache', action='store_true', help='leave the output cache enabled')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON from an earlier run to compare rows/sec against')
+    parser.add_argument('--startup', type=int, metavar='RUNS',
+                        help='benchmark start-up and first-request latency instead of throughput')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    parser.add_argument('--run-startup', help=argparse.SUPPRESS)
+    parser.add_argument('--register-startup', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_one:
+        print(json.dumps(run_scenario(json.loads(args.run_one))))
+        return
+    if args.run_startup:
+        print(json.dumps(run_startup(json.loads(args.run_startup))))
+        return
+    if args.register_startup:
+        register_startup_templates(args.register_startup)
+        return
+
+    fixtures = tempfile.mkdtemp(prefix='docgen-fixtures-')
+    try:
+        make_fixtures(fixtures, args.rows, args.roster_format)
+        if args.startup:
+            results = startup_benchmark(fixtures, args.startup, args.roster_format)
+        else:
+            results = []
+            for scenario in scenarios(args.types.split(','), args.formats.split(','), args.individual > 0):
+                spec = dict(scenario, fixtures=fixtures, roster_format=args.roster_format, cache=args.cache,
+                            individual_count=args.individual, workers=args.workers)
+                results.append(run_isolated(spec))
+                print(f"  {results[-1]['scenario']} done", file=sys.stderr)
+    finally:
+        shutil.rmtree(fixtures, ignore_errors=True)
+
+    report = {
+        'revision': git_revision(),
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'cpus': os.cpu_count(),
+        'settings': {'rows': args.rows, 'roster_format': args.roster_format, 'workers': args.workers,
+                     'individual': args.individual, 'cache': args.cache, 'startup_runs': args.startup},
+        'results': results,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    (print_startup_table if args.startup else print_table)(results, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Document generator: the Flask app and its settings.
+
+Each submodule keeps one part of the pipeline; app.py wires up the routes.
+"""
+import os
+import multiprocessing
+from flask import Flask
+
+# templates/ and static/ sit next to app.py, one level up
+app = Flask(__name__, root_path=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+app.config['SECRET_KEY'] = 'your-secret-key-here'
+app.config['UPLOAD_FOLDER'] = 'uploads'
+app.config['GENERATED_FOLDER'] = 'generated_docs'
+app.config['SCHEMA_FOLDER'] = 'schemas'  # extra <document_type>.json column mappings
+app.config['TEMPLATE_REGISTRY_FOLDER'] = 'template_registry'  # registered templates, one file per content hash
+app.config['MAX_CONTENT_LENGTH'] = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))  # per request
+app.config['UPLOAD_MAX_BYTES'] = int(os.environ.get('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024))  # one chunked upload
+app.config['UPLOAD_CHUNK_BYTES'] = 8 * 1024 * 1024  # chunk size suggested to chunked-upload clients
+app.config['TEMPLATE_CACHE_SIZE'] = 16  # parsed DOCX templates kept in memory
+# Render placeholder-only DOCX templates by splicing values into precompiled
+# XML instead of going through docxtpl/python-docx for every row
+app.config['DOCX_FAST_PATH'] = os.environ.get('DOCX_FAST_PATH', '1') != '0'
+app.config['CERTIFICATE_FORMAT'] = 'png'  # png, jpeg or webp
+app.config['CERTIFICATE_PNG_COMPRESS_LEVEL'] = 1  # zlib level 0-9; higher is smaller but slower
+app.config['CERTIFICATE_QUALITY'] = 90  # JPEG/WebP quality
+app.config['OUTPUT_CACHE_ENABLED'] = True
+app.config['OUTPUT_CACHE_FOLDER'] = os.path.join(app.config['GENERATED_FOLDER'], '.cache')
+app.config['OUTPUT_CACHE_MAX_BYTES'] = 2 * 1024 * 1024 * 1024
+# Context keys left out of the cache key. cur_date stays in, so cached
+# documents never carry a stale date; jobs can pin issue_date to reuse them.
+app.config['OUTPUT_CACHE_IGNORE_KEYS'] = ()
+app.config['BATCH_WORKERS'] = int(os.environ.get('BATCH_WORKERS', os.cpu_count() or 1))
+app.config['BATCH_CHUNK_SIZE'] = 4  # rows sent to a worker per task
+app.config['BATCH_WORKERS_TOTAL'] = int(os.environ.get('BATCH_WORKERS_TOTAL', os.cpu_count() or 1))  # across all jobs
+app.config['BATCH_WORKER_MEMORY'] = 1024 * 1024 * 1024  # heap a pool worker may add before its row fails; 0 for no limit
+# Pool workers start from a clean forkserver (spawn where there is none),
+# never forked from the threaded web process
+app.config['BATCH_START_METHOD'] = os.environ.get(
+    'BATCH_START_METHOD', 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+app.config['PIPELINE_QUEUE_SIZE'] = 2  # row groups waiting on PDF conversion before rendering pauses
+app.config['PDF_CONVERTER'] = os.environ.get('PDF_CONVERTER', 'docx2pdf')  # docx2pdf, libreoffice, unoserver or fake
+app.config['PDF_BATCH_SIZE'] = 50  # documents handed to the converter at once
+app.config['COHORT_PDF_DPI'] = 150  # certificate pixels per inch in a combined cohort PDF
+app.config['PDF_CONVERTER_POOL_SIZE'] = 2  # long-lived unoserver processes
+app.config['PDF_CONVERTER_TIMEOUT'] = 600  # seconds per LibreOffice invocation
+app.config['SOFFICE_BINARY'] = os.environ.get('SOFFICE_BINARY', 'soffice')
+app.config['UNOSERVER_BINARY'] = os.environ.get('UNOSERVER_BINARY', 'unoserver')
+app.config['UNOSERVER_BASE_PORT'] = int(os.environ.get('UNOSERVER_BASE_PORT', 0))  # 0 lets the OS pick free ports per process
+app.config['UNOSERVER_START_TIMEOUT'] = 60  # seconds a listener may take to accept connections
+app.config['JOB_WORKERS'] = int(os.environ.get('JOB_WORKERS', 2))  # generation jobs running at once
+app.config['JOB_QUEUE_LIMIT'] = int(os.environ.get('JOB_QUEUE_LIMIT', 100))  # waiting jobs before new ones are refused
+app.config['JOB_MIN_AVAILABLE_MEMORY'] = 512 * 1024 * 1024  # host memory a waiting job needs free to start
+app.config['FILE_STORE_PATH'] = os.environ.get('FILE_STORE_PATH', os.path.join(app.config['GENERATED_FOLDER'], 'files.db'))
+app.config['FILE_STORE_TTL'] = 7 * 24 * 3600  # seconds a finished job and its files are kept
+app.config['RETENTION_INTERVAL'] = 300  # seconds between retention sweeps
+app.config['JOB_HEARTBEAT_TIMEOUT'] = 3 * app.config['RETENTION_INTERVAL']  # unfinished job with no heartbeat this long is lost
+app.config['RETENTION_MAX_BYTES'] = 20 * 1024 * 1024 * 1024  # all job outputs together; 0 for no limit
+app.config['RETENTION_JOB_MAX_BYTES'] = 2 * 1024 * 1024 * 1024  # outputs of a single job; 0 for no limit
+app.config['RETENTION_UPLOAD_MAX_AGE'] = 24 * 3600  # stray uploads not tied to a live job
+app.config['RETENTION_TEMPLATE_MAX_AGE'] = app.config['FILE_STORE_TTL']  # unnamed registry templates left unused
+app.config['RETENTION_BATCH_SIZE'] = 500  # files deleted between pauses
+app.config['PROFILER'] = os.environ.get('PROFILER', 'cprofile')  # cprofile or pyinstrument, for profiled jobs
+app.config['RESULTS_PAGE_SIZE'] = 10  # files per page on the results page
+app.config['WARM_UP_ON_IMPORT'] = os.environ.get('WARM_UP') == '1'  # run warm_up() when the app is imported
+app.config['THUMBNAIL_SIZE'] = 320  # longest edge of result previews, in pixels
+app.config['THUMBNAIL_QUALITY'] = 70  # JPEG quality of result previews
+app.config['THUMBNAIL_MAX_AGE'] = 30 * 24 * 3600  # browser cache lifetime; previews never change
+app.config['OUTPUT_SENDFILE'] = os.environ.get('OUTPUT_SENDFILE', '')  # '', x-sendfile or x-accel-redirect
+app.config['OUTPUT_ACCEL_PREFIX'] = os.environ.get('OUTPUT_ACCEL_PREFIX', '/protected-outputs/')  # nginx internal location for GENERATED_FOLDER
+app.config['OUTPUT_MAX_AGE'] = 24 * 3600  # private browser cache lifetime of downloads
+app.config['OUTPUT_GZIP_FORMATS'] = ('docx',)  # formats served precompressed to clients that accept gzip
+app.config['OUTPUT_GZIP_MIN_SAVING'] = 0.05  # fraction a gzip variant must save to be kept
+
+# Create necessary directories
+os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['GENERATED_FOLDER'], exist_ok=True)
@@ -0,0 +1,414 @@
+"""JSON API: bulk jobs, templates and chunked uploads"""
+import os
+import uuid
+import json
+import csv
+import shutil
+import time
+from flask import request, url_for, jsonify
+
+from . import app
+from .rosters import ROSTER_EXTENSIONS, get_document_schema, issue_date_text, load_document_schemas, roster_header
+from .generators import certificate_layout
+from .store import TEMPLATE_KINDS, file_store, template_info, template_registry
+from .jobs import JobQueueFull, estimate_row_count, job_output_root, job_queue, roster_job, roster_problem
+
+# ---------------------- Bulk API ----------------------
+# Register a template once, then post records as JSON, NDJSON or CSV. JSON
+# records are written out as a typed .jsonl roster (CSV is kept as sent) and
+# run through the same job queue as /upload.
+def api_error(message, status=400):
+    return jsonify({'error': message}), status
+
+def busy_response():
+    response, status = api_error("Too many jobs are waiting; retry later", 503)
+    response.headers['Retry-After'] = '60'
+    return response, status
+
+def record_roster_layout(document_type):
+    """Header row and field -> column index for writing API records as a roster"""
+    if document_type == 'certificate':
+        header = [field['column'] for field in certificate_layout()['fields'] if field['column'] != 'cur_date']
+        columns = {key: position for position, column in enumerate(header) for key in (column.lower(), column)}
+        return header, columns
+    fields = get_document_schema(document_type)['fields']
+    positions = {variable: column for variable, column in fields.items() if isinstance(column, int)}
+    header = [None] * (max(positions.values(), default=-1) + 1)
+    columns = {}
+    for variable, column in positions.items():
+        header[column] = header[column] or variable
+        columns[variable] = column
+    for variable, column in fields.items():
+        if not isinstance(column, int):
+            columns[variable] = columns[str(column)] = len(header)
+            header.append(str(column))
+    return [name or f"column_{i + 1}" for i, name in enumerate(header)], columns
+
+def write_record_roster(records, document_type, path):
+    """Write dict/list records to a .jsonl roster that keeps their JSON types; returns the row count"""
+    header, columns = record_roster_layout(document_type)
+    count = 0
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(json.dumps(header, ensure_ascii=False) + '\n')
+        for count, record in enumerate(records, start=1):
+            if isinstance(record, str) and document_type == 'certificate':
+                record = [record]
+            if isinstance(record, dict):
+                unknown = sorted(key for key in record if key not in columns)
+                if unknown:
+                    raise ValueError(f"Record {count} has unknown fields: {', '.join(unknown)}")
+                row = [None] * len(header)
+                for key, value in record.items():
+                    row[columns[key]] = value
+            elif isinstance(record, list):
+                row = record
+            else:
+                raise ValueError(f"Record {count} must be an object or an array")
+            if any(isinstance(value, (dict, list)) for value in row):
+                raise ValueError(f"Record {count} has a field that is not a string, number or boolean")
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return count
+
+def iter_ndjson(stream):
+    for number, line in enumerate(iter(stream.readline, b''), start=1):
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError(f"Line {number} is not valid JSON")
+
+@app.route('/api/templates', methods=['GET', 'POST'])
+def api_templates():
+    """Register a template (multipart 'file', optional 'name' and 'document_type'), or list the named ones"""
+    if request.method == 'GET':
+        return jsonify({'templates': file_store.template_versions(request.args.get('name'))})
+    storage = request.files.get('file')
+    if storage is None or not storage.filename:
+        return api_error("Send the template as a multipart 'file' field")
+    try:
+        template = template_registry.register(storage.stream, storage.filename,
+                                              request.form.get('name', '').strip() or None)
+        info = template_info(template)
+        if request.form.get('document_type'):
+            info['warnings'] = template_registry.check(template, request.form['document_type'])
+    except ValueError as e:
+        return api_error(str(e))
+    return jsonify(info), 201
+
+@app.route('/api/templates/<reference>')
+def api_template(reference):
+    template = template_registry.resolve(reference)
+    if template is None:
+        return api_error("Unknown template", 404)
+    return jsonify(template_info(template))
+
+@app.route('/api/jobs', methods=['POST'])
+def api_create_job():
+    """Start a generation job from records.
+
+    application/json: {"document_type", "template_id", "format", "records", "previous_job",
+    "combine", "issue_date", "roster_upload"}; NDJSON or CSV bodies take them as query parameters.
+    """
+    if job_queue.full():
+        return busy_response()
+    content_type = (request.mimetype or '').lower()
+    body = request.get_json(silent=True) if content_type == 'application/json' else None
+    settings = body if isinstance(body, dict) else request.args
+    document_type = settings.get('document_type', '')
+    file_format = settings.get('format', 'both')
+    previous_job = settings.get('previous_job')
+    issue_date = settings.get('issue_date')
+
+    if document_type != 'certificate' and document_type not in load_document_schemas():
+        return api_error(f"Unknown document_type '{document_type}'")
+    if file_format not in ('doc', 'pdf', 'both'):
+        return api_error("format must be doc, pdf or both")
+    try:
+        issue_date and issue_date_text(issue_date)
+    except (TypeError, ValueError):
+        return api_error("issue_date must be written as YYYY-MM-DD")
+    template = template_registry.resolve(settings.get('template_id', ''))
+    if template is None:
+        return api_error("Unknown template_id; register the template at /api/templates first", 404)
+    try:
+        warnings = template_registry.check(template, document_type)
+    except ValueError as e:
+        return api_error(str(e))
+    if previous_job and not file_store.has_session(previous_job):
+        return api_error("previous_job was not found", 404)
+
+    job_id = str(uuid.uuid4())
+    roster_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_records.jsonl")
+    try:
+        if settings.get('roster_upload'):
+            roster_path, total = chunked_uploads.roster(settings['roster_upload'], document_type)
+        elif content_type == 'application/json':
+            if not isinstance(body, dict) or not isinstance(body.get('records'), list):
+                return api_error("The JSON body needs a 'records' array")
+            total = write_record_roster(body['records'], document_type, roster_path)
+        elif content_type in ('application/x-ndjson', 'application/jsonl'):
+            total = write_record_roster(iter_ndjson(request.stream), document_type, roster_path)
+        elif content_type == 'text/csv':
+            roster_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{job_id}_records.csv")
+            with open(roster_path, 'wb') as f:
+                shutil.copyfileobj(request.stream, f, 1024 * 1024)
+            # Same check as /upload, so a bad header is refused here rather than failing every row
+            try:
+                problem = roster_problem(document_type, roster_header(roster_path), template['variables'] or None)
+            except Exception as e:
+                problem = f"The roster could not be read: {e}"
+            if problem:
+                raise ValueError(problem)
+            total = estimate_row_count(roster_path)
+        else:
+            return api_error("Send application/json, application/x-ndjson or text/csv", 415)
+    except ValueError as e:
+        if os.path.exists(roster_path):
+            os.remove(roster_path)
+        return api_error(str(e))
+    if total == 0:
+        if not settings.get('roster_upload'):
+            os.remove(roster_path)
+        return api_error("No records to generate")
+
+    combine = str(settings.get('combine', '')).lower() in ('1', 'true', 'yes')
+    target, args, kwargs = roster_job(document_type, roster_path, template['path'], file_format,
+                                      job_output_root(job_id), combine, issue_date)
+    if previous_job:
+        kwargs['previous_files'] = file_store.files(previous_job)
+    roster_upload = settings.get('roster_upload')
+    if roster_upload:
+        try:
+            chunked_uploads.consume(roster_upload)
+        except ValueError as e:
+            return api_error(str(e))
+    try:
+        job = job_queue.submit(target, args, document_type=document_type, total=total, kwargs=kwargs,
+                               job_id=job_id, uploads=[roster_path], template=template['path'])
+    except JobQueueFull:
+        if roster_upload:
+            chunked_uploads.release(roster_upload)
+        return busy_response()
+    response = jsonify({
+        'job_id': job.id,
+        'status': job.status,
+        'rows_total': total,
+        'template_id': template['id'],
+        'warnings': warnings,
+        'status_url': url_for('job_status', job_id=job.id, limit=0),
+        'files_url': url_for('job_files', job_id=job.id),
+        'archive_url': url_for('batch_download', session_id=job.id),
+        'results_url': url_for('results', session_id=job.id, document_type=document_type),
+    })
+    response.status_code = 202
+    response.headers['Location'] = url_for('job_status', job_id=job.id, limit=0)
+    return response
+
+# ---------------------- Chunked Uploads ----------------------
+# Resumable uploads: create one with its total size, then PATCH the bytes in
+# order with an Upload-Offset header; GET gives the offset to resume from.
+UPLOAD_SIGNATURES = {
+    '.xlsx': b'PK\x03\x04', '.docx': b'PK\x03\x04', '.xls': b'\xd0\xcf\x11\xe0',
+    '.png': b'\x89PNG\r\n\x1a\n', '.jpg': b'\xff\xd8\xff', '.jpeg': b'\xff\xd8\xff',
+}
+
+class ChunkedUploads:
+    """Upload sessions in the file store, their bytes in UPLOAD_FOLDER"""
+
+    def __init__(self, store, folder, max_bytes):
+        self.store = store
+        self.folder = folder
+        self.max_bytes = max_bytes
+
+    def create(self, kind, filename, size, document_type=None, name=None):
+        extension = os.path.splitext(filename or '')[1].lower()
+        if kind == 'roster' and extension not in ROSTER_EXTENSIONS:
+            raise ValueError("Rosters must be .xlsx, .xls or .csv files")
+        if kind == 'template' and extension not in TEMPLATE_KINDS:
+            raise ValueError("Templates must be .docx, .png, .jpg or .jpeg files")
+        if kind not in ('roster', 'template'):
+            raise ValueError("kind must be roster or template")
+        if not isinstance(size, int) or size <= 0:
+            raise ValueError("size must be the file's length in bytes")
+        if self.max_bytes and size > self.max_bytes:
+            raise ValueError(f"Uploads are limited to {self.max_bytes:,} bytes")
+        if document_type and document_type != 'certificate' and document_type not in load_document_schemas():
+            raise ValueError(f"Unknown document_type '{document_type}'")
+        upload_id = uuid.uuid4().hex
+        path = os.path.join(self.folder, upload_id + extension)
+        open(path, 'wb').close()
+        now = time.time()
+        upload = {'id': upload_id, 'kind': kind, 'filename': filename, 'document_type': document_type,
+                  'name': name, 'path': path, 'size': size, 'received': 0, 'status': 'receiving',
+                  'error': None, 'result': {}, 'created': now, 'updated': now}
+        self.store.save_upload(upload)
+        return upload
+
+    def write(self, upload_id, offset, stream):
+        """Append one chunk at `offset`; returns the updated upload (status 'failed' with an error if rejected)"""
+        if not self.store.claim_upload(upload_id, offset):
+            return None  # unknown, finished, or the offset is not where the upload stands
+        upload = self.store.get_upload(upload_id)
+        remaining = upload['size'] - offset
+        try:
+            with open(upload['path'], 'r+b') as f:
+                f.seek(offset)
+                f.truncate()  # drops whatever an interrupted chunk left behind
+                for chunk in iter(lambda: stream.read(min(1024 * 1024, remaining + 1)), b''):
+                    remaining -= len(chunk)
+                    if remaining < 0:
+                        break
+                    f.write(chunk)
+                upload['received'] = f.tell()
+        except Exception:
+            # Bytes that arrived before a dropped connection are kept; the client resumes after them
+            upload.update(received=os.path.getsize(upload['path']), status='receiving', updated=time.time())
+            self.store.save_upload(upload)
+            raise
+        try:
+            if remaining < 0:
+                raise ValueError("The upload is longer than the size it was created with")
+            self._check(upload, offset)
+            upload['status'] = 'receiving'
+            if upload['received'] == upload['size']:
+                self._complete(upload)
+                upload['status'] = 'complete'
+        except ValueError as e:
+            upload.update(status='failed', error=str(e))
+            if os.path.exists(upload['path']):
+                os.remove(upload['path'])
+        upload['updated'] = time.time()
+        self.store.save_upload(upload)
+        return upload
+
+    def _check(self, upload, offset):
+        """Validate whatever the bytes received so far allow"""
+        extension = os.path.splitext(upload['path'])[1]
+        with open(upload['path'], 'rb') as f:
+            head = f.read(64 * 1024)
+        signature = UPLOAD_SIGNATURES.get(extension)
+        if offset == 0 and signature and not head.startswith(signature[:len(head)]):
+            raise ValueError(f"This is not a {extension} file")
+        if extension == '.csv' and 'header' not in upload['result']:
+            if any(head.startswith(magic) for magic in (b'PK\x03\x04', b'\xd0\xcf\x11\xe0')):
+                raise ValueError("This is an Excel workbook, not a .csv file")
+            complete = upload['received'] == upload['size']
+            if b'\n' in head or complete:
+                first_line = head.split(b'\n', 1)[0]
+                try:
+                    header = next(csv.reader([first_line.decode('utf-8-sig')]), [])
+                except UnicodeDecodeError:
+                    raise ValueError("CSV rosters must be UTF-8 text")
+                self._check_header(upload, header)
+            elif len(head) >= 64 * 1024:
+                raise ValueError("The CSV header row is longer than 64 KB")
+
+    def _check_header(self, upload, header):
+        upload['result']['header'] = [str(value).strip() if value is not None else '' for value in header]
+        if upload['document_type']:
+            problem = roster_problem(upload['document_type'], upload['result']['header'])
+            if problem:
+                raise ValueError(problem)
+
+    def _complete(self, upload):
+        if upload['kind'] == 'template':
+            with open(upload['path'], 'rb') as f:
+                template = template_registry.register(f, upload['filename'], upload['name'])
+            os.remove(upload['path'])
+            upload['result'] = template_info(template)
+            if upload['document_type']:
+                upload['result']['warnings'] = template_registry.check(template, upload['document_type'])
+            return
+        if 'header' not in upload['result']:
+            try:
+                header = roster_header(upload['path'])
+            except Exception as e:
+                raise ValueError(f"The roster could not be read: {e}")
+            self._check_header(upload, header)
+        upload['result']['rows'] = estimate_row_count(upload['path'])
+
+    def roster(self, upload_id, document_type):
+        """(path, rows) of a completed roster upload that fits `document_type`; consume() uses it up"""
+        upload = self.store.get_upload(upload_id)
+        if upload is None or upload['kind'] != 'roster':
+            raise ValueError("Unknown roster upload")
+        if upload['status'] == 'used':
+            raise ValueError("This roster upload was already used by a job")
+        if upload['status'] != 'complete':
+            raise ValueError(f"The roster upload is not complete ({upload['status']})")
+        problem = roster_problem(document_type, upload['result']['header'])
+        if problem:
+            raise ValueError(problem)
+        return upload['path'], upload['result']['rows']
+
+    def consume(self, upload_id):
+        """Hand a checked roster upload to a job; only one job can have it"""
+        if not self.store.move_upload(upload_id, 'complete', 'used'):
+            raise ValueError("This roster upload was already used by a job")
+
+    def release(self, upload_id):
+        """Give back an upload whose job could not be queued"""
+        self.store.move_upload(upload_id, 'used', 'complete')
+
+    def cancel(self, upload_id):
+        upload = self.store.get_upload(upload_id)
+        if upload is None:
+            return False
+        if upload['status'] != 'used' and os.path.exists(upload['path']):
+            os.remove(upload['path'])
+        self.store.delete_upload(upload_id)
+        return True
+
+chunked_uploads = ChunkedUploads(file_store, app.config['UPLOAD_FOLDER'], app.config['UPLOAD_MAX_BYTES'])
+
+def upload_info(upload):
+    info = {key: upload[key] for key in ('kind', 'filename', 'document_type', 'size', 'status', 'error')}
+    info.update(upload_id=upload['id'], offset=upload['received'], result=upload['result'],
+                chunk_bytes=min(app.config['UPLOAD_CHUNK_BYTES'], app.config['MAX_CONTENT_LENGTH'] or 1 << 62),
+                upload_url=url_for('api_upload', upload_id=upload['id']))
+    return info
+
+@app.route('/api/uploads', methods=['POST'])
+def api_create_upload():
+    """Start a resumable upload: {"kind": "roster" | "template", "filename", "size", "document_type", "name"}"""
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        return api_error("Send the upload's details as a JSON object")
+    try:
+        upload = chunked_uploads.create(body.get('kind'), body.get('filename'), body.get('size'),
+                                        body.get('document_type') or None, body.get('name') or None)
+    except ValueError as e:
+        return api_error(str(e))
+    response = jsonify(upload_info(upload))
+    response.status_code = 201
+    response.headers['Location'] = url_for('api_upload', upload_id=upload['id'])
+    return response
+
+@app.route('/api/uploads/<upload_id>', methods=['GET', 'PATCH', 'DELETE'])
+def api_upload(upload_id):
+    """GET: progress and the offset to resume from. PATCH: the next chunk. DELETE: abandon."""
+    if request.method == 'DELETE':
+        return ('', 204) if chunked_uploads.cancel(upload_id) else api_error("Unknown upload", 404)
+    if request.method == 'PATCH':
+        try:
+            offset = int(request.headers.get('Upload-Offset', ''))
+        except ValueError:
+            return api_error("Send the chunk's position in an Upload-Offset header")
+        upload = chunked_uploads.write(upload_id, offset, request.stream)
+        if upload is None:
+            current = file_store.get_upload(upload_id)
+            if current is None:
+                return api_error("Unknown upload", 404)
+            # Out of order or already finished; the body says where to go on from
+            response = jsonify(upload_info(current))
+            response.status_code = 409
+            return response
+        response = jsonify(upload_info(upload))
+        if upload['status'] == 'failed':
+            response.status_code = 422
+        response.headers['Upload-Offset'] = str(upload['received'])
+        return response
+    upload = file_store.get_upload(upload_id)
+    if upload is None:
+        return api_error("Unknown upload", 404)
+    return jsonify(upload_info(upload))
@@ -0,0 +1,406 @@
+"""The batch engine: rows through a worker pool and a PDF conversion stage"""
+import os
+import json
+import hashlib
+import threading
+import itertools
+import queue
+import time
+import contextlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import app
+from .lazy import GENERATION_MODULES
+from .metrics import _stage_local, record_stage, stage_timer, timed_iter
+from .rendering import docx_template_cache, file_digest, render_docx, write_bytes
+from .converters import get_pdf_converter
+from .cache import output_cache
+from .thumbnails import pdf_thumbnail
+
+# ---------------------- Batch Engine ----------------------
+# Workers run `prepare(options)` once, then `row_fn(state, row)` per row;
+# a failing row is reported without stopping the batch.
+_worker_state = {}
+
+def limit_worker_memory(headroom):
+    """Cap this pool worker's heap growth; past it the row at hand fails with MemoryError"""
+    if not headroom:
+        return
+    try:
+        import resource
+        with open('/proc/self/status') as f:
+            inherited = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmData:'))
+        _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+        soft = inherited + headroom
+        if hard != resource.RLIM_INFINITY:
+            soft = min(soft, hard)
+        resource.setrlimit(resource.RLIMIT_DATA, (soft, hard))
+    except (ImportError, OSError, ValueError, StopIteration):
+        pass  # not Linux; run without a limit
+
+def _init_batch_worker(prepare, options, config, cache):
+    # Workers don't inherit the parent's memory, so settings changed since
+    # import come along; the heavy modules load here, before any row runs
+    app.config.update(config)
+    output_cache.folder, output_cache.max_bytes, output_cache.enabled = cache
+    output_cache.counts_size = False  # the parent counts what workers add
+    for module in GENERATION_MODULES:
+        module.load()
+    limit_worker_memory(app.config['BATCH_WORKER_MEMORY'])
+    _worker_state['state'] = prepare(options)
+
+def batch_context(row_fn):
+    """multiprocessing context for pool workers; a forkserver preloads the row's module and the heavy ones"""
+    context = multiprocessing.get_context(app.config['BATCH_START_METHOD'])
+    if context.get_start_method() == 'forkserver':
+        context.set_forkserver_preload([row_fn.__module__] + [module.name for module in GENERATION_MODULES])
+    return context
+
+def _run_row(row_fn, state, index, row):
+    _stage_local.row = timings = []  # shipped back with the result
+    start = time.perf_counter()
+    try:
+        result, error = row_fn(state, row), None
+    except Exception as e:
+        result, error = None, str(e) or type(e).__name__
+    finally:
+        _stage_local.row = None
+    timings.append(('row', time.perf_counter() - start))
+    return index, result, error, timings
+
+def _run_batch_chunk(row_fn, chunk):
+    state = _worker_state['state']
+    return [_run_row(row_fn, state, index, row) for index, row in chunk]
+
+class WorkerBudget:
+    """Pool processes shared by every job in this process; each batch gets at least one"""
+
+    def __init__(self, total):
+        self.total = max(total, 1)
+        self.in_use = 0
+        self._cond = threading.Condition()
+
+    @contextlib.contextmanager
+    def reserve(self, wanted):
+        with self._cond:
+            while self.in_use >= self.total:
+                self._cond.wait()
+            granted = max(1, min(wanted, self.total - self.in_use))
+            self.in_use += granted
+        try:
+            yield granted
+        finally:
+            with self._cond:
+                self.in_use -= granted
+                self._cond.notify_all()
+
+batch_worker_budget = WorkerBudget(app.config['BATCH_WORKERS_TOTAL'])
+
+def iter_batch(row_fn, rows, prepare, options, workers=None, chunk_size=None):
+    """Yield (row_index, result, error, stage_timings) for every (row_index, row) in `rows`, in the order of `rows`"""
+    if workers is None:
+        workers = 1 if getattr(_stage_local, 'serial', False) else app.config['BATCH_WORKERS']
+    chunk_size = chunk_size or app.config['BATCH_CHUNK_SIZE']
+    rows = iter(rows)
+    first_chunk = list(itertools.islice(rows, chunk_size))
+
+    # Prepare in this process first: a bad template fails the whole batch
+    # here instead of inside every worker
+    state = prepare(options)
+
+    # Small batches are not worth the pool start-up cost
+    if workers <= 1 or len(first_chunk) < chunk_size:
+        for index, row in itertools.chain(first_chunk, rows):
+            yield _run_row(row_fn, state, index, row)
+        return
+
+    with batch_worker_budget.reserve(workers) as workers:
+        chunks = itertools.chain([first_chunk], iter(lambda: list(itertools.islice(rows, chunk_size)), []))
+        if workers <= 1:
+            for chunk in chunks:
+                for index, row in chunk:
+                    yield _run_row(row_fn, state, index, row)
+            return
+        yield from _pool_batch(row_fn, chunks, prepare, options, workers)
+
+def _pool_batch(row_fn, chunks, prepare, options, workers):
+    cache = (output_cache.folder, output_cache.max_bytes, output_cache.enabled)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=batch_context(row_fn), initializer=_init_batch_worker,
+                             initargs=(prepare, options, dict(app.config), cache)) as executor:
+        # Keep a bounded window of chunks in flight so `rows` is consumed lazily
+        pending = deque()
+        for chunk in chunks:
+            try:
+                future = executor.submit(_run_batch_chunk, row_fn, chunk)
+            except BrokenProcessPool as e:
+                future = Future()
+                future.set_exception(e)
+            pending.append((chunk, future))
+            if len(pending) >= workers * 2:
+                yield from _chunk_results(*pending.popleft())
+        while pending:
+            yield from _chunk_results(*pending.popleft())
+
+def _chunk_results(chunk, future):
+    try:
+        return future.result()
+    except Exception as e:
+        # The worker itself died (or failed to start); fail the rows it held
+        return [(index, None, str(e) or type(e).__name__, ()) for index, _ in chunk]
+
+def row_fingerprint(*parts):
+    """Stable hash of a row's values plus whatever else shapes its outputs"""
+    payload = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def carry_over_index(previous_files):
+    """A previous job's complete rows by (row_key, row_fingerprint), skipping rows with missing files"""
+    rows = {}
+    for file_info in previous_files or []:
+        if 'row_fingerprint' in file_info:
+            rows.setdefault((file_info['row_key'], file_info['row_fingerprint']), []).append(file_info)
+    return {identity: [dict({k: v for k, v in f.items() if k != 'cached'}, carried=True) for f in files]
+            for identity, files in rows.items() if all(os.path.exists(f['path']) for f in files)}
+
+class PipelineStage:
+    """A thread applying `fn` to items in order behind a bounded queue.
+
+    The first exception `fn` raises is re-raised by the next put() or close().
+    """
+
+    _DONE = object()
+
+    def __init__(self, fn, name, maxsize, threaded=True):
+        self.fn = fn
+        self.error = None
+        self._queue = None
+        if threaded:
+            self._queue = queue.Queue(maxsize)
+            # Stage timings still go to the job that runs the batch
+            self._thread = threading.Thread(target=self._loop, args=(getattr(_stage_local, 'job', None),),
+                                            name=f'batch-{name}', daemon=True)
+            self._thread.start()
+
+    def _loop(self, job_timings):
+        _stage_local.job = job_timings
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                return
+            if self.error is None:
+                try:
+                    self.fn(item)
+                except BaseException as e:
+                    self.error = e
+
+    def put(self, item):
+        if self.error is not None:
+            raise self.error
+        if self._queue is None:
+            self.fn(item)
+        else:
+            self._queue.put(item)
+
+    def close(self, cancel=False):
+        """Wait for the queued items (or drop them with `cancel`) and re-raise the stage's error"""
+        if self._queue is not None and self._thread.is_alive():
+            if cancel and self.error is None:
+                self.error = JobCancelled()
+            self._queue.put(self._DONE)
+            self._thread.join()
+        if self.error is not None and not cancel:
+            raise self.error
+
+class JobCancelled(Exception):
+    """Marks a pipeline stage whose batch already failed elsewhere"""
+
+def run_batch(row_fn, rows, prepare, options, on_row=None, identify=None, previous_files=None):
+    """Run a batch and return (generated_files, errors, rows_succeeded).
+
+    Rows render in the pool, PDFs convert PDF_BATCH_SIZE rows at a time on a
+    converter thread and finished rows reach `on_row` in order. With
+    `identify(row) -> (row_key, fingerprint)` rows matching `previous_files`
+    reuse that job's outputs.
+    """
+    generated_files = []
+    errors = []
+    succeeded = [0]
+    pending = []  # rows waiting on PDF conversion, in row order
+    identities = {}  # row index -> (row_key, fingerprint) while the row is in flight
+    in_flight = deque()  # indices handed to the pool and not yet back, in row order
+    carried_rows = deque()  # reused rows waiting for the rows before them
+    carry_over = carry_over_index(previous_files) if identify else {}
+    threaded = not getattr(_stage_local, 'serial', False)
+    if output_cache.enabled:
+        output_cache.size()  # counted before workers add to it; they report their bytes to finish()
+
+    def changed_rows():
+        for index, row in timed_iter(rows, 'roster_read'):
+            if identify:
+                identity = identify(row)
+                carried = carry_over.pop(identity, None)
+                if carried:
+                    carried_rows.append((index, carried))
+                    release_carried()
+                    continue
+                identities[index] = identity
+            in_flight.append(index)
+            yield index, row
+
+    def release_carried():
+        # Hand on reused rows once every row before them has come back from the pool
+        while carried_rows and (not in_flight or carried_rows[0][0] < in_flight[0]):
+            index, files = carried_rows.popleft()
+            forward(index, files, None)
+
+    def finish(index, files, error):
+        identity = identities.pop(index, None)
+        for f in files or []:
+            if 'cached' in f:
+                output_cache.record(f['cached'])
+            if 'cache_bytes' in f:
+                output_cache.added(f.pop('cache_bytes'))
+            if identity and not error:
+                f['row_key'], f['row_fingerprint'] = identity
+        if error:
+            app.logger.warning("Row %s failed: %s", index, error)
+            errors.append({'row': index, 'error': error})
+        else:
+            succeeded[0] += 1
+        if on_row:
+            on_row(index, files or [], error)
+        else:
+            generated_files.extend(files or [])
+
+    def convert(group):
+        entries = [f for _, files, _ in group for f in files or [] if 'convert_from' in f or 'convert_bytes' in f]
+        pairs = [(f['convert_from'], f['path']) for f in entries if 'convert_from' in f]
+        items = [(f['convert_bytes'], f['path']) for f in entries if 'convert_bytes' in f]
+        failures = {}
+        if entries:
+            with stage_timer('convert_batch'):
+                if pairs:
+                    failures.update(get_pdf_converter().convert_many(pairs))
+                if items:
+                    failures.update(get_pdf_converter().convert_many_bytes(items))
+        for index, files, error in group:
+            if error or not entries:
+                writer.put((index, files, error))
+                continue
+            converted = []
+            for f in files:
+                source = f.pop('convert_from', None)
+                from_bytes = f.pop('convert_bytes', None) is not None
+                cache_key = f.pop('cache_key', None)
+                if f.pop('remove_source', False) and source and os.path.exists(source):
+                    os.remove(source)
+                failure = failures.get(source) if source else failures.get(f['path']) if from_bytes else None
+                if failure:
+                    error = failure
+                    continue
+                if cache_key:
+                    output_cache.store(cache_key, 'pdf', f['path'])
+                if source or from_bytes:
+                    pdf_thumbnail(f['path'])
+                converted.append(f)
+            writer.put((index, converted, error))
+
+    def forward(index, files, error):
+        # Called in row order; rows queue behind ones waiting on conversion so
+        # the writer gets them in that order too
+        if pending or (not error and any('convert_from' in f or 'convert_bytes' in f for f in files)):
+            pending.append((index, files, error))
+            if len(pending) >= app.config['PDF_BATCH_SIZE']:
+                converter.put(pending[:])
+                pending.clear()
+        else:
+            converter.put([(index, files, error)])
+
+    writer = PipelineStage(lambda row: finish(*row), 'write', app.config['PDF_BATCH_SIZE'], threaded)
+    converter = PipelineStage(convert, 'convert', app.config['PIPELINE_QUEUE_SIZE'], threaded)
+    try:
+        for index, files, error, timings in iter_batch(row_fn, changed_rows(), prepare, options):
+            for stage, seconds in timings:
+                record_stage(stage, seconds)
+            in_flight.popleft()
+            forward(index, files, error)
+            release_carried()
+        release_carried()
+        if pending:
+            converter.put(pending[:])
+        converter.close()
+    except BaseException:
+        converter.close(cancel=True)
+        writer.close(cancel=True)
+        raise
+    writer.close()
+    return generated_files, errors, succeeded[0]
+
+def batch_result(generated_files, errors, succeeded):
+    """Map a batch outcome onto the (success, result) convention of the generators"""
+    if errors and not succeeded:
+        return False, f"Row {errors[0]['row']}: {errors[0]['error']}"
+    return True, generated_files
+
+def _prepare_docx_worker(options):
+    # Compile or parse once up front
+    if not (app.config['DOCX_FAST_PATH'] and docx_template_cache.compiled(options['template'])):
+        docx_template_cache.load(options['template'])
+    return dict(options, template_digest=file_digest(options['template']))
+
+def render_docx_outputs(state, context, base_name, display_name, document_type):
+    """The DOCX/PDF entries for one row, rendered at most once and cached when possible"""
+    option = state['option']
+    docx_key = output_cache.key(state['template_digest'], context, 'docx')
+    generated_files = []
+    doc_path = None
+    cache_bytes = [0]  # added to the cache by this worker, for the parent to count
+
+    def materialise_docx(path):
+        cached = output_cache.fetch(docx_key, 'docx', path)
+        if not cached:
+            write_bytes(path, render_docx(state['template'], context))
+            cache_bytes[0] += output_cache.store(docx_key, 'docx', path)
+        return cached
+
+    if option in ["doc", "both"]:
+        doc_path = os.path.join(state['docx_directory'], base_name + ".docx")
+        generated_files.append({
+            'name': display_name,
+            'filename': os.path.basename(doc_path),
+            'type': document_type,
+            'format': 'docx',
+            'path': doc_path,
+            'cached': materialise_docx(doc_path)
+        })
+
+    if option in ["pdf", "both"]:
+        pdf_path = os.path.join(state['pdf_directory'], base_name + ".pdf")
+        pdf_key = output_cache.key(state['template_digest'], context, 'pdf', state['pdf_converter'])
+        entry = {
+            'name': display_name,
+            'filename': os.path.basename(pdf_path),
+            'type': document_type,
+            'format': 'pdf',
+            'path': pdf_path,
+            'cached': output_cache.fetch(pdf_key, 'pdf', pdf_path)
+        }
+        if not entry['cached']:
+            # run_batch converts in batches; "pdf" mode sends bytes, or stages
+            # the DOCX for path-only backends
+            if doc_path is not None:
+                entry.update(convert_from=doc_path, cache_key=pdf_key)
+            elif state['pdf_from_bytes']:
+                entry.update(convert_bytes=render_docx(state['template'], context), cache_key=pdf_key)
+            else:
+                doc_path = os.path.join(state['staging_directory'], base_name + ".docx")
+                materialise_docx(doc_path)
+                entry.update(convert_from=doc_path, remove_source=True, cache_key=pdf_key)
+        generated_files.append(entry)
+
+    if cache_bytes[0]:
+        generated_files[0]['cache_bytes'] = cache_bytes[0]
+    return generated_files
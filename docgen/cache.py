@@ -0,0 +1,146 @@
+"""Content-addressed cache of finished outputs"""
+import os
+import uuid
+import json
+import hashlib
+import threading
+import shutil
+
+from . import app
+
+# ---------------------- Output Cache ----------------------
+def link_or_copy(source, target):
+    """Hard-link `source` to `target`, copying when linking isn't possible"""
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+class OutputCache:
+    """Content-addressed on-disk cache of finished outputs, hard-linked out on a hit.
+
+    Least recently used entries are evicted past `max_bytes`. Pool workers
+    hand what they store back to the parent, which does the counting.
+    """
+
+    def __init__(self, folder, max_bytes, enabled=True):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._size = None
+        self.counts_size = True  # False in pool workers
+        self._lock = threading.Lock()
+
+    def key(self, template_digest, context, output_format, converter=None):
+        ignored = app.config['OUTPUT_CACHE_IGNORE_KEYS']
+        payload = json.dumps({k: v for k, v in context.items() if k not in ignored},
+                             sort_keys=True, default=str)
+        if converter:
+            output_format = f"{output_format}:{converter}"
+        return hashlib.sha256(f"{template_digest}\0{output_format}\0{payload}".encode('utf-8')).hexdigest()
+
+    def _path(self, key, extension):
+        return os.path.join(self.folder, key[:2], f"{key}.{extension}")
+
+    def fetch(self, key, extension, target_path):
+        """Place a cached output at `target_path`; returns False on a miss"""
+        if not self.enabled:
+            return False
+        path = self._path(key, extension)
+        try:
+            link_or_copy(path, target_path)
+            os.utime(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def store(self, key, extension, source_path):
+        """Add an output; returns the bytes added when they are left for the parent process to count"""
+        if not self.enabled:
+            return 0
+        path = self._path(key, extension)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        link_or_copy(source_path, staging)
+        os.replace(staging, path)
+        size = os.path.getsize(path)
+        if not self.counts_size:
+            return size
+        self.added(size)
+        return 0
+
+    def size(self):
+        """Bytes in the cache, counted from the folder the first time"""
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            return self._size
+
+    def added(self, size):
+        """Count new bytes against the budget, evicting when it is exceeded"""
+        with self._lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            over_budget = self._size > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _scan(self):
+        entries = []
+        total = 0
+        for root, _, names in os.walk(self.folder):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+                total += stat.st_size
+        return entries, total
+
+    def evict(self):
+        """Drop least recently used entries until the cache is under 90% of its budget"""
+        entries, total = self._scan()
+        entries.sort()
+        target = self.max_bytes * 0.9
+        evicted = 0
+        for _, size, path in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            evicted += 1
+        with self._lock:
+            self._size = total
+            self.evictions += evicted
+        return evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bytes': self._size,
+            }
+
+output_cache = OutputCache(app.config['OUTPUT_CACHE_FOLDER'], app.config['OUTPUT_CACHE_MAX_BYTES'],
+                           app.config['OUTPUT_CACHE_ENABLED'])
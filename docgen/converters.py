@@ -0,0 +1,371 @@
+"""DOCX to PDF conversion backends"""
+import os
+import threading
+import tempfile
+import shutil
+import subprocess
+import queue
+import atexit
+import time
+import socket
+import xmlrpc.client
+from concurrent.futures import ThreadPoolExecutor
+
+from . import app
+from .lazy import docx2pdf
+from .metrics import stage_timer
+from .rendering import write_bytes
+
+# ---------------------- PDF Conversion ----------------------
+class PdfConverter:
+    """Converter interface; backends implement convert() and may override the batch/bytes methods"""
+
+    name = None
+    takes_bytes = False
+
+    def convert(self, doc_path, pdf_path):
+        raise NotImplementedError
+
+    def convert_many(self, pairs):
+        """Convert [(doc_path, pdf_path), ...] and return {doc_path: error} for failures"""
+        failures = {}
+        for doc_path, pdf_path in pairs:
+            try:
+                self.convert(doc_path, pdf_path)
+            except Exception as e:
+                failures[doc_path] = str(e)
+        return failures
+
+    def convert_bytes(self, docx_bytes, pdf_path):
+        # Most converters only take paths, so stage the document in the
+        # system temp directory rather than next to the outputs
+        with tempfile.TemporaryDirectory() as staging:
+            doc_name = os.path.splitext(os.path.basename(pdf_path))[0] + ".docx"
+            doc_path = write_bytes(os.path.join(staging, doc_name), docx_bytes)
+            self.convert(doc_path, pdf_path)
+        return pdf_path
+
+    def convert_many_bytes(self, items):
+        """Convert [(docx_bytes, pdf_path), ...] and return {pdf_path: error} for failures"""
+        failures = {}
+        for docx_bytes, pdf_path in items:
+            try:
+                self.convert_bytes(docx_bytes, pdf_path)
+            except Exception as e:
+                failures[pdf_path] = str(e)
+        return failures
+
+    def close(self):
+        pass
+
+class Docx2PdfConverter(PdfConverter):
+    """Microsoft Word through docx2pdf (Windows/macOS only)"""
+
+    name = 'docx2pdf'
+
+    def convert(self, doc_path, pdf_path):
+        docx2pdf.convert(doc_path, pdf_path)
+
+class LibreOfficeConverter(PdfConverter):
+    """Headless LibreOffice converting up to `batch_size` documents per soffice run"""
+
+    name = 'libreoffice'
+
+    def __init__(self, binary='soffice', batch_size=50, timeout=600):
+        self.binary = binary
+        self.batch_size = batch_size
+        self.timeout = timeout
+        # soffice can't share a profile between concurrent runs, so each
+        # running batch borrows its own; idle ones are kept warm for reuse
+        self._profiles = queue.LifoQueue()
+        self._profile_dirs = []
+        self._lock = threading.Lock()
+
+    def convert(self, doc_path, pdf_path):
+        failures = self.convert_many([(doc_path, pdf_path)])
+        if failures:
+            raise RuntimeError(failures[doc_path])
+
+    def convert_many(self, pairs):
+        failures = {}
+        batch = []
+        stems = set()
+        for doc_path, pdf_path in pairs:
+            # soffice names outputs after the input stem, so a batch must not repeat one
+            stem = os.path.splitext(os.path.basename(doc_path))[0]
+            if len(batch) >= self.batch_size or stem in stems:
+                failures.update(self._convert_batch(batch))
+                batch, stems = [], set()
+            batch.append((doc_path, pdf_path))
+            stems.add(stem)
+        if batch:
+            failures.update(self._convert_batch(batch))
+        return failures
+
+    def _convert_batch(self, batch):
+        try:
+            profile_dir = self._profiles.get_nowait()
+        except queue.Empty:
+            profile_dir = tempfile.mkdtemp(prefix='lo_profile_')
+            with self._lock:
+                self._profile_dirs.append(profile_dir)
+        try:
+            return self._run_soffice(batch, profile_dir)
+        finally:
+            self._profiles.put(profile_dir)
+
+    def _run_soffice(self, batch, profile_dir):
+        failures = {}
+        with tempfile.TemporaryDirectory() as out_dir:
+            command = [
+                self.binary, '--headless', '--norestore', '--nolockcheck',
+                f'-env:UserInstallation=file://{os.path.abspath(profile_dir)}',
+                '--convert-to', 'pdf', '--outdir', out_dir,
+            ] + [os.path.abspath(doc_path) for doc_path, _ in batch]
+            try:
+                subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                               timeout=self.timeout, check=True)
+            except (OSError, subprocess.SubprocessError) as e:
+                return {doc_path: f"LibreOffice conversion failed: {e}" for doc_path, _ in batch}
+
+            for doc_path, pdf_path in batch:
+                produced = os.path.join(out_dir, os.path.splitext(os.path.basename(doc_path))[0] + ".pdf")
+                if os.path.exists(produced):
+                    shutil.move(produced, pdf_path)
+                else:
+                    failures[doc_path] = "LibreOffice did not produce a PDF"
+        return failures
+
+    def close(self):
+        with self._lock:
+            profile_dirs, self._profile_dirs = self._profile_dirs, []
+        for profile_dir in profile_dirs:
+            shutil.rmtree(profile_dir, ignore_errors=True)
+
+def free_port(host='127.0.0.1'):
+    """A TCP port the OS currently has free"""
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+class UnoserverConverter(PdfConverter):
+    """Pool of long-lived `unoserver` listeners taking documents over XML-RPC.
+
+    A listener that has died is started again before its next document.
+    """
+
+    name = 'unoserver'
+    takes_bytes = True
+
+    def __init__(self, size=2, base_port=0, binary='unoserver', host='127.0.0.1', start=True, start_timeout=60):
+        self.host = host
+        # unoserver needs two ports: XML-RPC and the internal UNO socket
+        if base_port:
+            self.ports = [(base_port + 2 * i, base_port + 2 * i + 1) for i in range(size)]
+        else:
+            self.ports = [(free_port(host), free_port(host)) for _ in range(size)]
+        self.binary = binary
+        self.start_timeout = start_timeout
+        self._processes = {}
+        self._free = queue.Queue()
+        for ports in self.ports:
+            self._free.put(ports)
+        if start:
+            self.start()
+
+    def start(self):
+        for ports in self.ports:
+            self._launch(ports)
+        for ports in self.ports:
+            self._wait_ready(ports)
+
+    def _launch(self, ports):
+        port, uno_port = ports
+        self._processes[port] = subprocess.Popen(
+            [self.binary, '--interface', self.host, '--port', str(port), '--uno-port', str(uno_port)],
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def _wait_ready(self, ports):
+        """Block until the listener on `ports` accepts connections"""
+        port = ports[0]
+        deadline = time.monotonic() + self.start_timeout
+        while True:
+            process = self._processes.get(port)
+            if process is not None and process.poll() is not None:
+                raise RuntimeError(f"unoserver on port {port} exited with status {process.returncode}")
+            try:
+                with socket.create_connection((self.host, port), timeout=1):
+                    return
+            except OSError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"unoserver on port {port} did not start within {self.start_timeout}s")
+                time.sleep(0.2)
+
+    def _restart(self, ports):
+        process = self._processes.pop(ports[0], None)
+        if process is not None and process.poll() is None:
+            process.kill()
+            process.wait()
+        app.logger.warning("Restarting unoserver on port %s", ports[0])
+        self._launch(ports)
+        self._wait_ready(ports)
+
+    def _call(self, *args):
+        ports = self._free.get()
+        try:
+            process = self._processes.get(ports[0])
+            if process is None or process.poll() is not None:
+                self._restart(ports)
+            proxy = xmlrpc.client.ServerProxy(f"http://{self.host}:{ports[0]}", allow_none=True)
+            try:
+                # convert(inpath, indata, outpath, convert_to)
+                proxy.convert(*args)
+            except ConnectionError:
+                # The listener went away mid-call; one retry on a fresh one
+                self._restart(ports)
+                proxy.convert(*args)
+        finally:
+            self._free.put(ports)
+
+    def convert(self, doc_path, pdf_path):
+        self._call(os.path.abspath(doc_path), None, os.path.abspath(pdf_path), 'pdf')
+
+    def convert_bytes(self, docx_bytes, pdf_path):
+        # The listener accepts the document itself, so nothing is staged on disk
+        self._call(None, xmlrpc.client.Binary(docx_bytes), os.path.abspath(pdf_path), 'pdf')
+        return pdf_path
+
+    def convert_many(self, pairs):
+        failures = {}
+        def run(pair):
+            try:
+                self.convert(*pair)
+            except Exception as e:
+                failures[pair[0]] = str(e)
+        with ThreadPoolExecutor(max_workers=len(self.ports)) as executor:
+            list(executor.map(run, pairs))
+        return failures
+
+    def convert_many_bytes(self, items):
+        failures = {}
+        def run(item):
+            try:
+                self.convert_bytes(*item)
+            except Exception as e:
+                failures[item[1]] = str(e)
+        with ThreadPoolExecutor(max_workers=len(self.ports)) as executor:
+            list(executor.map(run, items))
+        return failures
+
+    def close(self):
+        processes, self._processes = list(self._processes.values()), {}
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+class FakePdfConverter(PdfConverter):
+    """Writes a tiny valid one-page PDF without any office suite; for tests"""
+
+    name = 'fake'
+    takes_bytes = True
+
+    def __init__(self):
+        self.converted = []
+
+    def convert(self, doc_path, pdf_path):
+        if not os.path.exists(doc_path):
+            raise FileNotFoundError(doc_path)
+        write_bytes(pdf_path, self.placeholder_pdf(os.path.basename(doc_path)))
+        self.converted.append((doc_path, pdf_path))
+
+    def convert_bytes(self, docx_bytes, pdf_path):
+        write_bytes(pdf_path, self.placeholder_pdf(os.path.basename(pdf_path)))
+        self.converted.append((None, pdf_path))
+        return pdf_path
+
+    @staticmethod
+    def placeholder_pdf(title):
+        text = str(title).replace('\\', '').replace('(', '').replace(')', '')
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('latin-1', 'replace')
+        objects = [
+            b"<< /Type /Catalog /Pages 2 0 R >>",
+            b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>",
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R "
+            b"/Resources << /Font << /F1 5 0 R >> >> >>",
+            b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream",
+            b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+        ]
+        out = bytearray(b"%PDF-1.4\n")
+        offsets = []
+        for number, body in enumerate(objects, start=1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+        for offset in offsets:
+            out += b"%010d 00000 n \n" % offset
+        out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+        return bytes(out)
+
+PDF_CONVERTERS = {'docx2pdf': Docx2PdfConverter, 'libreoffice': LibreOfficeConverter,
+                  'unoserver': UnoserverConverter, 'fake': FakePdfConverter}
+
+def create_pdf_converter(name=None):
+    name = name or app.config['PDF_CONVERTER']
+    if name == 'docx2pdf':
+        return Docx2PdfConverter()
+    if name == 'libreoffice':
+        return LibreOfficeConverter(app.config['SOFFICE_BINARY'], app.config['PDF_BATCH_SIZE'],
+                                    app.config['PDF_CONVERTER_TIMEOUT'])
+    if name == 'unoserver':
+        return UnoserverConverter(app.config['PDF_CONVERTER_POOL_SIZE'], app.config['UNOSERVER_BASE_PORT'],
+                                  app.config['UNOSERVER_BINARY'],
+                                  start_timeout=app.config['UNOSERVER_START_TIMEOUT'])
+    if name == 'fake':
+        return FakePdfConverter()
+    raise ValueError(f"Unknown PDF converter: {name}")
+
+_pdf_converter = None
+_pdf_converter_lock = threading.Lock()
+
+def get_pdf_converter():
+    """Return the process-wide converter, creating it on first use"""
+    global _pdf_converter
+    with _pdf_converter_lock:
+        if _pdf_converter is None:
+            _pdf_converter = create_pdf_converter()
+        return _pdf_converter
+
+def pdf_converter_name():
+    """Name of the backend this process converts with, without starting it"""
+    converter = _pdf_converter
+    if converter is not None:
+        return converter.name or type(converter).__name__
+    return app.config['PDF_CONVERTER']
+
+def pdf_converter_takes_bytes():
+    """Whether this process's backend converts documents from memory, without starting it"""
+    converter = _pdf_converter or PDF_CONVERTERS.get(app.config['PDF_CONVERTER'], PdfConverter)
+    return converter.takes_bytes
+
+def set_pdf_converter(converter):
+    """Swap the process-wide converter (e.g. a FakePdfConverter in tests)"""
+    global _pdf_converter
+    with _pdf_converter_lock:
+        previous, _pdf_converter = _pdf_converter, converter
+    if previous is not None and previous is not converter:
+        previous.close()
+
+def convert_docx_bytes(docx_bytes, pdf_path):
+    """Convert an in-memory DOCX straight to `pdf_path`"""
+    with stage_timer('convert'):
+        return get_pdf_converter().convert_bytes(docx_bytes, pdf_path)
+
+@atexit.register
+def _close_pdf_converter():
+    if _pdf_converter is not None:
+        _pdf_converter.close()
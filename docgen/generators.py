@@ -0,0 +1,701 @@
+"""Certificate and DOCX/PDF document generators"""
+import os
+import uuid
+import json
+import io
+import threading
+import tempfile
+import itertools
+import functools
+import zipfile
+import zlib
+import unicodedata
+import struct
+from collections import OrderedDict
+
+from . import app
+from .lazy import Image, ImageDraw, ImageFont, np
+from .metrics import stage_timer
+from .rendering import file_digest, render_docx, safe_filename, write_bytes
+from .converters import convert_docx_bytes, get_pdf_converter, pdf_converter_name, pdf_converter_takes_bytes
+from .cache import output_cache
+from .thumbnails import save_thumbnail, thumbnail_path
+from .batch import _prepare_docx_worker, batch_result, render_docx_outputs, row_fingerprint, run_batch
+from .rosters import (
+    ContextProjector, DOCUMENT_SCHEMAS, compile_projector, issue_date_text, iter_roster_records, iter_roster_rows,
+    load_document_schemas)
+
+# ---------------------- Cohort Output ----------------------
+# "One file per cohort" mode for printing: rows render into a staging
+# directory and are then streamed into one DOCX/PDF.
+def staging_on_row(staged, on_row):
+    """on_row for cohort mode: rows report progress only, their files go to `staged` in row order"""
+    def record(index, files, error):
+        staged.extend(f['path'] for f in files)
+        if on_row:
+            on_row(index, [], error)
+    return record
+
+def _split_document_xml(xml):
+    """(head, body, section) of a document.xml; section is the body-level <w:sectPr> or empty"""
+    start = xml.index(b'<w:body>') + len(b'<w:body>')
+    end = xml.rindex(b'</w:body>')
+    section = xml.rfind(b'<w:sectPr', start, end)
+    # A body-level sectPr is the body's last child; earlier ones belong to paragraphs
+    if section < max(xml.rfind(b'</w:p>', start, end), xml.rfind(b'</w:tbl>', start, end)):
+        section = end
+    return xml[:start], xml[start:section], xml[section:end]
+
+def merge_docx(paths, output_path):
+    """Concatenate DOCX files rendered from one template, a section break between students.
+
+    They share every part but word/document.xml, so only the bodies are joined.
+    """
+    with zipfile.ZipFile(paths[0]) as first:
+        head, _, section = _split_document_xml(first.read('word/document.xml'))
+        # A paragraph carrying the section properties ends one student's section
+        separator = b'<w:p><w:pPr>' + section + b'</w:pPr></w:p>' if section else \
+            b'<w:p><w:r><w:br w:type="page"/></w:r></w:p>'
+        with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as out:
+            for item in first.infolist():
+                if item.filename != 'word/document.xml':
+                    out.writestr(item, first.read(item))
+            with out.open('word/document.xml', 'w') as document:
+                document.write(head)
+                for number, path in enumerate(paths):
+                    with zipfile.ZipFile(path) as source:
+                        _, body, _ = _split_document_xml(source.read('word/document.xml'))
+                    if number:
+                        document.write(separator)
+                    document.write(body)
+                document.write(section + b'</w:body></w:document>')
+
+def _pdf_image(path):
+    """(width, height, /ColorSpace, filter entries, data) for embedding an image file in a PDF.
+
+    Plain PNGs pass their IDAT stream through and JPEGs go in as-is.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data.startswith(b'\x89PNG\r\n\x1a\n'):
+        width, height, depth, color, _, _, interlace = struct.unpack('>IIBBBBB', data[16:29])
+        if depth == 8 and color in (0, 2) and not interlace:
+            idat, position = [], 8
+            while position < len(data):
+                length, kind = struct.unpack('>I4s', data[position:position + 8])
+                if kind == b'IDAT':
+                    idat.append(data[position + 8:position + 8 + length])
+                elif kind == b'IEND':
+                    break
+                position += 12 + length
+            colors = 1 if color == 0 else 3
+            return (width, height, '/DeviceGray' if colors == 1 else '/DeviceRGB',
+                    f'/Filter /FlateDecode /DecodeParms << /Predictor 15 /Colors {colors} '
+                    f'/BitsPerComponent 8 /Columns {width} >>', b''.join(idat))
+    with Image.open(io.BytesIO(data)) as image:
+        if image.format == 'JPEG' and image.mode in ('L', 'RGB'):
+            return (image.width, image.height, '/DeviceGray' if image.mode == 'L' else '/DeviceRGB',
+                    '/Filter /DCTDecode', data)
+        if image.mode in ('RGBA', 'LA', 'P', 'PA'):
+            image = image.convert('RGBA')
+            flattened = Image.new('RGB', image.size, 'white')
+            flattened.paste(image, mask=image.getchannel('A'))
+            image = flattened
+        elif image.mode not in ('L', 'RGB'):
+            image = image.convert('RGB')
+        return (image.width, image.height, '/DeviceGray' if image.mode == 'L' else '/DeviceRGB',
+                '/Filter /FlateDecode', zlib.compress(image.tobytes(), 6))
+
+def write_image_pdf(image_paths, pdf_path, dpi=150):
+    """Write one PDF page per image, streaming pages to disk as they are added"""
+    offsets = {}
+    kids = []
+    with open(pdf_path, 'wb') as out:
+        out.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+        def write_object(number, body, stream=None):
+            offsets[number] = out.tell()
+            out.write(b'%d 0 obj\n' % number + body)
+            if stream is not None:
+                out.write(b'\nstream\n' + stream + b'\nendstream')
+            out.write(b'\nendobj\n')
+
+        number = 2  # 1 is the catalog and 2 the page tree, written last
+        for path in image_paths:
+            width, height, color_space, filters, data = _pdf_image(path)
+            page_width, page_height = width * 72 / dpi, height * 72 / dpi
+            content = f'q {page_width:.2f} 0 0 {page_height:.2f} 0 0 cm /Im0 Do Q'.encode('ascii')
+            image, contents, page = number + 1, number + 2, number + 3
+            write_object(image, (f'<< /Type /XObject /Subtype /Image /Width {width} /Height {height} '
+                                 f'/ColorSpace {color_space} /BitsPerComponent 8 {filters} '
+                                 f'/Length {len(data)} >>').encode('ascii'), data)
+            write_object(contents, b'<< /Length %d >>' % len(content), content)
+            write_object(page, (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.2f} {page_height:.2f}] '
+                                f'/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {contents} 0 R >>'
+                                ).encode('ascii'))
+            kids.append(page)
+            number = page
+
+        write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        write_object(2, b'<< /Type /Pages /Kids [%s] /Count %d >>'
+                     % (b' '.join(b'%d 0 R' % kid for kid in kids), len(kids)))
+        xref = out.tell()
+        out.write(b'xref\n0 %d\n0000000000 65535 f \n' % (number + 1))
+        for n in range(1, number + 1):
+            out.write(b'%010d 00000 n \n' % offsets[n])
+        out.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (number + 1, xref))
+    return len(kids)
+
+def cohort_entry(name, document_type, path):
+    return {
+        'name': name,
+        'filename': os.path.basename(path),
+        'type': document_type,
+        'format': os.path.splitext(path)[1][1:],
+        'path': path,
+    }
+
+# ---------------------- Individual Document Generator ----------------------
+def generate_individual_document(document_type, template_file, output_folder, student_data, file_format="both", on_row=None):
+    """Generate individual document for a single student"""
+    try:
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        generated_files = []
+        
+        if document_type == 'certificate':
+            # Generate certificate image, filling the layout's fields from the form
+            layout = certificate_layout()
+            issue_date = issue_date_text()
+            texts = [issue_date if field['column'] == 'cur_date' else
+                     str(student_data.get(field.get('manual') or ('' if i else 'student_name'), '')).strip()
+                     for i, field in enumerate(layout['fields'])]
+            if not texts[0]:
+                return False, "Student name is required for certificate generation"
+
+            renderer = get_certificate_renderer(template_file, layout)
+            generated_files.append(renderer.render_to_file(texts, output_folder))
+
+        elif document_type in load_document_schemas():
+            student_data = dict(student_data)
+            student_name = student_data.get('student_name', '')
+            if not student_data.get('first_name') and student_name:
+                # Split student name if first/last names not provided
+                name_parts = student_name.split(' ', 1)
+                student_data['first_name'] = name_parts[0]
+                student_data['last_name'] = name_parts[1] if len(name_parts) > 1 else ''
+
+            # Map the form fields to template variables through the schema
+            projector = compile_projector(document_type, template_file)
+            context = projector.from_form(student_data)
+            docx_bytes = render_docx(template_file, context)
+
+            names = [student_data.get(projector.schema['manual'].get(variable, variable), '')
+                     for variable in projector.schema['display_name']]
+            display_name = " ".join(names).strip() or student_name
+            filename_safe = safe_filename("_".join(names)) if any(names) else f"student_{uuid.uuid4().hex[:8]}"
+            base_name = f"{document_type}_{filename_safe}_{uuid.uuid4().hex[:8]}"
+            doc_path = None
+
+            if file_format in ["doc", "both"]:
+                doc_filename = base_name + ".docx"
+                doc_path = write_bytes(os.path.join(output_folder, doc_filename), docx_bytes)
+                generated_files.append({
+                    'name': display_name,
+                    'filename': doc_filename,
+                    'type': document_type,
+                    'format': 'docx',
+                    'path': doc_path
+                })
+
+            if file_format in ["pdf", "both"]:
+                pdf_filename = base_name + ".pdf"
+                pdf_path = os.path.join(output_folder, pdf_filename)
+                if doc_path:
+                    with stage_timer('convert'):
+                        get_pdf_converter().convert(doc_path, pdf_path)
+                else:
+                    convert_docx_bytes(docx_bytes, pdf_path)
+
+                generated_files.append({
+                    'name': display_name,
+                    'filename': pdf_filename,
+                    'type': document_type,
+                    'format': 'pdf',
+                    'path': pdf_path
+                })
+
+        else:
+            return False, f"Unsupported document type: {document_type}"
+
+        if on_row:
+            on_row(1, generated_files, None)
+        return True, generated_files
+
+    except Exception as e:
+        return False, str(e)
+
+# ---------------------- Certificate Generator ----------------------
+CERTIFICATE_EXTENSIONS = {'png': 'png', 'jpeg': 'jpg', 'webp': 'webp'}
+
+# Where each text field goes on a certificate. A SCHEMA_FOLDER/certificate.json
+# with the same shape replaces it, e.g. to add the date and student ID:
+#
+#   {"fields": [
+#       {"column": "Name", "y": 600, "size": 80, "fill": "orange", "manual": "student_name"},
+#       {"column": "cur_date", "y": 0.8, "size": 36},
+#       {"column": "Student ID", "x": 0.92, "y": 0.9, "size": 28, "align": "right", "manual": "student_id"}]}
+#
+# x and y are pixels, or fractions of the template up to 1.0. Wide text shrinks
+# to min_size; "manual" names the form field, the first field names the file.
+CERTIFICATE_LAYOUT = {
+    'fields': [
+        {'column': 'Name', 'y': 600, 'size': 80, 'font': 'arialbd.ttf', 'fill': 'orange', 'manual': 'student_name'},
+    ],
+}
+
+_layout_memo = {}  # mtime of SCHEMA_FOLDER/certificate.json (None when missing) -> layout
+
+def certificate_layout(font_path=None, font_size=None):
+    """The certificate layout, optionally with another font for the first field"""
+    path = os.path.join(app.config['SCHEMA_FOLDER'], 'certificate.json')
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime not in _layout_memo:
+        layout = CERTIFICATE_LAYOUT
+        if mtime is not None:
+            try:
+                with open(path, encoding='utf-8') as f:
+                    loaded = json.load(f)
+                fields = loaded.get('fields') if isinstance(loaded, dict) else None
+                if not fields or not all(isinstance(field, dict) and 'column' in field and 'y' in field
+                                         for field in fields):
+                    raise ValueError("'fields' must list objects with a column and a y position")
+                layout = loaded
+            except (OSError, ValueError) as e:
+                app.logger.warning("Ignoring certificate layout %s: %s", path, e)
+        _layout_memo.clear()
+        _layout_memo[mtime] = layout
+    layout = _layout_memo[mtime]
+    if font_path or font_size:
+        first = dict(layout['fields'][0])
+        first.update({key: value for key, value in (('font', font_path), ('size', font_size)) if value})
+        layout = dict(layout, fields=[first] + layout['fields'][1:])
+    return layout
+
+@functools.lru_cache(maxsize=128)
+def load_font(font_path, font_size):
+    """Load a TrueType font once per (path, size), falling back to the default font"""
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except:
+        return ImageFont.load_default()
+
+class GlyphMetrics:
+    """Advance widths of one font, measured once per character; widths() sizes many texts in one numpy pass"""
+
+    def __init__(self, font):
+        self.font = font
+        self._advances = {}
+
+    def advance(self, char):
+        width = self._advances.get(char)
+        if width is None:
+            width = self._advances[char] = self.font.getlength(char)
+        return width
+
+    def widths(self, texts):
+        lengths = np.fromiter(map(len, texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+        chars, inverse = np.unique(codes, return_inverse=True)
+        advances = np.array([self.advance(chr(code)) for code in chars], dtype=np.float64)
+        ends = np.cumsum(lengths)
+        starts = ends - lengths
+        totals = np.concatenate(([0.0], np.cumsum(advances[inverse])))
+        widths = totals[ends] - totals[starts]
+        # Combining marks don't add up per character; measure those texts whole
+        marks = np.array([unicodedata.category(chr(code)).startswith('M') for code in chars], dtype=bool)
+        if marks.any():
+            marked = np.concatenate(([0], np.cumsum(marks[inverse])))
+            for i in np.flatnonzero(marked[ends] - marked[starts]):
+                widths[i] = self.font.getlength(texts[i])
+        return widths
+
+@functools.lru_cache(maxsize=32)
+def glyph_metrics(font_path, font_size):
+    return GlyphMetrics(load_font(font_path, font_size))
+
+def _layout_position(value, extent):
+    """Pixels, or a fraction of the template's width/height for floats up to 1.0"""
+    if isinstance(value, float) and 0 <= value <= 1:
+        return value * extent
+    return float(value)
+
+class TextField:
+    """One field of a certificate layout, resolved against the template's size"""
+
+    def __init__(self, spec, width, height):
+        self.column = spec['column']
+        self.manual = spec.get('manual')
+        self.size = int(spec.get('size', 80))
+        self.min_size = int(spec.get('min_size', max(self.size // 2, 1)))
+        self.font_path = spec.get('font', 'arialbd.ttf')
+        self.fill = spec.get('fill', 'black')
+        self.align = spec.get('align', 'center')
+        if self.align not in ('center', 'left', 'right'):
+            raise ValueError(f"Unknown alignment '{self.align}' for {self.column}")
+        self.x = _layout_position(spec.get('x', 0.5), width)
+        self.y = _layout_position(spec['y'], height)
+        self.max_width = _layout_position(spec.get('max_width', 0.9), width)
+        self.metrics = glyph_metrics(self.font_path, self.size)
+
+class CertificateLayout:
+    """Places the text fields of many certificates at once, shrinking wide texts by SIZE_STEP"""
+    SIZE_STEP = 2
+
+    def __init__(self, spec, width, height):
+        self.fields = [TextField(field, width, height) for field in spec['fields']]
+
+    @property
+    def columns(self):
+        return [field.column for field in self.fields]
+
+    def place(self, rows):
+        """[(field, text, x, y, size), ...] for each row of field texts"""
+        placements = [[] for _ in rows]
+        for position, field in enumerate(self.fields):
+            texts = [row[position] for row in rows]
+            widths = field.metrics.widths(texts)
+            fitted = field.size * field.max_width / np.maximum(widths, 1e-9)
+            sizes = np.where(fitted >= field.size, field.size,
+                             np.clip(np.floor(fitted / self.SIZE_STEP) * self.SIZE_STEP, field.min_size, field.size))
+            scaled = widths * sizes / field.size
+            if field.align == 'center':
+                xs = field.x - scaled / 2
+            elif field.align == 'right':
+                xs = field.x - scaled
+            else:
+                xs = np.full(len(texts), field.x)
+            # A shrunk line keeps its middle where the full-size line would be
+            ys = field.y + (field.size - sizes) / 2
+            for i, text in enumerate(texts):
+                if text:
+                    placements[i].append((position, text, float(xs[i]), float(ys[i]), int(sizes[i])))
+        return placements
+
+def laid_out_rows(rows, layout, chunk_size=256):
+    """(index, texts) rows -> (index, (texts, placements)), laying out chunk_size rows per pass"""
+    rows = iter(rows)
+    for chunk in iter(lambda: list(itertools.islice(rows, chunk_size)), []):
+        for (index, texts), placed in zip(chunk, layout.place([texts for _, texts in chunk])):
+            yield index, (texts, placed)
+
+class CertificateRenderer:
+    """Draws text fields onto a copy of a certificate template decoded only once"""
+
+    def __init__(self, template_file, layout=None, output_format='png', compress_level=1, quality=90):
+        if output_format not in CERTIFICATE_EXTENSIONS:
+            raise ValueError(f"Unsupported certificate format: {output_format}")
+        base = Image.open(template_file)
+        base.load()
+        if output_format == 'jpeg' and base.mode not in ('RGB', 'L'):
+            base = base.convert('RGB')  # JPEG has no alpha channel
+        self.base = base
+        self.layout_spec = layout or certificate_layout()
+        self.layout = CertificateLayout(self.layout_spec, base.width, base.height)
+        self.output_format = output_format
+        self.extension = CERTIFICATE_EXTENSIONS[output_format]
+        self.compress_level = compress_level
+        self.quality = quality
+
+    def render(self, placements):
+        with stage_timer('draw'):
+            return self._draw(placements)
+
+    def _draw(self, placements):
+        certificate = self.base.copy()
+        draw = ImageDraw.Draw(certificate)
+        for position, text, x, y, size in placements:
+            field = self.layout.fields[position]
+            draw.text((x, y), text, fill=field.fill, font=load_font(field.font_path, size))
+        return certificate
+
+    def save_options(self):
+        if self.output_format == 'png':
+            return {'compress_level': self.compress_level}
+        if self.output_format == 'webp':
+            return {'quality': self.quality, 'method': 0}  # fastest encoder effort
+        return {'quality': self.quality}
+
+    def settings(self):
+        """Everything besides the template and texts that changes the output"""
+        return {
+            'layout': self.layout_spec,
+            'format': self.output_format,
+            'compress_level': self.compress_level,
+            'quality': self.quality,
+        }
+
+    def file_entry(self, name, output_folder):
+        output_filename = f"certificate_{safe_filename(name)}_{uuid.uuid4().hex[:8]}.{self.extension}"
+        return {
+            'name': name,
+            'filename': output_filename,
+            'type': 'certificate',
+            'format': self.extension,
+            'path': os.path.join(output_folder, output_filename)
+        }
+
+    def save(self, certificate, output_path):
+        with stage_timer('encode'):
+            certificate.save(output_path, self.output_format.upper(), **self.save_options())
+
+    def render_to_file(self, texts, output_folder):
+        """Render one certificate from its field texts and return its generated-file entry"""
+        entry = self.file_entry(texts[0], output_folder)
+        certificate = self.render(self.layout.place([texts])[0])
+        self.save(certificate, entry['path'])
+        save_thumbnail(certificate, thumbnail_path(entry['path']))
+        return entry
+
+_certificate_renderers = OrderedDict()
+_certificate_renderers_lock = threading.Lock()
+
+def get_certificate_renderer(template_file, layout=None):
+    """Return a cached CertificateRenderer for this template content and layout"""
+    layout = layout or certificate_layout()
+    key = (file_digest(template_file), json.dumps(layout, sort_keys=True), app.config['CERTIFICATE_FORMAT'],
+           app.config['CERTIFICATE_PNG_COMPRESS_LEVEL'], app.config['CERTIFICATE_QUALITY'])
+    with _certificate_renderers_lock:
+        renderer = _certificate_renderers.get(key)
+        if renderer is not None:
+            _certificate_renderers.move_to_end(key)
+            return renderer
+
+    renderer = CertificateRenderer(template_file, layout, app.config['CERTIFICATE_FORMAT'],
+                                   app.config['CERTIFICATE_PNG_COMPRESS_LEVEL'], app.config['CERTIFICATE_QUALITY'])
+    with _certificate_renderers_lock:
+        _certificate_renderers[key] = renderer
+        while len(_certificate_renderers) > 8:
+            _certificate_renderers.popitem(last=False)
+    return renderer
+
+def _prepare_certificate_worker(options):
+    renderer = get_certificate_renderer(options['template'], options['layout'])
+    return dict(options, renderer=renderer, template_digest=file_digest(options['template']))
+
+def _certificate_row(state, row):
+    texts, placements = row
+    renderer = state['renderer']
+    entry = renderer.file_entry(texts[0], state['output_folder'])
+    key = output_cache.key(state['template_digest'], dict(renderer.settings(), texts=texts), renderer.extension)
+    entry['cached'] = output_cache.fetch(key, renderer.extension, entry['path'])
+    if not entry['cached']:
+        certificate = renderer.render(placements)
+        renderer.save(certificate, entry['path'])
+        cache_bytes = output_cache.store(key, renderer.extension, entry['path'])
+        if cache_bytes:
+            entry['cache_bytes'] = cache_bytes
+        if state.get('thumbnails', True):
+            save_thumbnail(certificate, thumbnail_path(entry['path']))
+    return [entry]
+
+def certificate_texts(layout, row, columns, issue_date):
+    """A roster row's text for every layout field, in field order"""
+    texts = []
+    for field, column in zip(layout['fields'], columns):
+        if column is None:
+            texts.append(issue_date if field['column'] == 'cur_date' else '')
+        else:
+            value = row[column] if column < len(row) else None
+            texts.append('' if value is None else str(value).strip())
+    return texts
+
+def generate_certificates(excel_file, template_file, output_folder, font_path=None, font_size=None,
+                          on_row=None, previous_files=None, combine=False, issue_date=None):
+    """Generate certificates; with `combine` they become the pages of one PDF"""
+    try:
+        layout = certificate_layout(font_path, font_size)
+        rows = iter_roster_rows(excel_file)
+        header = [str(value).strip() if value is not None else '' for value in next(rows, None) or ()]
+        columns = []
+        for field in layout['fields']:
+            if field['column'] in header:
+                columns.append(header.index(field['column']))
+            elif field['column'] == 'cur_date':
+                columns.append(None)
+            else:
+                return False, f"The roster needs a '{field['column']}' column"
+        if not os.path.exists(output_folder):
+            os.makedirs(output_folder)
+
+        options = {
+            'template': template_file,
+            'output_folder': output_folder,
+            'layout': layout,
+        }
+        issue_date = issue_date_text(issue_date)
+        texts = ((index, certificate_texts(layout, row, columns, issue_date))
+                 for index, row in enumerate(rows, start=2))
+        # The first field names the certificate, so rows without it are skipped
+        rows = laid_out_rows(((index, row) for index, row in texts if row[0]),
+                             get_certificate_renderer(template_file, layout).layout)
+
+        # The name is the row key; every field's text goes into the fingerprint
+        settings = (file_digest(template_file), layout, app.config['CERTIFICATE_FORMAT'],
+                    app.config['CERTIFICATE_PNG_COMPRESS_LEVEL'], app.config['CERTIFICATE_QUALITY'])
+        identify = lambda row: (row[0][0], row_fingerprint(settings, row[0]))
+        if combine:
+            return combine_certificates(rows, options, on_row)
+        return batch_result(*run_batch(_certificate_row, rows, _prepare_certificate_worker, options, on_row,
+                                       identify, previous_files))
+    except Exception as e:
+        return False, str(e)
+
+def combine_certificates(rows, options, on_row=None):
+    """Render every certificate into staging and pack them into one PDF, a page each"""
+    staged = []
+    with tempfile.TemporaryDirectory() as staging_directory:
+        _, errors, _ = run_batch(_certificate_row, rows, _prepare_certificate_worker,
+                              dict(options, output_folder=staging_directory, thumbnails=False),
+                              staging_on_row(staged, on_row))
+        if not staged:
+            return batch_result([], errors, 0)
+        pdf_path = os.path.join(options['output_folder'], f"Certificates_Cohort_{uuid.uuid4().hex[:8]}.pdf")
+        with stage_timer('pack'):
+            write_image_pdf(staged, pdf_path, app.config['COHORT_PDF_DPI'])
+        # The first page is the first staged certificate
+        with Image.open(staged[0]) as first_page:
+            save_thumbnail(first_page, thumbnail_path(pdf_path))
+    generated_files = [cohort_entry(f"Certificates ({len(staged)} students)", 'certificate', pdf_path)]
+    if on_row:
+        on_row(None, generated_files, None)
+    return True, generated_files
+
+# ---------------------- Schema Documents ----------------------
+def _schema_row(state, row):
+    projector = state['projector']
+    document_type = state['document_type']
+    return render_docx_outputs(state, projector(row), projector.base_name(document_type, row),
+                               projector.display_name(row), document_type)
+
+def generate_docx_documents(document_type, excel_file, template_file, option, on_row=None, previous_files=None,
+                            output_root=None, combine=False, issue_date=None):
+    """Generate a DOCX/PDF per roster row; with `combine` one for the whole roster"""
+    projector = compile_projector(document_type, template_file, excel_file, issue_date)
+    docx_folder, pdf_folder = projector.schema['directories']
+    docx_directory = os.path.join(output_root or app.config['GENERATED_FOLDER'], docx_folder)
+    pdf_directory = os.path.join(output_root or app.config['GENERATED_FOLDER'], pdf_folder)
+
+    os.makedirs(docx_directory, exist_ok=True)
+    os.makedirs(pdf_directory, exist_ok=True)
+
+    options = {
+        'template': template_file,
+        'option': option,
+        'docx_directory': docx_directory,
+        'pdf_directory': pdf_directory,
+        'document_type': document_type,
+        'projector': projector,
+        'pdf_converter': pdf_converter_name(),
+        'pdf_from_bytes': pdf_converter_takes_bytes(),
+    }
+    rows = ((index, row) for index, row in iter_roster_records(excel_file) if projector.complete(row))
+
+    # The fingerprint covers what the worker renders from (the projected
+    # context, so cur_date and the schema mapping count) and what it names
+    settings = (file_digest(template_file), option, options['pdf_converter'])
+    identify = lambda row: (projector.key(row), row_fingerprint(settings, projector(row), projector.display_name(row)))
+    with tempfile.TemporaryDirectory() as staging_directory:
+        options['staging_directory'] = staging_directory
+        if combine:
+            return combine_docx_documents(projector.schema, rows, options, on_row)
+        return batch_result(*run_batch(_schema_row, rows, _prepare_docx_worker, options, on_row,
+                                       identify, previous_files))
+
+def combine_docx_documents(schema, rows, options, on_row=None):
+    """Render every row into staging, merge them into one DOCX and convert that once"""
+    staged = []
+    row_options = dict(options, option='doc', docx_directory=options['staging_directory'])
+    _, errors, _ = run_batch(_schema_row, rows, _prepare_docx_worker, row_options, staging_on_row(staged, on_row))
+    if not staged:
+        return batch_result([], errors, 0)
+
+    stem = f"{safe_filename(schema['label'])}_Cohort_{uuid.uuid4().hex[:8]}"
+    name = f"{schema['label']} cohort ({len(staged)} students)"
+    option = options['option']
+    docx_directory = options['docx_directory'] if option in ('doc', 'both') else options['staging_directory']
+    docx_path = os.path.join(docx_directory, stem + '.docx')
+    with stage_timer('merge'):
+        merge_docx(staged, docx_path)
+    generated_files = [cohort_entry(name, options['document_type'], docx_path)] if option in ('doc', 'both') else []
+
+    error = None
+    if option in ('pdf', 'both'):
+        pdf_path = os.path.join(options['pdf_directory'], stem + '.pdf')
+        with stage_timer('convert_batch'):
+            error = get_pdf_converter().convert_many([(docx_path, pdf_path)]).get(docx_path)
+        if error is None:
+            generated_files.append(cohort_entry(name, options['document_type'], pdf_path))
+    if on_row:
+        on_row(None, generated_files, error)
+    if error:
+        return False, f"Converting the cohort document failed: {error}"
+    return True, generated_files
+
+# ---------------------- Associate Degree Functions ----------------------
+def AssociateExcel_data(filename):
+    return list(iter_roster_rows(filename))
+
+def AssociateContext(student):
+    return ContextProjector(DOCUMENT_SCHEMAS['associate'])(student)
+
+def AssociateBaseName(student):
+    return ContextProjector(DOCUMENT_SCHEMAS['associate']).base_name('associate', student)
+
+def AssociateDocument(template, output_directory, student):
+    docx_bytes = render_docx(template, AssociateContext(student))
+    doc_name = os.path.join(output_directory, AssociateBaseName(student) + ".docx")
+    return write_bytes(doc_name, docx_bytes)
+
+def AssociateConvertPDF(doc_path, pdf_directory):
+    pdf_filename = os.path.splitext(os.path.basename(doc_path))[0] + ".pdf"
+    pdf_path = os.path.join(pdf_directory, pdf_filename)
+    get_pdf_converter().convert(doc_path, pdf_path)
+    return pdf_path
+
+def generate_associate_documents(excel_file, template_file, option, on_row=None, previous_files=None, output_root=None,
+                                 combine=False, issue_date=None):
+    """Generate associate documents with file tracking"""
+    return generate_docx_documents('associate', excel_file, template_file, option, on_row, previous_files, output_root,
+                                   combine, issue_date)
+
+# ---------------------- Transcript Functions ----------------------
+def TranscriptExcel_data(filename):
+    return list(iter_roster_rows(filename))
+
+def TranscriptContext(row_data):
+    return ContextProjector(DOCUMENT_SCHEMAS['transcript'])(row_data)
+
+def TranscriptBaseName(row_data):
+    return ContextProjector(DOCUMENT_SCHEMAS['transcript']).base_name('transcript', row_data)
+
+def TranscriptDocument(template, output_directory, row_data):
+    docx_bytes = render_docx(template, TranscriptContext(row_data))
+    doc_name = os.path.join(output_directory, TranscriptBaseName(row_data) + ".docx")
+    return write_bytes(doc_name, docx_bytes)
+
+def TranscriptPdf(doc_path, pdf_directory):
+    pdf_filename = os.path.splitext(os.path.basename(doc_path))[0] + ".pdf"
+    pdf_path = os.path.join(pdf_directory, pdf_filename)
+    get_pdf_converter().convert(doc_path, pdf_path)
+    return pdf_path
+
+def generate_transcripts(excel_file, template_file, option, on_row=None, previous_files=None, output_root=None,
+                         combine=False, issue_date=None):
+    """Generate transcripts with file tracking"""
+    return generate_docx_documents('transcript', excel_file, template_file, option, on_row, previous_files, output_root,
+                                   combine, issue_date)
@@ -0,0 +1,480 @@
+"""Background job queue, job set-up and retention"""
+import os
+import uuid
+import threading
+import functools
+import time
+import cProfile
+import pstats
+from collections import deque
+
+from . import app
+from .lazy import openpyxl
+from .metrics import StageTimings, _stage_local
+from .rendering import write_bytes
+from .thumbnails import thumbnail_path
+from .rosters import ContextProjector, get_document_schema
+from .generators import (
+    certificate_layout, generate_associate_documents, generate_certificates, generate_docx_documents,
+    generate_transcripts)
+from .serving import gzip_variant_path
+from .store import FileStore, file_store
+
+# ---------------------- Job Queue ----------------------
+class JobQuotaExceeded(Exception):
+    """A job wrote more output than RETENTION_JOB_MAX_BYTES allows"""
+
+class Job:
+    """Progress of one background generation run, mirrored into the file store"""
+
+    def __init__(self, document_type, total=None, job_id=None, uploads=(), template=None):
+        self.id = job_id or str(uuid.uuid4())
+        self.document_type = document_type
+        self.status = 'queued'
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.cached = 0
+        self.carried = 0
+        self.bytes = 0
+        self.uploads = list(uploads)
+        self.template = template  # registry template path, kept from retention while the job is unfinished
+        self.timings = StageTimings()
+        self.stages = {}  # timings.summary() once the job has finished
+        self.profile = None  # profiler report, for jobs submitted with profile=True
+        self.errors = []
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_record(cls, record):
+        job = cls(record['document_type'], record['total'], record['id'], record['uploads'])
+        for field in FileStore.JOB_FIELDS:
+            setattr(job, field, record[field])
+        job.errors = record['errors']
+        job.stages = record['stages']
+        return job
+
+    def save(self):
+        with self._lock:
+            file_store.save_job(self)
+
+    def record_row(self, index, files, error):
+        """on_row callback; index None (a cohort document) doesn't count as a row"""
+        with self._lock:
+            if index is not None:
+                self.done += 1
+            if error:
+                self.failed += 1
+                self.errors.append({'row': index, 'error': error})
+            self.cached += sum(1 for f in files if f.get('cached'))
+            self.carried += sum(1 for f in files if f.get('carried'))
+            sizes = [os.path.getsize(f['path']) if os.path.exists(f['path']) else 0 for f in files]
+            # Carried files belong to the earlier job and don't count against this one
+            self.bytes += sum(size for f, size in zip(files, sizes) if not f.get('carried'))
+            file_store.record(self, files, sizes)
+        quota = app.config['RETENTION_JOB_MAX_BYTES']
+        if quota and self.bytes > quota:
+            raise JobQuotaExceeded(f"Stopped after {self.done} rows: the job's output passed "
+                                   f"the per-job limit of {quota:,} bytes")
+
+    def to_dict(self, since=0, limit=None):
+        elapsed = ((self.finished or time.time()) - self.started) if self.started else 0
+        throughput = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if self.status == 'running' and self.total and throughput:
+            eta = max(self.total - self.done, 0) / throughput
+        formats = file_store.format_counts(self.id)
+        return {
+            'id': self.id,
+            'status': self.status,
+            'document_type': self.document_type,
+            'rows_done': self.done,
+            'rows_total': self.total,
+            'rows_failed': self.failed,
+            'throughput': round(throughput, 2),
+            'eta_seconds': round(eta, 1) if eta is not None else None,
+            'elapsed_seconds': round(elapsed, 1),
+            'file_count': sum(formats.values()),
+            'format_counts': formats,
+            'cached_files': self.cached,
+            'carried_files': self.carried,
+            'files': file_store.files(self.id, offset=since, limit=limit) if limit != 0 else [],
+            'errors': self.errors[:20],
+            'error': self.error,
+            'stages': self.stages,
+            'profile': bool(self.profile),
+        }
+
+class JobQueueFull(Exception):
+    """More jobs are already waiting than JOB_QUEUE_LIMIT allows"""
+
+def host_available_memory():
+    """MemAvailable from /proc/meminfo in bytes, or None where it can't be read"""
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+class JobQueue:
+    """In-process job broker with admission control.
+
+    At most `workers` jobs run at once and `limit` wait (then submit() raises
+    JobQueueFull); a waiting job starts only with `min_available` bytes free.
+    """
+
+    def __init__(self, workers=2, limit=0, min_available=0, heartbeat_timeout=900):
+        self.workers = workers
+        self.limit = limit
+        self.min_available = min_available
+        self.heartbeat_timeout = heartbeat_timeout
+        self._waiting = deque()
+        self._running = 0
+        self._active = {}  # job id -> Job, for jobs running in this process
+        self._threads = []
+        self._cond = threading.Condition()
+
+    def full(self):
+        with self._cond:
+            return bool(self.limit) and len(self._waiting) >= self.limit
+
+    def submit(self, target, args, document_type, total=None, kwargs=None, job_id=None, uploads=(), profile=False,
+               template=None):
+        retention_sweeper.start()
+        with self._cond:
+            if self.limit and len(self._waiting) >= self.limit:
+                raise JobQueueFull(f"{len(self._waiting)} jobs are already waiting to run")
+            job = Job(document_type, total, job_id, uploads, template)
+            job.save()
+            self._waiting.append((job, target, args, kwargs or {}, profile))
+            self._start()
+            self._cond.notify()
+        return job
+
+    def stats(self):
+        with self._cond:
+            return {'running': self._running, 'waiting': len(self._waiting), 'limit': self.limit}
+
+    def cancel(self, job_id):
+        """Fail a job still waiting in this process; False once it has started or lives elsewhere"""
+        with self._cond:
+            item = next((item for item in self._waiting if item[0].id == job_id), None)
+            if item is None:
+                return False
+            self._waiting.remove(item)
+        job = item[0]
+        job.status = 'failed'
+        job.error = 'Cancelled before it started'
+        job.finished = time.time()
+        job.save()
+        return True
+
+    def _start(self):
+        # Runner threads start on first use in each process (threads don't survive fork)
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._loop, name=f'job-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def _admissible(self):
+        if not self._waiting:
+            return False
+        if not self._running or not self.min_available:
+            return True
+        available = host_available_memory()
+        return available is None or available >= self.min_available
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._admissible():
+                    self._cond.wait(timeout=1)  # memory frees up without telling anyone
+                item = self._waiting.popleft()
+                self._running += 1
+                self._active[item[0].id] = item[0]
+            try:
+                self._run(*item)
+            except Exception:
+                app.logger.exception("Job %s crashed", item[0].id)
+            finally:
+                with self._cond:
+                    self._running -= 1
+                    self._active.pop(item[0].id, None)
+                    self._cond.notify_all()
+
+    def heartbeat(self):
+        """Keep this process's waiting and running jobs from being taken for lost"""
+        with self._cond:
+            job_ids = [job.id for job, *_ in self._waiting] + list(self._active)
+        if job_ids:
+            file_store.heartbeat(job_ids)
+
+    def get(self, job_id):
+        record = file_store.get_job(job_id)
+        if (record and record['status'] in ('queued', 'running')
+                and (record['heartbeat'] or record['created']) < time.time() - self.heartbeat_timeout):
+            # Its process is gone; report it as failed instead of polling forever
+            file_store.fail_lost_jobs(self.heartbeat_timeout)
+            record = file_store.get_job(job_id)
+        return Job.from_record(record) if record else None
+
+    def _run(self, job, target, args, kwargs, profile=False):
+        job.status = 'running'
+        job.started = time.time()
+        job.save()
+        _stage_local.job = job.timings
+        try:
+            if profile:
+                (success, result), job.profile = profile_call(
+                    job_output_root(job.id), functools.partial(target, *args, on_row=job.record_row, **kwargs))
+            else:
+                success, result = target(*args, on_row=job.record_row, **kwargs)
+        except Exception as e:
+            success, result = False, str(e)
+        finally:
+            _stage_local.job = None
+        if not success:
+            job.error = result
+        job.total = job.done
+        job.finished = time.time()
+        job.status = 'done' if success else 'failed'
+        job.stages = job.timings.summary()
+        job.save()
+
+job_queue = JobQueue(app.config['JOB_WORKERS'], app.config['JOB_QUEUE_LIMIT'], app.config['JOB_MIN_AVAILABLE_MEMORY'],
+                     app.config['JOB_HEARTBEAT_TIMEOUT'])
+
+def profile_call(folder, fn):
+    """Run `fn`, with its batch rows in this thread, under the configured profiler; returns (result, report)"""
+    os.makedirs(folder, exist_ok=True)
+    _stage_local.serial = True
+    try:
+        if app.config['PROFILER'] == 'pyinstrument':
+            try:
+                from pyinstrument import Profiler
+            except ImportError:
+                app.logger.warning("pyinstrument is not installed; profiling with cProfile")
+            else:
+                profiler = Profiler()
+                profiler.start()
+                try:
+                    result = fn()
+                finally:
+                    profiler.stop()
+                    report = os.path.join(folder, 'profile.html')
+                    write_bytes(report, profiler.output_html().encode('utf-8'))
+                return result, report
+
+        profiler = cProfile.Profile()
+        try:
+            result = profiler.runcall(fn)
+        finally:
+            report = os.path.join(folder, 'profile.txt')
+            with open(report, 'w', encoding='utf-8') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(60)
+        return result, report
+    finally:
+        _stage_local.serial = False
+
+def roster_job(document_type, roster_path, template_path, file_format, output_root, combine=False, issue_date=None):
+    """(target, args, kwargs) for a job generating `document_type` from a roster file"""
+    kwargs = {'combine': True} if combine else {}
+    if issue_date:
+        kwargs['issue_date'] = issue_date
+    if document_type == 'certificate':
+        return generate_certificates, (roster_path, template_path, os.path.join(output_root, 'Certificates')), kwargs
+    kwargs['output_root'] = output_root
+    if document_type == 'transcript':
+        return generate_transcripts, (roster_path, template_path, file_format), kwargs
+    if document_type == 'associate':
+        return generate_associate_documents, (roster_path, template_path, file_format), kwargs
+    return generate_docx_documents, (document_type, roster_path, template_path, file_format), kwargs
+
+def estimate_row_count(excel_file):
+    """Cheap data-row count for progress reporting (None when unknown)"""
+    try:
+        if excel_file.lower().endswith(('.csv', '.jsonl')):
+            with open(excel_file, 'rb') as f:
+                lines = sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1024 * 1024), b''))
+            return max(lines - 1, 0)
+        workbook = openpyxl.load_workbook(excel_file, read_only=True)
+        rows = workbook.active.max_row
+        workbook.close()
+        return max(rows - 1, 0) if rows else None
+    except Exception:
+        return None
+
+def roster_problem(document_type, header, variables=None):
+    """Why a roster with this header row can't be used for `document_type`, or None"""
+    header = [str(value).strip() if value is not None else '' for value in header]
+    if document_type == 'certificate':
+        missing = [field['column'] for field in certificate_layout()['fields']
+                   if field['column'] != 'cur_date' and field['column'] not in header]
+        return f"The roster needs a '{missing[0]}' column" if missing else None
+    try:
+        projector = ContextProjector(get_document_schema(document_type), header,
+                                     set() if variables is None else variables)
+    except ValueError as e:
+        return str(e)
+    beyond = sorted((position, variable) for variable, position in projector.columns.items()
+                    if position >= len(header))
+    if beyond:
+        return (f"The roster has {len(header)} columns, but '{beyond[-1][1]}' is read from column "
+                f"{beyond[-1][0] + 1}")
+    return None
+
+# ---------------------- Retention ----------------------
+def job_output_root(job_id):
+    """Per-job output directory, sharded on the id prefix to keep directories small"""
+    return os.path.join(app.config['GENERATED_FOLDER'], 'jobs', job_id[:2], job_id)
+
+class RetentionSweeper:
+    """Background thread that deletes job outputs, uploads and unused templates.
+
+    Finished jobs go after the store's TTL, past `max_bytes` (oldest first) or
+    on /cleanup, which waits for an unfinished job to end.
+    """
+
+    def __init__(self, store, interval=300, max_bytes=0, upload_max_age=24 * 3600, template_max_age=7 * 24 * 3600,
+                 batch_size=500):
+        self.store = store
+        self.interval = interval
+        self.max_bytes = max_bytes
+        self.upload_max_age = upload_max_age
+        self.template_max_age = template_max_age
+        self.batch_size = batch_size
+        self._requested = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._stats = {'sweeps': 0, 'jobs_removed': 0, 'files_removed': 0,
+                       'uploads_removed': 0, 'templates_removed': 0, 'bytes_reclaimed': 0, 'last_sweep': None}
+
+    def start(self):
+        """Start the sweeper thread once per process (threads don't survive fork)"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='retention', daemon=True)
+                self._thread.start()
+
+    def schedule(self, session_id):
+        """Remove a session's files on the next pass, which starts right away"""
+        with self._lock:
+            self._requested.add(session_id)
+        self.start()
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            try:
+                self.sweep()
+            except Exception:
+                app.logger.exception("Retention sweep failed")
+
+    def sweep(self):
+        # Jobs whose process died are failed here and then expire like any other
+        job_queue.heartbeat()
+        self.store.fail_lost_jobs(job_queue.heartbeat_timeout)
+        with self._lock:
+            requested, self._requested = self._requested, set()
+        unfinished = {session_id for session_id in requested
+                      if self.store.job_status(session_id) in ('queued', 'running')}
+        if unfinished:
+            with self._lock:
+                self._requested |= unfinished
+        # Before the sessions go, while the store still lists their uploads
+        self.sweep_uploads()
+        for session_id in (requested - unfinished) | set(self.store.expired()):
+            self.remove_session(session_id)
+        while self.max_bytes and self.store.total_bytes() > self.max_bytes:
+            session_id = self.store.oldest_finished()
+            if session_id is None:
+                break
+            self.remove_session(session_id)
+        self.sweep_templates()
+        with self._lock:
+            self._stats['sweeps'] += 1
+            self._stats['last_sweep'] = time.time()
+
+    def remove_session(self, session_id):
+        paths = self.store.delete(session_id)
+        root = job_output_root(session_id)
+        paths += [variant(path) for path in paths for variant in (thumbnail_path, gzip_variant_path)]
+        paths += [os.path.join(root, name) for name in ('profile.txt', 'profile.html')]
+        self._unlink(paths, 'files_removed')
+        self._prune([os.path.dirname(path) for path in paths] + [directory for directory, _, _ in os.walk(root)])
+        with self._lock:
+            self._stats['jobs_removed'] += 1
+
+    def sweep_uploads(self):
+        for session_id, uploads in self.store.finished_uploads():
+            self._unlink(uploads, 'uploads_removed')
+            self.store.clear_uploads(session_id)
+        # Uploads of jobs that were never submitted (failed validation) and
+        # chunked uploads that were abandoned or never used
+        folder = app.config['UPLOAD_FOLDER']
+        cutoff = time.time() - self.upload_max_age
+        self.store.forget_uploads(cutoff)
+        live = {os.path.abspath(path) for path in self.store.live_uploads()}
+        with os.scandir(folder) as entries:
+            stray = [entry.path for entry in entries
+                     if entry.is_file() and entry.stat().st_mtime < cutoff and os.path.abspath(entry.path) not in live]
+        self._unlink(stray, 'uploads_removed')
+
+    def sweep_templates(self):
+        stale = self.store.stale_templates(time.time() - self.template_max_age)
+        for template_id, _ in stale:
+            self.store.delete_template(template_id)
+        self._unlink([path for _, path in stale], 'templates_removed')
+
+    def _unlink(self, paths, counter):
+        removed = reclaimed = 0
+        for start in range(0, len(paths), self.batch_size):
+            for path in paths[start:start + self.batch_size]:
+                try:
+                    stat = os.stat(path)
+                    os.remove(path)
+                except FileNotFoundError:
+                    continue
+                removed += 1
+                # Hard links into the output cache free nothing
+                if stat.st_nlink == 1:
+                    reclaimed += stat.st_size
+            time.sleep(0.01)
+        with self._lock:
+            self._stats[counter] += removed
+            self._stats['bytes_reclaimed'] += reclaimed
+
+    def _prune(self, directories):
+        """Remove directories left empty, climbing up to the jobs folder"""
+        stop = os.path.abspath(os.path.join(app.config['GENERATED_FOLDER'], 'jobs'))
+        for directory in sorted({os.path.abspath(d) for d in directories}, key=len, reverse=True):
+            while directory.startswith(stop + os.sep):
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    break  # gone already, or still holds files carried into a later job
+                directory = os.path.dirname(directory)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, stored_bytes=self.store.total_bytes())
+
+retention_sweeper = RetentionSweeper(
+    file_store,
+    interval=app.config['RETENTION_INTERVAL'],
+    max_bytes=app.config['RETENTION_MAX_BYTES'],
+    upload_max_age=app.config['RETENTION_UPLOAD_MAX_AGE'],
+    template_max_age=app.config['RETENTION_TEMPLATE_MAX_AGE'],
+    batch_size=app.config['RETENTION_BATCH_SIZE'],
+)
@@ -0,0 +1,30 @@
+"""Heavy dependencies, imported on first use"""
+import importlib
+
+# ---------------------- Lazy Imports ----------------------
+# Only generation needs these, so they load on first use (or in warm_up()).
+class LazyModule:
+    """Stand-in for a heavy module, imported on first attribute access"""
+
+    def __init__(self, name):
+        self.name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self.name)
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self.load(), attribute)
+
+pd = LazyModule('pandas')
+np = LazyModule('numpy')
+openpyxl = LazyModule('openpyxl')
+docxtpl = LazyModule('docxtpl')
+docx2pdf = LazyModule('docx2pdf')
+Image = LazyModule('PIL.Image')
+ImageDraw = LazyModule('PIL.ImageDraw')
+ImageFont = LazyModule('PIL.ImageFont')
+# docx2pdf is left out: it is only used on Windows/macOS with Word
+GENERATION_MODULES = (pd, np, openpyxl, docxtpl, Image, ImageDraw, ImageFont)
@@ -0,0 +1,73 @@
+"""Per-process and per-job stage timings"""
+import threading
+import time
+import contextlib
+
+# ---------------------- Metrics ----------------------
+# Stage timers feed histograms per process and per job; pool workers ship
+# their rows' timings back with the results.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+class StageTimings:
+    """Cumulative histogram of durations per stage"""
+
+    def __init__(self, buckets=STAGE_BUCKETS):
+        self.buckets = buckets
+        self._stages = {}  # stage -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            counts = self._stages.get(stage)
+            if counts is None:
+                counts = self._stages[stage] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += seconds
+
+    def snapshot(self):
+        with self._lock:
+            return {stage: list(counts) for stage, counts in self._stages.items()}
+
+    def summary(self):
+        """Per-stage count, total and mean for job reports"""
+        return {stage: {'count': counts[-2],
+                        'total_seconds': round(counts[-1], 4),
+                        'mean_ms': round(counts[-1] / counts[-2] * 1000, 3) if counts[-2] else None}
+                for stage, counts in sorted(self.snapshot().items())}
+
+process_timings = StageTimings()
+_stage_local = threading.local()  # .row: timings buffered inside a batch row, .job: the job's StageTimings
+
+def record_stage(stage, seconds):
+    buffered = getattr(_stage_local, 'row', None)
+    if buffered is not None:
+        buffered.append((stage, seconds))
+        return
+    process_timings.observe(stage, seconds)
+    job_timings = getattr(_stage_local, 'job', None)
+    if job_timings is not None:
+        job_timings.observe(stage, seconds)
+
+@contextlib.contextmanager
+def stage_timer(stage):
+    """Time the enclosed block as one observation of `stage`"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+def timed_iter(iterable, stage):
+    """Yield from `iterable`, timing each step (e.g. reading a roster row)"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        record_stage(stage, time.perf_counter() - start)
+        yield item
@@ -0,0 +1,292 @@
+"""DOCX template parsing, caching and rendering"""
+import os
+import re
+import io
+import copy
+import hashlib
+import threading
+import zipfile
+import zlib
+import struct
+from jinja2 import Environment, TemplateError, nodes as jinja_nodes
+from collections import OrderedDict
+from xml.sax.saxutils import escape as xml_escape
+
+from . import app
+from .lazy import docxtpl
+from .metrics import stage_timer
+
+# ---------------------- Template Cache ----------------------
+_digest_memo = OrderedDict()  # (path, size, mtime) -> sha256
+_digest_lock = threading.Lock()
+
+def file_digest(path):
+    """Return the sha256 of a file, memoised on path, size and mtime"""
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _digest_lock:
+        digest = _digest_memo.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _digest_lock:
+            _digest_memo[key] = digest
+            while len(_digest_memo) > 256:
+                _digest_memo.popitem(last=False)
+    return digest
+
+class TemplateCache:
+    """Parse-once LRU cache of DOCX templates keyed by file content hash; callers render into a copy"""
+
+    def __init__(self, max_entries=16):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # digest -> (template bytes, pristine DocxTemplate)
+        self._variables = {}  # digest -> names the template references
+        self._compiled = OrderedDict()  # digest -> CompiledDocxTemplate, or None when it needs docxtpl
+        self._lock = threading.Lock()
+
+    def digest(self, template):
+        return file_digest(template)
+
+    def _get_entry(self, template):
+        digest = self.digest(template)
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is not None:
+                self._entries.move_to_end(digest)
+                return entry
+
+        with open(template, 'rb') as f:
+            data = f.read()
+        with stage_timer('template_parse'):
+            pristine = docxtpl.DocxTemplate(io.BytesIO(data))
+            pristine.init_docx()
+        entry = (data, pristine)
+
+        with self._lock:
+            self._entries[digest] = entry
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def load(self, template):
+        """Return a fresh DocxTemplate for `template` that is safe to render once"""
+        data, pristine = self._get_entry(template)
+        with stage_timer('template_load'):
+            doc = docxtpl.DocxTemplate(io.BytesIO(data))
+            doc.docx = copy.deepcopy(pristine.docx)
+        return doc
+
+    def variables(self, template):
+        """Names the template's placeholders reference, scanned once per version"""
+        digest = self.digest(template)
+        with self._lock:
+            names = self._variables.get(digest)
+        if names is None:
+            names = frozenset(self.load(template).get_undeclared_template_variables())
+            with self._lock:
+                self._variables[digest] = names
+        return names
+
+    def compiled(self, template):
+        """The template's CompiledDocxTemplate, or None when only docxtpl can render it"""
+        digest = self.digest(template)
+        with self._lock:
+            if digest in self._compiled:
+                self._compiled.move_to_end(digest)
+                return self._compiled[digest]
+
+        with open(template, 'rb') as f:
+            data = f.read()
+        with stage_timer('template_compile'):
+            try:
+                compiled = CompiledDocxTemplate(data)
+            except ValueError as e:
+                app.logger.info("%s uses docxtpl rendering: %s", template, e)
+                compiled = None
+
+        with self._lock:
+            self._compiled[digest] = compiled
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        return compiled
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._variables.clear()
+            self._compiled.clear()
+
+class CompiledDocxTemplate:
+    """A DOCX template whose parts only hold plain `{{ name }}` placeholders.
+
+    Rendering joins escaped values into precompiled XML fragments. Anything
+    richer raises ValueError, leaving the template on the docxtpl path.
+    """
+
+    PART = re.compile(r'word/(document|header\d*|footer\d*|footnotes)\.xml$')
+    MARKERS = ('{{', '{%', '{#')
+    SPECIAL_TAG = re.compile(r'\{\{(?:tr|tc|p|r)\s|\{\{\s*[rp]\s')
+    LISTING_CHARS = re.compile('[\t\a\n\f]')
+
+    def __init__(self, data):
+        self.members = []  # (member bytes, central record) or (None, (fragments, names, zip info))
+        self.names = set()
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            for info in archive.infolist():
+                if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                    raise ValueError(f"{info.filename} is encrypted or uses an unusual compression")
+                if max(info.file_size, info.compress_size, info.header_offset) >= 0xFFFFFFFF:
+                    raise ValueError("ZIP64 archives are not supported")
+                if self.PART.match(info.filename):
+                    xml = archive.read(info.filename).decode('utf-8')
+                    if any(marker in xml for marker in self.MARKERS) or re.search(r'\{(<[^>]*>)+[{%#]', xml):
+                        self.members.append((None, self._compile_part(info, xml)))
+                        continue
+                elif info.filename == 'docProps/core.xml':
+                    if any(marker in archive.read(info.filename).decode('utf-8') for marker in self.MARKERS):
+                        raise ValueError("document properties are templated")
+                self.members.append((self._copy_member(data, info), self._central_record(info)))
+        if not any(static is None for static, _ in self.members):
+            raise ValueError("no placeholders to fill")
+
+    def _compile_part(self, info, xml):
+        declared = re.match(r'<\?xml[^?]+\bencoding="([^"]+)"', xml, re.I)
+        if declared and declared.group(1).lower().replace('-', '') != 'utf8':
+            raise ValueError(f"{info.filename} is not UTF-8")
+        if self.SPECIAL_TAG.search(re.sub(r'<[^>]*>', '', xml)):
+            raise ValueError(f"{info.filename} uses paragraph/run/table tags")
+        source = docxtpl.DocxTemplate(None).patch_xml(xml)
+        fragments, names, text = [], [], []
+        try:
+            body = Environment().parse(source).body
+        except TemplateError as e:
+            raise ValueError(f"{info.filename} does not parse: {e}")
+        for node in body:
+            if not isinstance(node, jinja_nodes.Output):
+                raise ValueError(f"{info.filename} uses Jinja tags")
+            for child in node.nodes:
+                if isinstance(child, jinja_nodes.TemplateData):
+                    text.append(child.data)
+                elif isinstance(child, jinja_nodes.Name):
+                    fragments.append(self._unescape_markers(''.join(text)).encode('utf-8'))
+                    names.append(child.name)
+                    text = []
+                else:
+                    raise ValueError(f"{info.filename} uses Jinja expressions or filters")
+        fragments.append(self._unescape_markers(''.join(text)).encode('utf-8'))
+        self.names.update(names)
+        return fragments, names, info
+
+    @staticmethod
+    def _unescape_markers(xml):
+        # docxtpl's escapes for literal braces in the document
+        return xml.replace('{_{', '{{').replace('}_}', '}}').replace('{_%', '{%').replace('%_}', '%}')
+
+    @staticmethod
+    def _copy_member(data, info):
+        """Local header plus the member's compressed bytes, exactly as stored in the template"""
+        name_length, extra_length = struct.unpack('<HH', data[info.header_offset + 26:info.header_offset + 30])
+        start = info.header_offset + 30 + name_length + extra_length
+        return CompiledDocxTemplate._local_header(info, info.CRC, info.compress_size, info.file_size,
+                                                  info.compress_type) + data[start:start + info.compress_size]
+
+    @staticmethod
+    def _dos_time(info):
+        year, month, day, hour, minute, second = info.date_time
+        return (hour << 11) | (minute << 5) | (second // 2), ((year - 1980) << 9) | (month << 5) | day
+
+    @staticmethod
+    def _flags(info):
+        return info.flag_bits & 0x800  # keep the UTF-8 name flag, sizes always go in the local header
+
+    @staticmethod
+    def _local_header(info, crc, compressed, size, method):
+        name = info.filename.encode('utf-8' if info.flag_bits & 0x800 else 'cp437')
+        dos_time, dos_date = CompiledDocxTemplate._dos_time(info)
+        return struct.pack('<IHHHHHIIIHH', 0x04034b50, 20, CompiledDocxTemplate._flags(info), method,
+                           dos_time, dos_date, crc, compressed, size, len(name), 0) + name
+
+    @staticmethod
+    def _central_record(info, crc=None, compressed=None, size=None, method=None):
+        """Central directory entry up to (not including) its offset field, and its name"""
+        name = info.filename.encode('utf-8' if info.flag_bits & 0x800 else 'cp437')
+        dos_time, dos_date = CompiledDocxTemplate._dos_time(info)
+        head = struct.pack('<IHHHHHHIIIHHHHHI', 0x02014b50, 20, 20, CompiledDocxTemplate._flags(info),
+                           info.compress_type if method is None else method, dos_time, dos_date,
+                           info.CRC if crc is None else crc,
+                           info.compress_size if compressed is None else compressed,
+                           info.file_size if size is None else size,
+                           len(name), 0, 0, 0, info.internal_attr, info.external_attr)
+        return head, name
+
+    def render(self, context):
+        """The filled-in document as bytes, or None when a value needs docxtpl (tabs, breaks)"""
+        values = {}
+        for name in self.names:
+            value = str(context[name]) if name in context else ''  # as Jinja prints it
+            if self.LISTING_CHARS.search(value):
+                return None
+            values[name] = xml_escape(value, {'"': '&quot;'}).encode('utf-8')
+
+        out = io.BytesIO()
+        central = []
+        for static, compiled in self.members:
+            offset = out.tell()
+            if static is not None:
+                out.write(static)
+                head, name = compiled
+            else:
+                fragments, names, info = compiled
+                pieces = [fragments[0]]
+                for slot, fragment in zip(names, fragments[1:]):
+                    pieces += (values[slot], fragment)
+                xml = b''.join(pieces)
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+                body = compressor.compress(xml) + compressor.flush()
+                crc = zlib.crc32(xml)
+                out.write(self._local_header(info, crc, len(body), len(xml), zipfile.ZIP_DEFLATED))
+                out.write(body)
+                head, name = self._central_record(info, crc, len(body), len(xml), zipfile.ZIP_DEFLATED)
+            central.append(head + struct.pack('<I', offset) + name)
+
+        directory_offset = out.tell()
+        directory = b''.join(central)
+        out.write(directory)
+        out.write(struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, len(central), len(central), len(directory),
+                              directory_offset, 0))
+        return out.getvalue()
+
+docx_template_cache = TemplateCache(app.config['TEMPLATE_CACHE_SIZE'])
+
+# ---------------------- Rendering Helpers ----------------------
+def render_docx(template, context):
+    """Render a DOCX template once and return the finished document as bytes"""
+    compiled = docx_template_cache.compiled(template) if app.config['DOCX_FAST_PATH'] else None
+    if compiled is not None:
+        with stage_timer('render_fast'):
+            data = compiled.render(context)
+        if data is not None:
+            return data
+    doc = docx_template_cache.load(template)
+    with stage_timer('render'):
+        doc.render(context)
+    buffer = io.BytesIO()
+    with stage_timer('save'):
+        doc.save(buffer)
+    return buffer.getvalue()
+
+def write_bytes(path, data):
+    with stage_timer('write'), open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+UNSAFE_FILENAME_CHARACTERS = re.compile(r'[\s/\\&<>:"|?*\x00-\x1f\x7f]')
+
+def safe_filename(text):
+    # One path component, safe on every filesystem and in a Content-Disposition header
+    return UNSAFE_FILENAME_CHARACTERS.sub('_', str(text)).lstrip('.') or '_'
@@ -0,0 +1,220 @@
+"""Roster reading and the schemas mapping roster columns to template variables"""
+import os
+import re
+import uuid
+import json
+import csv
+from datetime import datetime
+
+from . import app
+from .lazy import openpyxl, pd
+from .rendering import docx_template_cache, safe_filename
+
+# ---------------------- Roster Reader ----------------------
+ROSTER_EXTENSIONS = ('.xlsx', '.xls', '.csv')
+
+CSV_NUMBER = re.compile(r'-?(0|[1-9][0-9]*)(\.[0-9]+)?')
+
+def _csv_value(value):
+    # Only canonical numbers become numbers; "007", "85.50" and "NaN" stay text
+    if value == '':
+        return None
+    if not CSV_NUMBER.fullmatch(value):
+        return value
+    number = float(value) if '.' in value else int(value)
+    return number if str(number) == value else value
+
+def _iter_raw_roster_rows(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.csv':
+        with open(filename, newline='', encoding='utf-8-sig') as f:
+            for row in csv.reader(f):
+                yield tuple(_csv_value(value) for value in row)
+    elif extension == '.jsonl':
+        # Records posted to the API, one JSON array per row, typed as they were sent
+        with open(filename, encoding='utf-8') as f:
+            for line in f:
+                yield tuple(json.loads(line))
+    elif extension == '.xls':
+        # Legacy .xls has no streaming reader; pandas loads it in one go
+        data = pd.read_excel(filename, header=None, dtype=object)
+        for row in data.itertuples(index=False, name=None):
+            yield tuple(None if pd.isna(value) else value for value in row)
+    else:
+        workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+        try:
+            for row in workbook.active.iter_rows(values_only=True):
+                yield row
+        finally:
+            workbook.close()
+
+def iter_roster_rows(filename):
+    """Lazily yield the rows of an .xlsx/.xls/.csv/.jsonl roster as tuples padded to the header width"""
+    width = None
+    for row in _iter_raw_roster_rows(filename):
+        if width is None:
+            width = len(row)
+        elif len(row) < width:
+            row = tuple(row) + (None,) * (width - len(row))
+        yield row
+
+def iter_roster_records(filename, skip_header=True):
+    """Yield (spreadsheet_row_number, row) pairs, skipping the header row"""
+    rows = iter_roster_rows(filename)
+    if skip_header:
+        next(rows, None)
+    return enumerate(rows, start=2 if skip_header else 1)
+
+# ---------------------- Document Schemas ----------------------
+# A schema maps template variables to roster columns (a 0-based position or a
+# header name). A new document type only needs SCHEMA_FOLDER/<type>.json:
+#
+#   {"label": "Internship Letter",
+#    "fields": {"name": "Full Name", "company": "Company", "weeks": 4},
+#    "display_name": ["name"], "row_key": ["name"], "required": ["name"]}
+TRANSCRIPT_COLUMNS = (
+    "student_id", "first_name", "last_name",
+    "logic", "l_g", "bcum", "bc_g", "design", "d_g", "p1", "p1_g", "e1", "e1_g",
+    "wd", "wd_g", "algo", "al_g", "p2", "p2_g", "e2", "e2_g", "sd", "sd_g",
+    "js", "js_g", "php", "ph_g", "db", "db_g", "vc1", "v1_g", "node", "no_g",
+    "e3", "e3_g", "p3", "p3_g", "oop", "op_g", "lar", "lar_g", "vue", "vu_g",
+    "vc2", "v2_g", "e4", "e4_g", "p4", "p4_g", "int", "in_g",
+)
+
+DOCUMENT_SCHEMAS = {
+    'transcript': {
+        'label': 'Transcript',
+        'fields': {name: position for position, name in enumerate(TRANSCRIPT_COLUMNS)},
+        'display_name': ['first_name', 'last_name'],
+        'row_key': ['student_id'],
+        'required': ['first_name', 'last_name'],
+        'directories': ['Transcript_Doc', 'Transcript_PDF'],
+    },
+    'associate': {
+        'label': 'Associate',
+        'fields': {
+            'id_kh': 0, 'id_e': 1, 'name_kh': 2, 'name_e': 3, 'g1': 4, 'g2': 5,
+            'dob_kh': 6, 'dob_e': 7, 'pro_kh': 8, 'pro_e': 9, 'ed_kh': 10, 'ed_e': 11,
+        },
+        'display_name': ['name_e'],
+        'row_key': ['id_kh', 'id_e'],
+        'required': ['name_e'],
+        'directories': ['Associate_Documents', 'Associate_PDF'],
+        'manual': {'id_kh': 'student_id', 'id_e': 'student_id', 'name_e': 'student_name'},
+    },
+}
+
+_schema_memo = {}  # (filename, mtime) listing of SCHEMA_FOLDER -> schemas
+
+def load_document_schemas():
+    """Built-in schemas plus any <document_type>.json found in SCHEMA_FOLDER"""
+    folder = app.config['SCHEMA_FOLDER']
+    listing = ()
+    if os.path.isdir(folder):
+        with os.scandir(folder) as entries:
+            listing = tuple(sorted((entry.name, entry.stat().st_mtime_ns) for entry in entries
+                                   if entry.name.lower().endswith('.json')))
+    if listing in _schema_memo:
+        return _schema_memo[listing]
+
+    schemas = {name: dict(schema) for name, schema in DOCUMENT_SCHEMAS.items()}
+    for filename, _ in listing:
+        name = os.path.splitext(filename)[0]
+        if name == 'certificate':
+            continue
+        try:
+            with open(os.path.join(folder, filename), encoding='utf-8') as f:
+                schema = json.load(f)
+            if not isinstance(schema, dict) or not isinstance(schema.get('fields'), dict) or not schema['fields']:
+                raise ValueError("'fields' must map template variables to columns")
+        except (OSError, ValueError) as e:
+            app.logger.warning("Skipping document schema %s: %s", filename, e)
+            continue
+        schemas[name] = schema
+    for name, schema in schemas.items():
+        fields = list(schema['fields'])
+        schema.setdefault('label', name.replace('_', ' ').title())
+        schema.setdefault('display_name', fields[:1])
+        schema.setdefault('row_key', schema['display_name'])
+        schema.setdefault('required', schema['display_name'])
+        schema.setdefault('directories', [f"{safe_filename(schema['label'])}_Doc",
+                                          f"{safe_filename(schema['label'])}_PDF"])
+        schema.setdefault('manual', {})
+    _schema_memo.clear()
+    _schema_memo[listing] = schemas
+    return schemas
+
+def get_document_schema(document_type):
+    schema = load_document_schemas().get(document_type)
+    if schema is None:
+        raise ValueError(f"Unsupported document type: {document_type}")
+    return schema
+
+class ContextProjector:
+    """Row -> template context for one job, with columns resolved once and one issue date"""
+
+    def __init__(self, schema, header=None, variables=None, issue_date=None):
+        self.schema = schema
+        lookup = {str(name).strip().lower(): position
+                  for position, name in enumerate(header or ()) if name is not None}
+        needed = set(schema['display_name']) | set(schema['row_key']) | set(schema['required'])
+        wanted = set(schema['fields']) if variables is None else set(variables) | needed
+        self.columns = {}
+        for variable, column in schema['fields'].items():
+            if variable not in wanted:
+                continue
+            if isinstance(column, int):
+                self.columns[variable] = column
+            elif str(column).strip().lower() in lookup:
+                self.columns[variable] = lookup[str(column).strip().lower()]
+            elif header is not None:
+                raise ValueError(f"The roster has no '{column}' column (needed for {variable})")
+        self.context_columns = [(variable, position) for variable, position in self.columns.items()
+                                if variables is None or variable in variables]
+        self.constants = {}
+        if variables is None or 'cur_date' in variables:
+            self.constants['cur_date'] = issue_date_text(issue_date)
+
+    def __call__(self, row):
+        context = {variable: row[position] for variable, position in self.context_columns}
+        context.update(self.constants)
+        return context
+
+    def value(self, row, variable):
+        position = self.columns.get(variable)
+        return row[position] if position is not None and position < len(row) else None
+
+    def complete(self, row):
+        return all(self.value(row, variable) for variable in self.schema['required'])
+
+    def display_name(self, row):
+        return " ".join(str(self.value(row, variable) or '') for variable in self.schema['display_name']).strip()
+
+    def base_name(self, prefix, row):
+        names = "_".join(str(self.value(row, variable)) for variable in self.schema['display_name'])
+        return f"{prefix}_{safe_filename(names)}_{uuid.uuid4().hex[:8]}"
+
+    def key(self, row):
+        return "|".join(str(self.value(row, variable)) for variable in self.schema['row_key'])
+
+    def from_form(self, form):
+        """Context for the manual-entry form, which names fields as in the schema"""
+        manual = self.schema['manual']
+        context = {variable: form.get(manual.get(variable, variable), '')
+                   for variable, _ in self.context_columns}
+        context.update(self.constants)
+        return context
+
+def roster_header(filename):
+    return next(iter_roster_rows(filename), ())
+
+def compile_projector(document_type, template_file, excel_file=None, issue_date=None):
+    """Projector for a job: schema + roster header + the template's placeholders"""
+    header = roster_header(excel_file) if excel_file else None
+    return ContextProjector(get_document_schema(document_type), header,
+                            docx_template_cache.variables(template_file), issue_date)
+
+def issue_date_text(issue_date=None):
+    """The cur_date text: a job's pinned date (YYYY-MM-DD) or today"""
+    date = datetime.strptime(issue_date, "%Y-%m-%d") if issue_date else datetime.now()
+    return date.strftime("%B %d, %Y")
@@ -0,0 +1,157 @@
+"""Downloads: streamed archives and single outputs"""
+import os
+import uuid
+import shutil
+import zipfile
+import gzip
+import mimetypes
+from flask import request, send_file, Response
+from urllib.parse import quote as url_quote
+
+from . import app
+from .metrics import stage_timer
+from .rendering import file_digest
+from .store import file_store
+
+# ---------------------- Archive Streaming ----------------------
+# Formats that are already compressed (DOCX is itself a zip) are stored as-is
+ALREADY_COMPRESSED_FORMATS = {'png', 'jpg', 'jpeg', 'webp', 'pdf', 'docx'}
+
+class _ZipStreamBuffer:
+    """Write-only, unseekable sink for zipfile; the archive is drained as it is written"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def stream_zip(entries, chunk_size=64 * 1024):
+    """Yield a ZIP archive of [(arcname, path, file_format), ...] piece by piece"""
+    buffer = _ZipStreamBuffer()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as archive:
+        for arcname, path, file_format in entries:
+            if not os.path.exists(path):
+                continue
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            if file_format in ALREADY_COMPRESSED_FORMATS:
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with open(path, 'rb') as source, archive.open(info, 'w') as target:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    target.write(chunk)
+                    data = buffer.drain()
+                    if data:
+                        yield data
+            yield buffer.drain()
+    # Central directory
+    yield buffer.drain()
+
+# ---------------------- Output Serving ----------------------
+# Outputs are served with their sha256 as ETag and honour Range. With
+# OUTPUT_SENDFILE a front proxy sends the bytes, and OUTPUT_GZIP_FORMATS get
+# a gzip copy in a `.gz` folder (left empty when it saves too little).
+def gzip_variant_path(path):
+    return os.path.join(os.path.dirname(path), '.gz', os.path.basename(path) + '.gz')
+
+def gzip_variant(path):
+    """Path of a worthwhile gzip copy of `path`, made on first request, or None"""
+    variant = gzip_variant_path(path)
+    try:
+        if not os.path.exists(variant):
+            with stage_timer('gzip'):
+                os.makedirs(os.path.dirname(variant), exist_ok=True)
+                # Write-then-rename so a concurrent request never serves half a file
+                partial = f"{variant}.{uuid.uuid4().hex[:8]}.part"
+                with open(path, 'rb') as source, open(partial, 'wb') as raw, \
+                        gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as target:
+                    shutil.copyfileobj(source, target, 1024 * 1024)
+                if os.path.getsize(partial) > os.path.getsize(path) * (1 - app.config['OUTPUT_GZIP_MIN_SAVING']):
+                    open(partial, 'wb').close()
+                os.replace(partial, variant)
+        return variant if os.path.getsize(variant) else None
+    except OSError as e:
+        app.logger.warning("Could not precompress %s: %s", path, e)
+        return None
+
+def output_digest(file_info):
+    """sha256 of a generated file, hashed on first download and then read from the file store"""
+    digest = file_info.get('digest')
+    if digest is None:
+        digest = file_digest(file_info['path'])
+        file_store.set_digest(file_info['path'], digest)
+    return digest
+
+def offload_header(path):
+    """(header, value) handing `path` to the front proxy, or None to send it from Python"""
+    mode = app.config['OUTPUT_SENDFILE']
+    if mode == 'x-sendfile':
+        return 'X-Sendfile', path
+    if mode == 'x-accel-redirect':
+        relative = os.path.relpath(path, os.path.abspath(app.config['GENERATED_FOLDER']))
+        if relative.startswith(os.pardir):
+            return None
+        return 'X-Accel-Redirect', app.config['OUTPUT_ACCEL_PREFIX'].rstrip('/') + '/' + url_quote(
+            relative.replace(os.sep, '/'))
+    return None
+
+def serve_output(file_info, as_attachment):
+    """Conditional, resumable response for a generated file, offloaded when configured"""
+    path = os.path.abspath(file_info['path'])
+    etag = output_digest(file_info)
+    mimetype = mimetypes.guess_type(file_info['filename'])[0] or 'application/octet-stream'
+    encoded = file_info['format'] in app.config['OUTPUT_GZIP_FORMATS']
+    variant = gzip_variant(path) if encoded and request.accept_encodings['gzip'] else None
+    if variant:
+        # A different representation, so it needs its own validator for If-Range
+        path, etag = variant, f"{etag}-gzip"
+
+    offload = offload_header(path)
+    if offload:
+        stat = os.stat(path)
+        response = Response(mimetype=mimetype)
+        response.content_length = stat.st_size
+        response.last_modified = stat.st_mtime
+        response.set_etag(etag)
+        if as_attachment:
+            response.headers.set('Content-Disposition', 'attachment', filename=file_info['filename'])
+        # The proxy does the byte ranges; only the validators are checked here
+        response = response.make_conditional(request.environ)
+        if response.status_code != 304:
+            response.headers[offload[0]] = offload[1]
+    else:
+        response = send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                             download_name=file_info['filename'], conditional=True, etag=etag)
+    if variant:
+        response.headers['Content-Encoding'] = 'gzip'
+    if encoded:
+        response.vary.add('Accept-Encoding')
+    # Output names are unique, so a file never changes; it is a student's record, though
+    response.cache_control.no_cache = None
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.max_age = app.config['OUTPUT_MAX_AGE']
+    return response
+
+OUTPUT_FORMATS = ('docx', 'pdf', 'png', 'jpg', 'jpeg', 'webp')
+
+def parse_filter(value):
+    """Split a comma-separated `type` / `format` filter into its values"""
+    if not value:
+        return None
+    return sorted({part.strip().lower() for part in value.split(',') if part.strip()}) or None
@@ -0,0 +1,491 @@
+"""SQLite-backed job/file store and the template registry"""
+import os
+import json
+import hashlib
+import threading
+import tempfile
+import time
+import sqlite3
+
+from . import app
+from .rendering import docx_template_cache
+from .rosters import get_document_schema
+from .generators import get_certificate_renderer
+
+# ---------------------- File Store ----------------------
+class FileStore:
+    """SQLite (WAL) index of jobs, their files, registry templates and chunked uploads.
+
+    Each thread gets its own connection, so several processes can share it.
+    """
+
+    SCHEMA = '''
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            document_type TEXT,
+            status TEXT NOT NULL,
+            total INTEGER,
+            done INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            cached INTEGER NOT NULL DEFAULT 0,
+            carried INTEGER NOT NULL DEFAULT 0,
+            errors TEXT NOT NULL DEFAULT '[]',
+            error TEXT,
+            created REAL NOT NULL,
+            started REAL,
+            finished REAL,
+            bytes INTEGER NOT NULL DEFAULT 0,
+            uploads TEXT NOT NULL DEFAULT '[]',
+            stages TEXT NOT NULL DEFAULT '{}',
+            profile TEXT,
+            template TEXT,
+            heartbeat REAL
+        );
+        CREATE TABLE IF NOT EXISTS files (
+            id INTEGER PRIMARY KEY,
+            session_id TEXT NOT NULL,
+            filename TEXT NOT NULL,
+            type TEXT,
+            format TEXT,
+            data TEXT NOT NULL,
+            path TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            digest TEXT
+        );
+        CREATE TABLE IF NOT EXISTS templates (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            extension TEXT NOT NULL,
+            filename TEXT,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            variables TEXT NOT NULL DEFAULT '[]',
+            created REAL NOT NULL,
+            last_used REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS upload_sessions (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            filename TEXT,
+            document_type TEXT,
+            name TEXT,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            received INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            error TEXT,
+            result TEXT NOT NULL DEFAULT '{}',
+            created REAL NOT NULL,
+            updated REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS template_versions (
+            name TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            template_id TEXT NOT NULL,
+            created REAL NOT NULL,
+            PRIMARY KEY (name, version)
+        );
+    '''
+    INDEXES = '''
+        CREATE INDEX IF NOT EXISTS files_session_filename ON files (session_id, filename);
+        CREATE INDEX IF NOT EXISTS files_session_order ON files (session_id, id);
+        CREATE INDEX IF NOT EXISTS files_path ON files (path);
+        CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (status, finished);
+        CREATE INDEX IF NOT EXISTS template_versions_template ON template_versions (template_id);
+    '''
+    # Columns added after the first release, created on older databases
+    MIGRATIONS = (
+        ('jobs', 'bytes', "INTEGER NOT NULL DEFAULT 0"),
+        ('jobs', 'uploads', "TEXT NOT NULL DEFAULT '[]'"),
+        ('jobs', 'stages', "TEXT NOT NULL DEFAULT '{}'"),
+        ('jobs', 'profile', "TEXT"),
+        ('jobs', 'template', "TEXT"),
+        ('jobs', 'heartbeat', "REAL"),
+        ('files', 'path', "TEXT"),
+        ('files', 'size', "INTEGER NOT NULL DEFAULT 0"),
+        ('files', 'digest', "TEXT"),
+    )
+    JOB_FIELDS = ('document_type', 'status', 'total', 'done', 'failed', 'cached', 'carried',
+                  'error', 'created', 'started', 'finished', 'bytes', 'profile', 'template')
+
+    def __init__(self, path, ttl):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as db:
+            db.executescript(self.SCHEMA)
+            for table, column, definition in self.MIGRATIONS:
+                if column not in {row['name'] for row in db.execute(f'PRAGMA table_info({table})')}:
+                    db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                    if (table, column) == ('files', 'path'):
+                        db.execute("UPDATE files SET path = json_extract(data, '$.path')")
+            db.executescript(self.INDEXES)
+        # A connection must not be carried into forked workers
+        self.close()
+
+    def _connect(self):
+        db = getattr(self._local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30)
+            db.row_factory = sqlite3.Row
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            self._local.db = db
+        return db
+
+    def close(self):
+        """Close this thread's connection, e.g. before a prefork server forks"""
+        db = getattr(self._local, 'db', None)
+        if db is not None:
+            db.close()
+            self._local.db = None
+
+    def save_job(self, job):
+        """Insert or update a job's status and counters"""
+        values = [getattr(job, field) for field in self.JOB_FIELDS]
+        with self._connect() as db:
+            db.execute(
+                f"INSERT OR REPLACE INTO jobs (id, errors, uploads, stages, heartbeat, {', '.join(self.JOB_FIELDS)}) "
+                f"VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(self.JOB_FIELDS))})",
+                [job.id, json.dumps(job.errors[:20]), json.dumps(job.uploads), json.dumps(job.stages),
+                 time.time()] + values)
+
+    def record(self, job, files, sizes):
+        """Append a row's files and the job's new counters in one transaction"""
+        with self._connect() as db:
+            db.executemany(
+                'INSERT INTO files (session_id, filename, type, format, data, path, size) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(job.id, f['filename'], f['type'], f['format'], json.dumps(f, default=str), f['path'], size)
+                 for f, size in zip(files, sizes)])
+            db.execute(
+                'UPDATE jobs SET done = ?, failed = ?, cached = ?, carried = ?, bytes = ?, errors = ?, heartbeat = ? '
+                'WHERE id = ?',
+                (job.done, job.failed, job.cached, job.carried, job.bytes, json.dumps(job.errors[:20]), time.time(),
+                 job.id))
+
+    def heartbeat(self, job_ids):
+        """Note that the process holding these unfinished jobs is still alive"""
+        with self._connect() as db:
+            db.execute('UPDATE jobs SET heartbeat = ? WHERE id IN (SELECT value FROM json_each(?))',
+                       (time.time(), json.dumps(list(job_ids))))
+
+    def fail_lost_jobs(self, timeout):
+        """Fail queued or running jobs with no heartbeat for `timeout` seconds; returns their ids"""
+        now = time.time()
+        with self._connect() as db:
+            lost = [row[0] for row in db.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') AND COALESCE(heartbeat, created) < ?",
+                (now - timeout,))]
+            db.execute(
+                "UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id IN (SELECT value FROM json_each(?))",
+                (now, "The server stopped before this job finished; please submit it again", json.dumps(lost)))
+        return lost
+
+    def get_job(self, session_id):
+        row = self._connect().execute('SELECT * FROM jobs WHERE id = ?', (session_id,)).fetchone()
+        if row is None:
+            return None
+        return dict(row, errors=json.loads(row['errors']), uploads=json.loads(row['uploads']),
+                    stages=json.loads(row['stages']))
+
+    def job_counts(self):
+        """Number of jobs per status, across every process sharing the store"""
+        return {row[0]: row[1] for row in self._connect().execute('SELECT status, COUNT(*) FROM jobs GROUP BY status')}
+
+    def has_session(self, session_id):
+        return self._connect().execute('SELECT 1 FROM jobs WHERE id = ?', (session_id,)).fetchone() is not None
+
+    def job_status(self, session_id):
+        row = self._connect().execute('SELECT status FROM jobs WHERE id = ?', (session_id,)).fetchone()
+        return row['status'] if row else None
+
+    def _where(self, session_id, types, formats):
+        clauses, params = ['session_id = ?'], [session_id]
+        for column, values in (('type', types), ('format', formats)):
+            if values:
+                clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        return ' AND '.join(clauses), params
+
+    def files(self, session_id, offset=0, limit=None, types=None, formats=None):
+        """A session's files in generation order, optionally one page of them"""
+        where, params = self._where(session_id, types, formats)
+        rows = self._connect().execute(
+            f'SELECT data FROM files WHERE {where} ORDER BY id LIMIT ? OFFSET ?',
+            params + [-1 if limit is None else limit, offset])
+        return [json.loads(row['data']) for row in rows]
+
+    def count(self, session_id, types=None, formats=None):
+        where, params = self._where(session_id, types, formats)
+        return self._connect().execute(f'SELECT COUNT(*) FROM files WHERE {where}', params).fetchone()[0]
+
+    def format_counts(self, session_id):
+        rows = self._connect().execute(
+            'SELECT format, COUNT(*) FROM files WHERE session_id = ? GROUP BY format', (session_id,))
+        return {row[0]: row[1] for row in rows}
+
+    def find(self, session_id, filename):
+        """First file of a session with this filename, or None"""
+        row = self._connect().execute(
+            'SELECT data, digest FROM files WHERE session_id = ? AND filename = ? ORDER BY id LIMIT 1',
+            (session_id, filename)).fetchone()
+        if row is None:
+            return None
+        file_info = json.loads(row['data'])
+        if row['digest']:
+            file_info['digest'] = row['digest']
+        return file_info
+
+    def set_digest(self, path, digest):
+        """Remember a file's content hash for every row that points at it"""
+        with self._connect() as db:
+            db.execute('UPDATE files SET digest = ? WHERE path = ?', (digest, path))
+
+    def delete(self, session_id):
+        """Forget a session and return the file paths no other session still uses"""
+        with self._connect() as db:
+            paths = [row[0] for row in db.execute(
+                'SELECT DISTINCT path FROM files WHERE session_id = ? AND path IS NOT NULL', (session_id,))]
+            db.execute('DELETE FROM files WHERE session_id = ?', (session_id,))
+            db.execute('DELETE FROM jobs WHERE id = ?', (session_id,))
+            # Rows carried into later jobs point at this session's files
+            shared = {row[0] for row in db.execute(
+                'SELECT path FROM files WHERE path IN (SELECT value FROM json_each(?))', (json.dumps(paths),))}
+        return [path for path in paths if path not in shared]
+
+    def expired(self):
+        """Finished sessions older than the TTL"""
+        cutoff = time.time() - self.ttl
+        return [row[0] for row in self._connect().execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') AND COALESCE(finished, created) < ?",
+            (cutoff,))]
+
+    def oldest_finished(self):
+        row = self._connect().execute(
+            "SELECT id FROM jobs WHERE status IN ('done', 'failed') ORDER BY finished LIMIT 1").fetchone()
+        return row[0] if row else None
+
+    def total_bytes(self):
+        """Disk used by all listed files, counting files shared between sessions once"""
+        return self._connect().execute(
+            'SELECT COALESCE(SUM(size), 0) FROM (SELECT MAX(size) AS size FROM files GROUP BY path)').fetchone()[0]
+
+    def finished_uploads(self):
+        """(session_id, uploads) for finished jobs whose uploads are still on disk"""
+        rows = self._connect().execute(
+            "SELECT id, uploads FROM jobs WHERE status IN ('done', 'failed') AND uploads != '[]'")
+        return [(row['id'], json.loads(row['uploads'])) for row in rows]
+
+    def live_uploads(self):
+        rows = self._connect().execute("SELECT uploads FROM jobs WHERE status NOT IN ('done', 'failed')")
+        return {path for row in rows for path in json.loads(row['uploads'])}
+
+    def clear_uploads(self, session_id):
+        with self._connect() as db:
+            db.execute("UPDATE jobs SET uploads = '[]' WHERE id = ?", (session_id,))
+
+    def save_template(self, template):
+        with self._connect() as db:
+            db.execute(
+                'INSERT OR REPLACE INTO templates (id, kind, extension, filename, path, size, variables, created, '
+                'last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (template['id'], template['kind'], template['extension'], template['filename'], template['path'],
+                 template['size'], json.dumps(template['variables']), template['created'], template['last_used']))
+
+    def get_template(self, template_id):
+        row = self._connect().execute('SELECT * FROM templates WHERE id = ?', (template_id,)).fetchone()
+        return dict(row, variables=json.loads(row['variables'])) if row else None
+
+    def touch_template(self, template_id):
+        with self._connect() as db:
+            db.execute('UPDATE templates SET last_used = ? WHERE id = ?', (time.time(), template_id))
+
+    def add_template_version(self, name, template_id):
+        """Point `name` at a template, as a new version unless it is already the latest"""
+        latest = self.template_version(name)
+        if latest and latest['template_id'] == template_id:
+            return latest['version']
+        with self._connect() as db:
+            db.execute(
+                'INSERT INTO template_versions (name, version, template_id, created) '
+                'SELECT ?, COALESCE(MAX(version), 0) + 1, ?, ? FROM template_versions WHERE name = ?',
+                (name, template_id, time.time(), name))
+        return self.template_version(name)['version']
+
+    def template_version(self, name, version=None):
+        """A named template's latest version, or the given one; None if there is none"""
+        if version is None:
+            row = self._connect().execute(
+                'SELECT * FROM template_versions WHERE name = ? ORDER BY version DESC LIMIT 1', (name,)).fetchone()
+        else:
+            row = self._connect().execute(
+                'SELECT * FROM template_versions WHERE name = ? AND version = ?', (name, version)).fetchone()
+        return dict(row) if row else None
+
+    def template_versions(self, name=None):
+        """Named versions, newest first, optionally of one name only"""
+        where, params = ('WHERE name = ?', (name,)) if name else ('', ())
+        return [dict(row) for row in self._connect().execute(
+            f'SELECT * FROM template_versions {where} ORDER BY name, version DESC', params)]
+
+    def stale_templates(self, cutoff):
+        """(id, path) of unnamed templates last used before `cutoff` that no unfinished job reads"""
+        return [(row[0], row[1]) for row in self._connect().execute(
+            'SELECT id, path FROM templates WHERE last_used < ? '
+            'AND id NOT IN (SELECT template_id FROM template_versions) '
+            "AND path NOT IN (SELECT template FROM jobs WHERE status IN ('queued', 'running') "
+            'AND template IS NOT NULL)', (cutoff,))]
+
+    def delete_template(self, template_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM templates WHERE id = ?', (template_id,))
+
+    UPLOAD_FIELDS = ('kind', 'filename', 'document_type', 'name', 'path', 'size', 'received', 'status', 'error',
+                     'created', 'updated')
+
+    def save_upload(self, upload):
+        with self._connect() as db:
+            db.execute(
+                f"INSERT OR REPLACE INTO upload_sessions (id, result, {', '.join(self.UPLOAD_FIELDS)}) "
+                f"VALUES (?, ?, {', '.join('?' * len(self.UPLOAD_FIELDS))})",
+                [upload['id'], json.dumps(upload['result'])] + [upload[field] for field in self.UPLOAD_FIELDS])
+
+    def get_upload(self, upload_id):
+        row = self._connect().execute('SELECT * FROM upload_sessions WHERE id = ?', (upload_id,)).fetchone()
+        return dict(row, result=json.loads(row['result'])) if row else None
+
+    def claim_upload(self, upload_id, offset, stale_after=300):
+        """Reserve an upload for the chunk starting at `offset`; a claim older than `stale_after` lapses"""
+        now = time.time()
+        with self._connect() as db:
+            claimed = db.execute(
+                "UPDATE upload_sessions SET status = 'writing', updated = ? WHERE id = ? AND received = ? "
+                "AND (status = 'receiving' OR (status = 'writing' AND updated < ?))",
+                (now, upload_id, offset, now - stale_after)).rowcount
+        return claimed == 1
+
+    def move_upload(self, upload_id, before, after):
+        """Switch an upload from status `before` to `after`; False if it wasn't in `before`"""
+        with self._connect() as db:
+            return db.execute('UPDATE upload_sessions SET status = ?, updated = ? WHERE id = ? AND status = ?',
+                              (after, time.time(), upload_id, before)).rowcount == 1
+
+    def delete_upload(self, upload_id):
+        with self._connect() as db:
+            db.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+
+    def forget_uploads(self, cutoff):
+        """Drop upload sessions untouched since `cutoff`; their files go with the stray uploads"""
+        with self._connect() as db:
+            db.execute('DELETE FROM upload_sessions WHERE updated < ?', (cutoff,))
+
+file_store = FileStore(app.config['FILE_STORE_PATH'], app.config['FILE_STORE_TTL'])
+
+# ---------------------- Template Registry ----------------------
+TEMPLATE_KINDS = {'.docx': 'docx', '.png': 'image', '.jpg': 'image', '.jpeg': 'image'}
+
+class TemplateRegistry:
+    """Templates stored once per content hash, checked and preprocessed when registered.
+
+    Jobs refer to one by id, by name (latest version) or by "name@version".
+    """
+
+    def __init__(self, store, folder):
+        self.store = store
+        self.folder = folder
+
+    def register(self, stream, filename, name=None):
+        """Store a template read from `stream`; returns its record"""
+        extension = os.path.splitext(filename or '')[1].lower()
+        kind = TEMPLATE_KINDS.get(extension)
+        if kind is None:
+            raise ValueError("Templates must be .docx, .png, .jpg or .jpeg files")
+        if name is not None and not (0 < len(name) <= 64 and all(c.isalnum() or c in '-_.' for c in name)):
+            raise ValueError("Template names may only use letters, digits, '-', '_' and '.'")
+
+        os.makedirs(self.folder, exist_ok=True)
+        sha = hashlib.sha256()
+        with tempfile.NamedTemporaryFile(dir=self.folder, suffix='.part', delete=False) as f:
+            for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+                sha.update(chunk)
+                f.write(chunk)
+        template_id = sha.hexdigest()[:32]
+        record = self.store.get_template(template_id)
+        if record is not None and os.path.exists(record['path']):
+            os.remove(f.name)  # seen before: already checked and preprocessed
+            # Uploading it again is a use; its age for retention starts over
+            self.store.touch_template(template_id)
+        else:
+            path = os.path.join(self.folder, template_id + extension)
+            os.replace(f.name, path)
+            try:
+                variables = self.preprocess(path, kind)
+            except ValueError:
+                os.remove(path)
+                raise
+            now = time.time()
+            record = {'id': template_id, 'kind': kind, 'extension': extension, 'filename': filename,
+                      'path': path, 'size': os.path.getsize(path), 'variables': variables,
+                      'created': now, 'last_used': now}
+            self.store.save_template(record)
+        if name is not None:
+            record = dict(record, name=name, version=self.store.add_template_version(name, template_id))
+        return record
+
+    def preprocess(self, path, kind):
+        """Parse or decode a template into this process's caches; returns its placeholders"""
+        try:
+            if kind == 'docx':
+                if app.config['DOCX_FAST_PATH']:
+                    docx_template_cache.compiled(path)
+                return sorted(docx_template_cache.variables(path))
+            get_certificate_renderer(path)
+            return []
+        except Exception as e:
+            raise ValueError(f"The template could not be read: {e}")
+
+    def resolve(self, reference):
+        """Record for a template id, "name" or "name@version"; None if unknown"""
+        name, _, version = (reference or '').strip().partition('@')
+        if not name or (version and not version.isdigit()):
+            return None
+        named = self.store.template_version(name, int(version) if version else None)
+        record = self.store.get_template(named['template_id'] if named else name)
+        if record is None or not os.path.exists(record['path']):
+            return None
+        if named:
+            record.update(name=name, version=named['version'])
+        self.store.touch_template(record['id'])
+        # A no-op once this process has parsed or decoded it
+        self.preprocess(record['path'], record['kind'])
+        return record
+
+    def check(self, record, document_type):
+        """Warnings about using a template for `document_type`; ValueError if it can't be used"""
+        if (document_type == 'certificate') != (record['kind'] == 'image'):
+            raise ValueError("Certificates need a PNG or JPG template; other documents need a DOCX template")
+        if document_type == 'certificate':
+            return []
+        schema = get_document_schema(document_type)
+        variables = set(record['variables'])
+        warnings = []
+        unfilled = sorted(variables - set(schema['fields']) - {'cur_date'})
+        if unfilled:
+            warnings.append(f"These placeholders have no {schema['label']} column and will be left blank: "
+                            f"{', '.join(unfilled)}")
+        if not variables & set(schema['fields']):
+            warnings.append(f"The template uses none of the {schema['label']} fields")
+        return warnings
+
+def template_info(record):
+    """A template record as the API shows it"""
+    info = {'template_id': record['id'], 'kind': record['kind'], 'filename': record['filename'],
+            'size': record['size'], 'created': record['created']}
+    if record['kind'] == 'docx':
+        info['variables'] = record['variables']
+    if 'name' in record:
+        info.update(name=record['name'], version=record['version'])
+    return info
+
+template_registry = TemplateRegistry(file_store, app.config['TEMPLATE_REGISTRY_FOLDER'])
@@ -0,0 +1,96 @@
+"""Small JPEG previews for the results page"""
+import os
+import uuid
+import functools
+
+from . import app
+from .lazy import Image
+from .metrics import stage_timer
+
+# ---------------------- Thumbnails ----------------------
+# JPEG previews in a `.thumbs` folder next to each output. PDFs are
+# rasterised with PyMuPDF; cached outputs get theirs on first view.
+THUMBNAIL_IMAGE_FORMATS = ('png', 'jpg', 'jpeg', 'webp')
+
+def thumbnail_path(path):
+    return os.path.join(os.path.dirname(path), '.thumbs', os.path.basename(path) + '.jpg')
+
+@functools.lru_cache(maxsize=1)
+def _pymupdf():
+    try:
+        import fitz  # a deployment without PyMuPDF just shows PDFs without previews
+    except ImportError:
+        return None
+    return fitz
+
+def pdf_first_page(pdf_path, size):
+    """First page of a PDF rasterised to fit `size` pixels, or None without PyMuPDF"""
+    fitz = _pymupdf()
+    if fitz is None:
+        return None
+    with fitz.open(pdf_path) as document:
+        page = document[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+def save_thumbnail(image, path):
+    """Shrink a decoded page (in place) into a JPEG preview at `path`; failures are only logged"""
+    try:
+        with stage_timer('thumbnail'):
+            size = app.config['THUMBNAIL_SIZE']
+            image.thumbnail((size, size), Image.Resampling.BILINEAR, reducing_gap=2.0)
+            if image.mode in ('RGBA', 'LA', 'P', 'PA'):
+                image = image.convert('RGBA')
+                flat = Image.new('RGB', image.size, 'white')
+                flat.paste(image, mask=image.getchannel('A'))
+                image = flat
+            elif image.mode not in ('RGB', 'L'):
+                image = image.convert('RGB')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write-then-rename so a concurrent request never serves half a file
+            partial = f"{path}.{uuid.uuid4().hex[:8]}.part"
+            image.save(partial, 'JPEG', quality=app.config['THUMBNAIL_QUALITY'])
+            os.replace(partial, path)
+        return True
+    except Exception as e:
+        app.logger.warning("Could not write thumbnail %s: %s", path, e)
+        return False
+
+def has_thumbnail(file_info):
+    """Whether a preview exists or can be made for this file"""
+    if file_info['format'] in THUMBNAIL_IMAGE_FORMATS:
+        return True
+    return file_info['format'] == 'pdf' and (_pymupdf() is not None
+                                             or os.path.exists(thumbnail_path(file_info['path'])))
+
+def ensure_thumbnail(file_info):
+    """Path of a file's preview, made from the output itself if the batch left none"""
+    path = thumbnail_path(file_info['path'])
+    if os.path.exists(path):
+        return path
+    if not os.path.exists(file_info['path']):
+        return None
+    if file_info['format'] in THUMBNAIL_IMAGE_FORMATS:
+        with Image.open(file_info['path']) as image:
+            save_thumbnail(image, path)
+    elif file_info['format'] == 'pdf':
+        try:
+            page = pdf_first_page(file_info['path'], app.config['THUMBNAIL_SIZE'])
+        except Exception as e:
+            app.logger.warning("Could not rasterise %s: %s", file_info['path'], e)
+            page = None
+        if page is not None:
+            save_thumbnail(page, path)
+    return path if os.path.exists(path) else None
+
+def pdf_thumbnail(pdf_path):
+    """Preview a freshly converted PDF from its first page, when PyMuPDF is available"""
+    if _pymupdf() is None:
+        return
+    try:
+        page = pdf_first_page(pdf_path, app.config['THUMBNAIL_SIZE'])
+    except Exception as e:
+        app.logger.warning("Could not rasterise %s: %s", pdf_path, e)
+        return
+    save_thumbnail(page, thumbnail_path(pdf_path))
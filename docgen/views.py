@@ -0,0 +1,413 @@
+"""Browser-facing routes"""
+import os
+import uuid
+from flask import render_template, request, redirect, url_for, send_file, flash, jsonify, abort, Response
+
+from . import app
+from .metrics import STAGE_BUCKETS, process_timings
+from .cache import output_cache
+from .thumbnails import ensure_thumbnail, has_thumbnail
+from .batch import batch_worker_budget
+from .rosters import ROSTER_EXTENSIONS, issue_date_text, load_document_schemas, roster_header
+from .generators import generate_individual_document
+from .serving import OUTPUT_FORMATS, parse_filter, serve_output, stream_zip
+from .store import file_store, template_registry
+from .jobs import (
+    JobQueueFull, estimate_row_count, job_output_root, job_queue, retention_sweeper, roster_job, roster_problem)
+from .api import chunked_uploads
+
+# ---------------------- Flask Routes ----------------------
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/upload', methods=['GET', 'POST'])
+def upload():
+    if request.method == 'POST':
+        # Turn new work away before accepting any files when the queue is full
+        if job_queue.full():
+            flash('The server is busy with other jobs right now. Please try again in a few minutes.', 'error')
+            return redirect(request.url)
+        document_type = request.form.get('document_type')
+        file_format = request.form.get('file_format', 'both')
+        data_method = request.form.get('data_method', 'excel')
+        # Each job writes under its own directory so retention can drop it whole
+        job_id = str(uuid.uuid4())
+        output_root = job_output_root(job_id)
+        
+        # Use a registered template, or register the uploaded one; a file
+        # that was uploaded before is reused as-is, already preprocessed
+        template_ref = request.form.get('template_ref', '').strip()
+        if template_ref:
+            template = template_registry.resolve(template_ref)
+            if template is None:
+                flash(f'There is no registered template "{template_ref}"', 'error')
+                return redirect(request.url)
+        else:
+            # Check if template file was uploaded
+            if 'template_file' not in request.files:
+                flash('Please upload a template file', 'error')
+                return redirect(request.url)
+            
+            template_file = request.files['template_file']
+            
+            if template_file.filename == '':
+                flash('Please select a template file', 'error')
+                return redirect(request.url)
+            
+            try:
+                template = template_registry.register(template_file.stream, template_file.filename,
+                                                      request.form.get('template_name', '').strip() or None)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+        template_path = template['path']
+        uploads = []
+        
+        if data_method == 'excel':
+            roster_upload = request.form.get('roster_upload', '').strip()
+            if roster_upload:
+                # The page already sent the roster in chunks through /api/uploads
+                try:
+                    excel_path, total = chunked_uploads.roster(roster_upload, document_type)
+                except ValueError as e:
+                    flash(str(e), 'error')
+                    return redirect(request.url)
+                uploads.append(excel_path)
+            else:
+                # Excel file method
+                if 'excel_file' not in request.files:
+                    flash('Please upload an Excel file', 'error')
+                    return redirect(request.url)
+                
+                excel_file = request.files['excel_file']
+                
+                if excel_file.filename == '':
+                    flash('Please select an Excel file', 'error')
+                    return redirect(request.url)
+                
+                # Validate file types
+                if not excel_file.filename.lower().endswith(ROSTER_EXTENSIONS):
+                    flash('Please upload a valid Excel or CSV file (.xlsx, .xls or .csv)', 'error')
+                    return redirect(request.url)
+                
+                # Save Excel file
+                excel_filename = f"{uuid.uuid4()}_{excel_file.filename}"
+                excel_path = os.path.join(app.config['UPLOAD_FOLDER'], excel_filename)
+                excel_file.save(excel_path)
+                uploads.append(excel_path)
+                total = estimate_row_count(excel_path)
+            
+            # Pick the generator based on type
+            if document_type == 'certificate':
+                if not template['extension'].endswith(('.png', '.jpg', '.jpeg')):
+                    flash('Certificate generation requires a PNG or JPG template file', 'error')
+                    return redirect(request.url)
+            elif document_type == 'transcript':
+                if not template['extension'].endswith('.docx'):
+                    flash('Transcript generation requires a DOCX template file', 'error')
+                    return redirect(request.url)
+            elif document_type == 'associate':
+                if not template['extension'].endswith('.docx'):
+                    flash('Associate document generation requires a DOCX template file', 'error')
+                    return redirect(request.url)
+            elif document_type in load_document_schemas():
+                if not template['extension'].endswith('.docx'):
+                    flash('This document type requires a DOCX template file', 'error')
+                    return redirect(request.url)
+            else:
+                flash('Invalid document type', 'error')
+                return redirect(request.url)
+
+            # Catch a roster missing columns before queueing a job that would fail every row
+            try:
+                problem = roster_problem(document_type, roster_header(excel_path), template['variables'] or None)
+            except Exception as e:
+                problem = f"The roster could not be read: {e}"
+            if problem:
+                if not roster_upload:
+                    os.remove(excel_path)
+                flash(problem, 'error')
+                return redirect(request.url)
+            for warning in template_registry.check(template, document_type):
+                flash(warning, 'warning')
+            issue_date = request.form.get('issue_date', '').strip()
+            try:
+                issue_date and issue_date_text(issue_date)
+            except ValueError:
+                flash('The issue date must be written as YYYY-MM-DD', 'error')
+                return redirect(request.url)
+            target, args, kwargs = roster_job(document_type, excel_path, template_path, file_format, output_root,
+                                              combine=bool(request.form.get('combine')), issue_date=issue_date)
+
+            # Reuse the outputs of unchanged students from an earlier job
+            previous_job = request.form.get('previous_job', '').strip()
+            if previous_job:
+                if not file_store.has_session(previous_job):
+                    flash('The previous job was not found; unchanged documents cannot be reused', 'error')
+                    return redirect(request.url)
+                kwargs['previous_files'] = file_store.files(previous_job)
+                
+        else:
+            # Manual input method
+            student_name = request.form.get('student_name', '').strip()
+            if not student_name:
+                flash('Please enter student name', 'error')
+                return redirect(request.url)
+            
+            # Prepare student data
+            student_data = {
+                'student_name': student_name,
+                'student_id': request.form.get('student_id', ''),
+                'first_name': request.form.get('first_name', ''),
+                'last_name': request.form.get('last_name', ''),
+                'name_kh': request.form.get('name_kh', ''),
+            }
+            
+            # Generate individual document
+            output_folder = os.path.join(output_root, 'Individual_Documents')
+            target = generate_individual_document
+            args = (document_type, template_path, output_folder, student_data, file_format)
+            total = 1
+            kwargs = {}
+        
+        # Everything checked out; only now is a chunked roster used up
+        roster_upload = data_method == 'excel' and request.form.get('roster_upload', '').strip()
+        if roster_upload:
+            try:
+                chunked_uploads.consume(roster_upload)
+            except ValueError as e:
+                flash(str(e), 'error')
+                return redirect(request.url)
+
+        # Generate in the background; the results page fills in as files finish
+        try:
+            job = job_queue.submit(target, args, document_type=document_type, total=total, kwargs=kwargs,
+                                   job_id=job_id, uploads=uploads, profile=bool(request.form.get('profile')),
+                                   template=template_path)
+        except JobQueueFull:
+            if roster_upload:
+                chunked_uploads.release(roster_upload)
+            flash('The server is busy with other jobs right now. Please try again in a few minutes.', 'error')
+            return redirect(request.url)
+        return redirect(url_for('results', session_id=job.id, document_type=document_type))
+    
+    # Document types added through SCHEMA_FOLDER get their own buttons
+    extra_types = {name: schema['label'] for name, schema in load_document_schemas().items()
+                   if name not in ('transcript', 'associate')}
+    return render_template('upload.html', previous_job=request.args.get('previous_job', ''),
+                           extra_types=extra_types, saved_templates=file_store.template_versions())
+
+@app.route('/results')
+def results():
+    session_id = request.args.get('session_id')
+    document_type = request.args.get('document_type', '')
+    file_count = request.args.get('file_count', 0)
+    
+    job = job_queue.get(session_id) if session_id else None
+    if job is None:
+        flash('Session expired or invalid. Please generate documents again.', 'error')
+        return redirect(url_for('upload'))
+    
+    # Only the requested page is rendered; the page fetches others on demand
+    page_size = app.config['RESULTS_PAGE_SIZE']
+    page = max(request.args.get('page', 1, type=int), 1)
+    status = job.to_dict(limit=0)
+    files = [public_file(session_id, file_info)
+             for file_info in file_store.files(session_id, offset=(page - 1) * page_size, limit=page_size)]
+    
+    return render_template('results.html', 
+                         document_type=document_type,
+                         file_count=file_count or status['file_count'],
+                         files=files,
+                         file_total=status['file_count'],
+                         format_counts=status['format_counts'],
+                         page=page,
+                         page_size=page_size,
+                         session_id=session_id,
+                         job=status)
+
+def public_file(session_id, file_info):
+    """The parts of a file entry that are safe to hand to the browser"""
+    return {
+        'name': file_info['name'],
+        'filename': file_info['filename'],
+        'type': file_info['type'],
+        'format': file_info['format'],
+        'download_url': url_for('download_file', session_id=session_id, filename=file_info['filename']),
+        'view_url': url_for('view_file', session_id=session_id, filename=file_info['filename']),
+        'thumb_url': (url_for('thumbnail', session_id=session_id, filename=file_info['filename'])
+                      if has_thumbnail(file_info) else None),
+    }
+
+@app.route('/jobs/<job_id>')
+def job_status(job_id):
+    """Progress of a generation job; `since`/`limit` select which files to include"""
+    job = job_queue.get(job_id)
+    if job is None:
+        abort(404)
+    status = job.to_dict(since=request.args.get('since', 0, type=int),
+                         limit=request.args.get('limit', None, type=int))
+    status['files'] = [public_file(job_id, file_info) for file_info in status['files']]
+    return jsonify(status)
+
+@app.route('/jobs/<job_id>/files')
+def job_files(job_id):
+    """One page of a job's files, optionally filtered with ?type=...&format=..."""
+    if not file_store.has_session(job_id):
+        abort(404)
+    types, formats = parse_filter(request.args.get('type')), parse_filter(request.args.get('format'))
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', app.config['RESULTS_PAGE_SIZE'], type=int), 0), 1000)
+    files = file_store.files(job_id, offset=offset, limit=limit, types=types, formats=formats)
+    return jsonify({
+        'offset': offset,
+        'total': file_store.count(job_id, types=types, formats=formats),
+        'files': [public_file(job_id, file_info) for file_info in files],
+    })
+
+@app.route('/cache/stats')
+def cache_stats():
+    """Output cache hit/miss counters for this process"""
+    return jsonify(output_cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition of stage timings and counters for this process"""
+    lines = ['# HELP docgen_stage_seconds Time spent in each generation stage.',
+             '# TYPE docgen_stage_seconds histogram']
+    for stage, counts in sorted(process_timings.snapshot().items()):
+        for bound, count in zip(STAGE_BUCKETS, counts):
+            lines.append(f'docgen_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+        lines.append(f'docgen_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {counts[-2]}')
+        lines.append(f'docgen_stage_seconds_sum{{stage="{stage}"}} {counts[-1]:.6f}')
+        lines.append(f'docgen_stage_seconds_count{{stage="{stage}"}} {counts[-2]}')
+
+    cache = output_cache.stats()
+    retention = retention_sweeper.stats()
+    lines += [
+        '# HELP docgen_output_cache_lookups_total Output cache lookups by result.',
+        '# TYPE docgen_output_cache_lookups_total counter',
+        f'docgen_output_cache_lookups_total{{result="hit"}} {cache["hits"]}',
+        f'docgen_output_cache_lookups_total{{result="miss"}} {cache["misses"]}',
+        '# HELP docgen_output_cache_bytes Bytes held by the output cache.',
+        '# TYPE docgen_output_cache_bytes gauge',
+        f'docgen_output_cache_bytes {cache["bytes"]}',
+        '# HELP docgen_retention_reclaimed_bytes_total Bytes freed by the retention sweeper.',
+        '# TYPE docgen_retention_reclaimed_bytes_total counter',
+        f'docgen_retention_reclaimed_bytes_total {retention["bytes_reclaimed"]}',
+        '# HELP docgen_stored_bytes Bytes of generated files still listed.',
+        '# TYPE docgen_stored_bytes gauge',
+        f'docgen_stored_bytes {retention["stored_bytes"]}',
+        '# HELP docgen_jobs Jobs in the file store by status.',
+        '# TYPE docgen_jobs gauge',
+    ]
+    for status, count in sorted(file_store.job_counts().items()):
+        lines.append(f'docgen_jobs{{status="{status}"}} {count}')
+    queue_stats = job_queue.stats()
+    lines += [
+        '# HELP docgen_job_queue Jobs in this process by queue state.',
+        '# TYPE docgen_job_queue gauge',
+        f'docgen_job_queue{{state="running"}} {queue_stats["running"]}',
+        f'docgen_job_queue{{state="waiting"}} {queue_stats["waiting"]}',
+        '# HELP docgen_batch_workers_in_use Pool processes reserved by running batches.',
+        '# TYPE docgen_batch_workers_in_use gauge',
+        f'docgen_batch_workers_in_use {batch_worker_budget.in_use}',
+    ]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+@app.route('/jobs/<job_id>/profile')
+def job_profile(job_id):
+    """Profiler report of a job submitted with profiling switched on"""
+    record = file_store.get_job(job_id)
+    if record is None or not record['profile'] or not os.path.exists(record['profile']):
+        abort(404)
+    return send_file(os.path.abspath(record['profile']))
+
+@app.route('/retention/stats')
+def retention_stats():
+    """What the retention sweeper has removed in this process"""
+    return jsonify(retention_sweeper.stats())
+
+@app.route('/download/<session_id>/<filename>')
+def download_file(session_id, filename):
+    """Download generated files"""
+    file_info = file_store.find(session_id, filename)
+    if file_info is None and not file_store.has_session(session_id):
+        flash('Session expired', 'error')
+        return redirect(url_for('upload'))
+    
+    if not file_info or not os.path.exists(file_info['path']):
+        flash('File not found', 'error')
+        return redirect(url_for('results', session_id=session_id))
+    
+    return serve_output(file_info, as_attachment=True)
+
+@app.route('/view/<session_id>/<filename>')
+def view_file(session_id, filename):
+    """View generated files in browser"""
+    file_info = file_store.find(session_id, filename)
+    if file_info is None and not file_store.has_session(session_id):
+        flash('Session expired', 'error')
+        return redirect(url_for('upload'))
+    
+    if not file_info or not os.path.exists(file_info['path']):
+        flash('File not found', 'error')
+        return redirect(url_for('results', session_id=session_id))
+    
+    # For PDF and images, send file for viewing; DOCX is downloaded since
+    # browsers can't display it
+    return serve_output(file_info, as_attachment=file_info['format'] not in ['pdf', 'png', 'jpg', 'jpeg', 'webp'])
+
+@app.route('/thumb/<session_id>/<filename>')
+def thumbnail(session_id, filename):
+    """Small JPEG preview of a generated certificate or PDF, cached by the browser"""
+    file_info = file_store.find(session_id, filename)
+    path = ensure_thumbnail(file_info) if file_info else None
+    if path is None:
+        abort(404)
+    # Output names are unique, so a preview never changes once written
+    response = send_file(os.path.abspath(path), mimetype='image/jpeg', conditional=True, etag=True,
+                         max_age=app.config['THUMBNAIL_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/batch_download/<session_id>')
+def batch_download(session_id):
+    """Download all files as zip, optionally filtered with ?type=...&format=..."""
+    if not file_store.has_session(session_id):
+        flash('Session expired', 'error')
+        return redirect(url_for('upload'))
+    
+    types, formats = parse_filter(request.args.get('type')), parse_filter(request.args.get('format'))
+    # Both end up in the archive's file name, so only known values are accepted
+    if types and not set(types) <= {'certificate'} | set(load_document_schemas()):
+        abort(400, description="Unknown document type in 'type'")
+    if formats and not set(formats) <= set(OUTPUT_FORMATS):
+        abort(400, description=f"'format' must be among {', '.join(OUTPUT_FORMATS)}")
+    files = file_store.files(session_id, types=types, formats=formats)
+    if not files:
+        flash('No files to download', 'error')
+        return redirect(url_for('results', session_id=session_id))
+
+    entries = [(f['filename'], f['path'], f['format']) for f in files]
+    suffix = '_'.join('-'.join(values) for values in (types, formats) if values)
+    archive_name = f"documents_{session_id[:8]}{'_' + suffix if suffix else ''}.zip"
+    response = Response(stream_zip(entries), mimetype='application/zip')
+    response.headers.set('Content-Disposition', 'attachment', filename=archive_name)
+    return response
+
+@app.route('/cleanup/<session_id>')
+def cleanup(session_id):
+    """Clean up generated files (optional)"""
+    # Files are deleted in the background; a queued job is cancelled first,
+    # and a running one keeps its files until it has finished
+    if file_store.has_session(session_id):
+        job = job_queue.get(session_id)
+        cancelled = job.status == 'queued' and job_queue.cancel(session_id)
+        retention_sweeper.schedule(session_id)
+        if job.status in ('queued', 'running') and not cancelled:
+            flash('This job is still running; its files will be removed once it has finished', 'info')
+            return redirect(url_for('results', session_id=session_id))
+        flash('Generated files for this job will be removed shortly', 'info')
+    return redirect(url_for('index'))
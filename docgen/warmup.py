@@ -0,0 +1,39 @@
+"""Pre-fork warm-up"""
+import os
+import time
+
+from . import app
+from .lazy import GENERATION_MODULES
+from .generators import certificate_layout, glyph_metrics
+from .store import file_store, template_registry
+
+# ---------------------- Warm-up ----------------------
+def warm_up(max_templates=None):
+    """Load modules, named templates and fonts before a prefork server forks, e.g. from gunicorn's when_ready"""
+    started = time.perf_counter()
+    for module in GENERATION_MODULES:
+        module.load()
+    max_templates = app.config['TEMPLATE_CACHE_SIZE'] if max_templates is None else max_templates
+    warmed = []
+    for version in file_store.template_versions():
+        if len(warmed) >= max_templates:
+            break
+        if version['name'] in warmed:
+            continue  # newest version first
+        record = file_store.get_template(version['template_id'])
+        if record is None or not os.path.exists(record['path']):
+            continue
+        try:
+            template_registry.preprocess(record['path'], record['kind'])
+        except ValueError as e:
+            app.logger.warning("Could not warm template %s: %s", version['name'], e)
+            continue
+        warmed.append(version['name'])
+    for field in certificate_layout()['fields']:
+        glyph_metrics(field.get('font', 'arialbd.ttf'), int(field.get('size', 80)))
+    # Threads don't survive fork and neither may SQLite connections
+    file_store.close()
+    return {'templates': warmed, 'seconds': round(time.perf_counter() - started, 3)}
+
+if app.config['WARM_UP_ON_IMPORT']:
+    warm_up()
@@ -0,0 +1,63 @@
+import io
+import os
+import sys
+import tempfile
+
+import docx
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app creates its upload, output and registry folders relative to the
+# working directory when it is imported, so keep them out of the checkout
+os.chdir(tempfile.mkdtemp(prefix='docgen-tests-'))
+os.environ.setdefault('PDF_CONVERTER', 'fake')
+sys.path.insert(0, ROOT)
+
+import app  # noqa: E402,F401  (registers the routes)
+from docgen.cache import output_cache  # noqa: E402
+from docgen.converters import FakePdfConverter, set_pdf_converter  # noqa: E402
+from docgen.rosters import TRANSCRIPT_COLUMNS  # noqa: E402
+
+GRADE_COLUMNS = [column for column in TRANSCRIPT_COLUMNS if column not in ('student_id', 'first_name', 'last_name')]
+
+
+@pytest.fixture(autouse=True)
+def fake_converter(monkeypatch):
+    converter = FakePdfConverter()
+    set_pdf_converter(converter)
+    monkeypatch.setattr(output_cache, 'enabled', False)
+    return converter
+
+
+@pytest.fixture
+def transcript_template(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("ID: {{ student_id }} Name: {{ first_name }} {{ last_name }} Date: {{ cur_date }}")
+    table = document.add_table(rows=len(GRADE_COLUMNS) // 2, cols=2)
+    for row, (subject, grade) in enumerate(zip(GRADE_COLUMNS[::2], GRADE_COLUMNS[1::2])):
+        table.cell(row, 0).text = "{{ %s }}" % subject
+        table.cell(row, 1).text = "{{ %s }}" % grade
+    document.sections[0].header.paragraphs[0].text = "Transcript of {{ last_name }}"
+    path = tmp_path / 'transcript.docx'
+    document.save(path)
+    return str(path)
+
+
+def write_transcript_roster(path, rows, changed=()):
+    """A CSV roster of `rows` students; students in `changed` get a different first grade"""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(','.join(['ID', 'First', 'Last'] + GRADE_COLUMNS) + '\n')
+        for i in range(rows):
+            grades = [str(j + (100 if i in changed else 0)) for j in range(len(GRADE_COLUMNS))]
+            f.write(','.join([f"S{i:04d}", f"First{i}", f"Last{i}"] + grades) + '\n')
+    return str(path)
+
+
+def document_text(path_or_bytes):
+    source = io.BytesIO(path_or_bytes) if isinstance(path_or_bytes, bytes) else path_or_bytes
+    document = docx.Document(source)
+    text = [p.text for p in document.paragraphs]
+    text += [cell.text for table in document.tables for row in table.rows for cell in row.cells]
+    text += [p.text for section in document.sections for p in section.header.paragraphs]
+    return text
@@ -0,0 +1,146 @@
+import json
+import time
+
+import pytest
+
+from docgen import app
+from docgen.rosters import TRANSCRIPT_COLUMNS
+
+from conftest import write_transcript_roster
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def template_id(client, transcript_template):
+    with open(transcript_template, 'rb') as f:
+        response = client.post('/api/templates', data={'file': (f, 'transcript.docx')})
+    assert response.status_code == 201
+    return response.get_json()['template_id']
+
+
+def student(i):
+    record = {column: f"{column} {i}" for column in TRANSCRIPT_COLUMNS}
+    record.update(student_id=f"S{i:04d}", first_name=f"First{i}", last_name=f"Last{i}")
+    return record
+
+
+def wait_for(client, status_url, timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        status = client.get(status_url).get_json()
+        if status['status'] in ('done', 'failed') or time.time() > deadline:
+            return status
+        time.sleep(0.05)
+
+
+def test_json_records_become_a_job(client, template_id):
+    response = client.post('/api/jobs', json={'document_type': 'transcript', 'template_id': template_id,
+                                              'format': 'doc', 'records': [student(i) for i in range(3)]})
+    assert response.status_code == 202
+    job = response.get_json()
+    assert job['rows_total'] == 3
+
+    status = wait_for(client, job['status_url'])
+    assert (status['status'], status['rows_done'], status['file_count']) == ('done', 3, 3)
+    files = client.get(job['files_url']).get_json()
+    assert files['total'] == 3
+    assert [f['name'] for f in files['files']] == ['First0 Last0', 'First1 Last1', 'First2 Last2']
+
+
+def test_ndjson_records_are_streamed_in(client, template_id):
+    body = ''.join(json.dumps(student(i)) + '\n' for i in range(4))
+    response = client.post(f'/api/jobs?document_type=transcript&template_id={template_id}&format=doc',
+                           data=body, content_type='application/x-ndjson')
+    assert response.status_code == 202
+    assert wait_for(client, response.get_json()['status_url'])['rows_done'] == 4
+
+
+@pytest.mark.parametrize('settings, status, error', [
+    ({'document_type': 'diploma'}, 400, "Unknown document_type"),
+    ({'format': 'docx'}, 400, "format must be"),
+    ({'issue_date': '01/05/2030'}, 400, "issue_date must be"),
+    ({'template_id': 'missing'}, 404, "Unknown template_id"),
+    ({'records': [{'nickname': 'Al'}]}, 400, "unknown fields: nickname"),
+    ({'records': []}, 400, "No records"),
+])
+def test_bad_requests_are_refused(client, template_id, settings, status, error):
+    body = dict({'document_type': 'transcript', 'template_id': template_id, 'records': [student(0)]}, **settings)
+    response = client.post('/api/jobs', json=body)
+    assert response.status_code == status
+    assert error in response.get_json()['error']
+
+
+def start_upload(client, content, **details):
+    body = dict({'kind': 'roster', 'filename': 'roster.csv', 'size': len(content), 'document_type': 'transcript'},
+                **details)
+    response = client.post('/api/uploads', json=body)
+    assert response.status_code == 201
+    return response.get_json()['upload_url']
+
+
+def send(client, upload_url, offset, chunk):
+    return client.patch(upload_url, data=chunk, headers={'Upload-Offset': str(offset)})
+
+
+def test_roster_arrives_in_chunks_and_feeds_one_job(client, template_id, tmp_path):
+    content = open(write_transcript_roster(tmp_path / 'roster.csv', 3), 'rb').read()
+    upload_url = start_upload(client, content)
+
+    first = content.index(b'\n') + 10
+    response = send(client, upload_url, 0, content[:first])
+    assert response.status_code == 200
+    assert response.headers['Upload-Offset'] == str(first)
+    assert response.get_json()['result']['header'][:3] == ['ID', 'First', 'Last']  # checked before the rest came
+    # A chunk sent again, or out of order, is refused with where to resume
+    conflict = send(client, upload_url, 0, content[:first])
+    assert conflict.status_code == 409 and conflict.get_json()['offset'] == first
+
+    done = send(client, upload_url, first, content[first:]).get_json()
+    assert (done['status'], done['result']['rows']) == ('complete', 3)
+    assert client.get(upload_url).get_json()['offset'] == len(content)
+
+    upload_id = done['upload_id']
+    job = {'document_type': 'transcript', 'template_id': template_id, 'format': 'doc', 'roster_upload': upload_id}
+    response = client.post('/api/jobs', json=job)
+    assert response.status_code == 202
+    assert wait_for(client, response.get_json()['status_url'])['rows_done'] == 3
+    again = client.post('/api/jobs', json=job)
+    assert again.status_code == 400 and 'already used' in again.get_json()['error']
+
+
+def test_wrong_header_fails_on_the_first_chunk(client):
+    content = b'Name,Grade\nAnn,90\n' + b'Bob,80\n' * 1000
+    upload_url = start_upload(client, content)
+    response = send(client, upload_url, 0, content[:64])
+    assert response.status_code == 422
+    upload = response.get_json()
+    assert upload['status'] == 'failed' and upload['error']
+    assert send(client, upload_url, 64, content[64:]).status_code == 409
+
+
+@pytest.mark.parametrize('content, sent, error', [
+    (b'ID,First,Last\n', b'ID,First,Last\nS1,Ann,Lee\n', "longer than the size"),
+    (b'PK\x03\x04' + b'\0' * 60, b'PK\x03\x04' + b'\0' * 60, "Excel workbook, not a .csv"),
+])
+def test_bad_bytes_are_refused(client, content, sent, error):
+    upload_url = start_upload(client, content, document_type=None)
+    response = send(client, upload_url, 0, sent)
+    assert response.status_code == 422
+    assert error in response.get_json()['error']
+
+
+@pytest.mark.parametrize('details, error', [
+    ({'filename': 'roster.txt'}, "Rosters must be"),
+    ({'kind': 'template', 'filename': 'letter.pdf'}, "Templates must be"),
+    ({'size': 0}, "size must be"),
+    ({'document_type': 'diploma'}, "Unknown document_type"),
+])
+def test_uploads_are_checked_before_any_bytes(client, details, error):
+    body = dict({'kind': 'roster', 'filename': 'roster.csv', 'size': 10}, **details)
+    response = client.post('/api/uploads', json=body)
+    assert response.status_code == 400
+    assert error in response.get_json()['error']
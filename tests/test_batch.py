@@ -0,0 +1,109 @@
+import os
+from datetime import datetime
+
+import pytest
+
+from docgen import app, rosters
+from docgen.converters import FakePdfConverter, set_pdf_converter
+from docgen.batch import batch_worker_budget
+from docgen.cache import output_cache
+from docgen.generators import generate_transcripts
+
+from conftest import write_transcript_roster
+
+
+@pytest.fixture(params=[1, 4], ids=['serial', 'pool'])
+def workers(request, monkeypatch):
+    monkeypatch.setitem(app.config, 'BATCH_WORKERS', request.param)
+    monkeypatch.setattr(batch_worker_budget, 'total', request.param)
+    return request.param
+
+
+def run_transcripts(roster, template, output_root, file_format='doc', previous_files=None):
+    rows = []
+
+    def on_row(index, files, error):
+        rows.append((index, files, error))
+
+    ok, _ = generate_transcripts(roster, template, file_format, on_row=on_row,
+                                 previous_files=previous_files, output_root=str(output_root))
+    assert ok
+    return rows
+
+
+@pytest.mark.parametrize('file_format', ['doc', 'both'])
+def test_rows_reach_on_row_in_order(tmp_path, transcript_template, workers, file_format):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 30)
+    rows = run_transcripts(roster, transcript_template, tmp_path / 'out', file_format)
+    assert [index for index, _, _ in rows] == list(range(2, 32))
+    assert all(error is None for _, _, error in rows)
+    formats = {f['format'] for _, files, _ in rows for f in files}
+    assert formats == ({'docx'} if file_format == 'doc' else {'docx', 'pdf'})
+
+
+def test_pool_workers_use_the_parent_settings(tmp_path, transcript_template, monkeypatch):
+    # Workers start from a forkserver, so settings changed after import must reach them
+    monkeypatch.setitem(app.config, 'BATCH_WORKERS', 4)
+    monkeypatch.setattr(batch_worker_budget, 'total', 4)
+    monkeypatch.setattr(output_cache, 'folder', str(tmp_path / 'cache'))
+    monkeypatch.setattr(output_cache, 'enabled', True)
+    monkeypatch.setattr(output_cache, '_size', None)
+
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 20)
+    run_transcripts(roster, transcript_template, tmp_path / 'first')
+    assert len(list((tmp_path / 'cache').rglob('*.docx'))) == 20
+    again = run_transcripts(roster, transcript_template, tmp_path / 'again')
+    assert all(f['cached'] for _, files, _ in again for f in files)
+
+
+def test_pdf_only_rows_convert_from_memory(tmp_path, transcript_template, workers, fake_converter, monkeypatch):
+    def staged(pairs):
+        raise AssertionError("pdf-only rows should not be staged for a converter that takes bytes")
+    monkeypatch.setattr(fake_converter, 'convert_many', staged)
+
+    rows = run_transcripts(write_transcript_roster(tmp_path / 'roster.csv', 10), transcript_template,
+                           tmp_path / 'out', 'pdf')
+    files = [f for _, files, _ in rows for f in files]
+    assert len(files) == 10 and {f['format'] for f in files} == {'pdf'}
+    assert all(open(f['path'], 'rb').read(5) == b'%PDF-' for f in files)
+    assert not list((tmp_path / 'out').rglob('*.docx'))
+
+
+@pytest.mark.parametrize('file_format', ['doc', 'both'])
+def test_carried_over_rows_keep_row_order(tmp_path, transcript_template, workers, file_format):
+    first = run_transcripts(write_transcript_roster(tmp_path / 'first.csv', 30), transcript_template,
+                            tmp_path / 'first', file_format)
+    previous_files = [f for _, files, _ in first for f in files]
+
+    changed = set(range(1, 30, 2))
+    again = run_transcripts(write_transcript_roster(tmp_path / 'again.csv', 30, changed), transcript_template,
+                            tmp_path / 'again', file_format, previous_files)
+    assert [index for index, _, _ in again] == list(range(2, 32))
+    for index, files, _ in again:
+        carried = all(f.get('carried') for f in files)
+        assert carried == (index - 2 not in changed)
+        assert all(os.path.exists(f['path']) for f in files)
+
+
+def test_carry_over_follows_issue_date_and_converter(tmp_path, transcript_template, monkeypatch):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 5)
+    first = run_transcripts(roster, transcript_template, tmp_path / 'first', 'both')
+    previous_files = [f for _, files, _ in first for f in files]
+
+    again = run_transcripts(roster, transcript_template, tmp_path / 'again', 'both', previous_files)
+    assert all(f.get('carried') for _, files, _ in again for f in files)
+
+    class Tomorrow(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2099, 1, 2)
+    with monkeypatch.context() as patch:
+        patch.setattr(rosters, 'datetime', Tomorrow)
+        redated = run_transcripts(roster, transcript_template, tmp_path / 'redated', 'both', previous_files)
+    assert not any(f.get('carried') for _, files, _ in redated for f in files)
+
+    class OtherConverter(FakePdfConverter):
+        name = 'other'
+    set_pdf_converter(OtherConverter())
+    converted = run_transcripts(roster, transcript_template, tmp_path / 'converted', 'both', previous_files)
+    assert not any(f.get('carried') for _, files, _ in converted for f in files)
@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+from docgen import app
+from docgen.cache import OutputCache, output_cache
+from docgen.generators import generate_transcripts
+
+from conftest import document_text, write_transcript_roster
+
+
+@pytest.fixture
+def cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(output_cache, 'folder', str(tmp_path / 'cache'))
+    monkeypatch.setattr(output_cache, 'enabled', True)
+    monkeypatch.setattr(output_cache, '_size', None)
+    for counter in ('hits', 'misses', 'evictions'):
+        monkeypatch.setattr(output_cache, counter, 0)
+    return output_cache
+
+
+def generate(roster, template, output_root, issue_date=None):
+    files = []
+    ok, _ = generate_transcripts(roster, template, 'doc', on_row=lambda i, f, e: files.extend(f or []),
+                                 output_root=str(output_root), issue_date=issue_date)
+    assert ok
+    return files
+
+
+def test_pinned_issue_date_is_rendered_and_reuses_cached_documents(tmp_path, transcript_template, cache):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 3)
+    first = generate(roster, transcript_template, tmp_path / 'first', '2030-05-01')
+    assert not any(f.get('cached') for f in first)
+    assert any('Date: May 01, 2030' in text for text in document_text(first[0]['path']))
+
+    again = generate(roster, transcript_template, tmp_path / 'again', '2030-05-01')
+    assert all(f.get('cached') for f in again)
+
+    redated = generate(roster, transcript_template, tmp_path / 'redated', '2030-05-02')
+    assert not any(f.get('cached') for f in redated)
+
+
+def test_lookups_are_counted(tmp_path, transcript_template, cache):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 3)
+    first = generate(roster, transcript_template, tmp_path / 'first')
+    generate(roster, transcript_template, tmp_path / 'again')
+    stats = app.test_client().get('/cache/stats').get_json()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (3, 3, 0.5)
+    assert stats['bytes'] == sum(os.path.getsize(f['path']) for f in first)
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = OutputCache(str(tmp_path / 'cache'), max_bytes=350)
+
+    def store(key):
+        source = tmp_path / f"{key}.docx"
+        source.write_bytes(b'x' * 100)
+        cache.store(key, 'docx', str(source))
+    for age, key in enumerate(['aa01', 'bb02', 'cc03']):
+        store(key)
+        os.utime(cache._path(key, 'docx'), (age, age))
+    assert cache.fetch('aa01', 'docx', str(tmp_path / 'hit.docx'))  # now the most recently used
+
+    store('dd04')  # 400 bytes: back under 90% of the budget, oldest first
+    assert [os.path.exists(cache._path(key, 'docx')) for key in ('aa01', 'bb02', 'cc03', 'dd04')] == \
+        [True, False, True, True]
+    assert (cache.stats()['evictions'], cache.size()) == (1, 300)
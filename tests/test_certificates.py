@@ -0,0 +1,60 @@
+import unicodedata
+
+import pytest
+
+from docgen.generators import CertificateLayout, GlyphMetrics, glyph_metrics, laid_out_rows, load_font
+
+
+class MonospaceFont:
+    """10px per character; alone, a combining mark takes a box of its own like in most fonts"""
+
+    def getlength(self, text):
+        if len(text) == 1:
+            return 10.0
+        return 10.0 * sum(1 for char in text if not unicodedata.category(char).startswith('M'))
+
+
+def test_widths_match_measuring_each_text():
+    font = load_font('missing-font.ttf', 40)
+    texts = ['Ann Lee', '', 'Sokha Chan', 'Ann Lee', 'Émile Zola']
+    assert list(glyph_metrics('missing-font.ttf', 40).widths(texts)) == \
+        pytest.approx([font.getlength(text) for text in texts])
+
+
+def test_texts_with_combining_marks_are_measured_whole():
+    metrics = GlyphMetrics(MonospaceFont())
+    # "ស៊ុន": two letters and two combining signs
+    assert list(metrics.widths(['Ann', 'ស៊ុន', 'é'])) == [30.0, 20.0, 10.0]
+
+
+def layout(**field):
+    spec = {'fields': [dict({'column': 'name', 'y': 100, 'x': 500, 'size': 80, 'max_width': 400}, **field)]}
+    layout = CertificateLayout(spec, 1000, 700)
+    layout.fields[0].metrics = GlyphMetrics(MonospaceFont())
+    return layout
+
+
+def test_wide_names_shrink_in_steps_down_to_the_minimum():
+    # At size 80 a character is 10px wide, so 40 characters fill the 400px
+    rows = [['A' * 20], ['A' * 40], ['A' * 50], ['A' * 300], ['']]
+    placements = layout(min_size=30).place(rows)
+    assert [placed[0][4] for placed in placements[:4]] == [80, 80, 64, 30]
+    assert placements[4] == []
+
+    _, _, x, y, size = placements[2][0]
+    assert size % CertificateLayout.SIZE_STEP == 0
+    assert x == 500 - 500 * 64 / 80 / 2  # centred on the field
+    assert y == 100 + (80 - 64) / 2
+
+
+@pytest.mark.parametrize('align, x', [('left', 500), ('right', 300), ('center', 400)])
+def test_alignment(align, x):
+    assert layout(align=align).place([['A' * 20]])[0][0][2] == x
+
+
+def test_rows_are_laid_out_in_chunks_and_keep_their_order():
+    rows = [(index, [f"Student {index}"]) for index in range(2, 12)]
+    placed = list(laid_out_rows(iter(rows), layout(), chunk_size=3))
+    assert [index for index, _ in placed] == list(range(2, 12))
+    assert all(texts == [f"Student {index}"] and placements[0][1] == texts[0]
+               for index, (texts, placements) in placed)
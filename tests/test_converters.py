@@ -0,0 +1,147 @@
+import os
+import threading
+from xmlrpc.server import SimpleXMLRPCServer
+
+import pytest
+
+from docgen import converters
+from docgen.converters import FakePdfConverter, LibreOfficeConverter, UnoserverConverter
+
+
+def write_docx_stubs(folder, stems):
+    paths = []
+    for stem in stems:
+        path = folder / f"{stem}.docx"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'docx')
+        paths.append(str(path))
+    return paths
+
+
+@pytest.fixture
+def soffice(monkeypatch):
+    """Stands in for subprocess.run of soffice: writes a PDF per input into --outdir"""
+    runs = []
+
+    def run(command, **kwargs):
+        out_dir = command[command.index('--outdir') + 1]
+        inputs = command[command.index('--outdir') + 2:]
+        profile = next(arg for arg in command if arg.startswith('-env:UserInstallation='))
+        runs.append((profile, inputs))
+        for doc_path in inputs:
+            stem = os.path.splitext(os.path.basename(doc_path))[0]
+            if stem != 'broken':
+                with open(os.path.join(out_dir, stem + '.pdf'), 'wb') as f:
+                    f.write(FakePdfConverter.placeholder_pdf(stem))
+    monkeypatch.setattr(converters.subprocess, 'run', run)
+    return runs
+
+
+def test_libreoffice_converts_many_documents_per_run(tmp_path, soffice):
+    docs = write_docx_stubs(tmp_path, [f"student{i}" for i in range(5)])
+    # soffice names its outputs after the input stem, so a repeated stem starts a new run
+    docs += write_docx_stubs(tmp_path / 'again', ['student3'])
+    pairs = [(doc, str(tmp_path / f"out{i}.pdf")) for i, doc in enumerate(docs)]
+
+    converter = LibreOfficeConverter(batch_size=3)
+    try:
+        assert converter.convert_many(pairs) == {}
+    finally:
+        converter.close()
+    assert [len(inputs) for _, inputs in soffice] == [3, 2, 1]
+    assert len({profile for profile, _ in soffice}) == 1  # one warm profile, reused run after run
+    assert all(open(pdf_path, 'rb').read(5) == b'%PDF-' for _, pdf_path in pairs)
+
+
+def test_libreoffice_reports_documents_it_did_not_convert(tmp_path, soffice):
+    docs = write_docx_stubs(tmp_path, ['ann', 'broken', 'bob'])
+    pairs = [(doc, str(tmp_path / f"out{i}.pdf")) for i, doc in enumerate(docs)]
+    converter = LibreOfficeConverter()
+    try:
+        failures = converter.convert_many(pairs)
+    finally:
+        converter.close()
+    assert list(failures) == [docs[1]]
+    assert len(soffice) == 1
+
+
+class FakeUnoserver:
+    """Stands in for an unoserver process: an XML-RPC convert() on the port it was given"""
+
+    def __init__(self, command, **kwargs):
+        port = int(command[command.index('--port') + 1])
+        self.server = SimpleXMLRPCServer(('127.0.0.1', port), logRequests=False, allow_none=True)
+        self.server.register_function(self.convert, 'convert')
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.returncode = None
+        self.converted = 0
+
+    def convert(self, inpath, indata, outpath, convert_to):
+        with open(outpath, 'wb') as f:
+            f.write(FakePdfConverter.placeholder_pdf(os.path.basename(outpath)))
+        self.converted += 1
+
+    def stop_listening(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def poll(self):
+        return self.returncode
+
+    def kill(self):
+        if self.returncode is None:
+            self.stop_listening()
+            self.returncode = -9
+
+    terminate = kill
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+@pytest.fixture
+def launched(monkeypatch):
+    listeners = []
+
+    def popen(command, **kwargs):
+        listeners.append(FakeUnoserver(command))
+        return listeners[-1]
+    monkeypatch.setattr(converters.subprocess, 'Popen', popen)
+    return listeners
+
+
+@pytest.fixture
+def unoserver(launched):
+    converter = UnoserverConverter(size=1, start_timeout=5)
+    yield converter
+    converter.close()
+
+
+def test_unoserver_restarts_a_listener_that_exited(tmp_path, unoserver, launched):
+    unoserver.convert_bytes(b'docx', str(tmp_path / 'first.pdf'))
+    launched[0].kill()  # the office process died between documents
+
+    unoserver.convert_bytes(b'docx', str(tmp_path / 'second.pdf'))
+    assert len(launched) == 2
+    assert [listener.converted for listener in launched] == [1, 1]
+    assert (tmp_path / 'second.pdf').read_bytes().startswith(b'%PDF-')
+
+
+def test_unoserver_retries_a_call_on_a_fresh_listener(tmp_path, unoserver, launched):
+    launched[0].stop_listening()  # still running, but no longer answering
+
+    unoserver.convert_bytes(b'docx', str(tmp_path / 'out.pdf'))
+    assert len(launched) == 2
+    assert launched[0].returncode is not None  # the unresponsive one was killed
+    assert launched[1].converted == 1
+
+
+def test_unoserver_spreads_documents_over_its_listeners(tmp_path, launched):
+    converter = UnoserverConverter(size=2, start_timeout=5)
+    try:
+        items = [(b'docx', str(tmp_path / f"out{i}.pdf")) for i in range(6)]
+        assert converter.convert_many_bytes(items) == {}
+    finally:
+        converter.close()
+    assert sum(listener.converted for listener in launched) == 6
+    assert all(os.path.exists(pdf_path) for _, pdf_path in items)
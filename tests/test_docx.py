@@ -0,0 +1,91 @@
+import io
+import zipfile
+
+import docx
+import pytest
+
+from docgen import app
+from docgen.rendering import docx_template_cache, render_docx
+from docgen.generators import generate_transcripts, merge_docx
+
+from conftest import document_text, write_transcript_roster
+
+
+def render_with_docxtpl(monkeypatch, template, context):
+    with monkeypatch.context() as patch:
+        patch.setitem(app.config, 'DOCX_FAST_PATH', False)
+        return render_docx(template, context)
+
+
+def context_for(template, value):
+    return {name: value(name) for name in docx_template_cache.variables(template)}
+
+
+@pytest.mark.parametrize('value', [
+    lambda name: f"v_{name}",
+    lambda name: f"{name} ឈ្មោះ \"quoted\"",
+    lambda name: 42,
+], ids=['plain', 'unicode', 'number'])
+def test_fast_path_matches_docxtpl(monkeypatch, transcript_template, value):
+    assert docx_template_cache.compiled(transcript_template) is not None
+    context = context_for(transcript_template, value)
+    fast = render_docx(transcript_template, context)
+    assert zipfile.ZipFile(io.BytesIO(fast)).testzip() is None
+    assert document_text(fast) == document_text(render_with_docxtpl(monkeypatch, transcript_template, context))
+
+
+def test_fast_path_falls_back_for_line_breaks(monkeypatch, transcript_template):
+    context = context_for(transcript_template, lambda name: name)
+    context['first_name'] = 'line one\nline two'
+    assert docx_template_cache.compiled(transcript_template).render(context) is None
+    assert document_text(render_docx(transcript_template, context)) == \
+        document_text(render_with_docxtpl(monkeypatch, transcript_template, context))
+
+
+def test_fast_path_treats_missing_values_like_docxtpl(monkeypatch, transcript_template):
+    context = context_for(transcript_template, lambda name: name)
+    del context['logic']
+    context['l_g'] = None
+    assert document_text(render_docx(transcript_template, context)) == \
+        document_text(render_with_docxtpl(monkeypatch, transcript_template, context))
+
+
+def test_templates_with_logic_are_left_to_docxtpl(tmp_path):
+    document = docx.Document()
+    document.add_paragraph("{% if honours %}With honours, {% endif %}{{ first_name }}")
+    template = str(tmp_path / 'logic.docx')
+    document.save(template)
+    assert docx_template_cache.compiled(template) is None
+    context = {'honours': True, 'first_name': 'Ann'}
+    assert document_text(render_docx(template, context))[0] == 'With honours, Ann'
+
+
+def test_merge_docx_keeps_every_student_in_order(tmp_path, transcript_template):
+    paths = []
+    for i in range(3):
+        context = context_for(transcript_template, lambda name: f"{name}{i}")
+        path = tmp_path / f"student{i}.docx"
+        path.write_bytes(render_docx(transcript_template, context))
+        paths.append(str(path))
+    merged = str(tmp_path / 'cohort.docx')
+    merge_docx(paths, merged)
+
+    assert zipfile.ZipFile(merged).testzip() is None
+    text = document_text(merged)
+    positions = [next(i for i, line in enumerate(text) if f"first_name{n}" in line) for n in range(3)]
+    assert positions == sorted(positions)
+    assert sum(1 for line in text if line.startswith('ID: ')) == 3
+
+
+def test_combined_transcripts_are_one_document_and_one_pdf(tmp_path, transcript_template):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 4)
+    rows = []
+    ok, files = generate_transcripts(roster, transcript_template, 'both', on_row=lambda *row: rows.append(row),
+                                     output_root=str(tmp_path / 'out'), combine=True)
+    assert ok
+    assert [f['format'] for f in files] == ['docx', 'pdf']
+    assert files[0]['name'] == 'Transcript cohort (4 students)'
+    assert sum(1 for line in document_text(files[0]['path']) if line.startswith('ID: ')) == 4
+    # Every row is reported, then the cohort files once
+    assert [index for index, _, _ in rows] == [2, 3, 4, 5, None]
+    assert rows[-1][1] == files
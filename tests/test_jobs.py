@@ -0,0 +1,159 @@
+import threading
+import time
+
+import pytest
+
+from docgen import api, app, jobs, views
+from docgen.batch import WorkerBudget
+from docgen.jobs import JobQueue, JobQueueFull
+
+from conftest import write_transcript_roster
+
+
+def use_queue(monkeypatch, queue):
+    monkeypatch.setattr(jobs.retention_sweeper, 'start', lambda: None)
+    for module in (jobs, views, api):
+        monkeypatch.setattr(module, 'job_queue', queue)
+    return queue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    return use_queue(monkeypatch, JobQueue(workers=1))
+
+
+@pytest.fixture
+def full_queue(monkeypatch):
+    # No runner threads, so the one job it admits keeps waiting
+    queue = use_queue(monkeypatch, JobQueue(workers=0, limit=1))
+    queue.submit(lambda on_row: (True, None), (), 'transcript')
+    return queue
+
+
+def poll(client, job_id, until=('done', 'failed'), timeout=30):
+    deadline = time.time() + timeout
+    while True:
+        status = client.get(f'/jobs/{job_id}').get_json()
+        if status['status'] in until or time.time() > deadline:
+            return status
+        time.sleep(0.05)
+
+
+def test_job_reports_progress_until_it_finishes(queue):
+    first_row, finish = threading.Event(), threading.Event()
+
+    def target(on_row):
+        on_row(0, [], None)
+        first_row.set()
+        finish.wait(10)
+        on_row(1, [], 'row 1 is missing a name')
+        return True, None
+    job = queue.submit(target, (), 'transcript', total=2)
+    client = app.test_client()
+
+    assert first_row.wait(10)
+    status = client.get(f'/jobs/{job.id}').get_json()
+    assert (status['status'], status['rows_done'], status['rows_total']) == ('running', 1, 2)
+
+    finish.set()
+    status = poll(client, job.id)
+    assert status['status'] == 'done'
+    assert (status['rows_done'], status['rows_failed']) == (2, 1)
+    assert status['errors'] == [{'row': 1, 'error': 'row 1 is missing a name'}]
+
+
+def test_job_that_raises_is_reported_failed(queue):
+    def target(on_row):
+        raise RuntimeError('template is corrupt')
+    job = queue.submit(target, (), 'transcript')
+    status = poll(app.test_client(), job.id)
+    assert status['status'] == 'failed'
+    assert status['error'] == 'template is corrupt'
+
+
+def test_unknown_job_is_not_found(queue):
+    assert app.test_client().get('/jobs/no-such-job').status_code == 404
+
+
+def test_upload_returns_before_the_documents_are_generated(queue, tmp_path, transcript_template):
+    roster = write_transcript_roster(tmp_path / 'roster.csv', 3)
+    client = app.test_client()
+    with open(transcript_template, 'rb') as template, open(roster, 'rb') as excel:
+        response = client.post('/upload', data={
+            'document_type': 'transcript', 'file_format': 'doc', 'data_method': 'excel',
+            'template_file': (template, 'transcript.docx'), 'excel_file': (excel, 'roster.csv'),
+        })
+    assert response.status_code == 302
+    job_id = response.headers['Location'].split('session_id=')[1].split('&')[0]
+
+    status = poll(client, job_id)
+    assert status['status'] == 'done'
+    assert (status['rows_done'], status['file_count']) == (3, 3)
+
+
+def test_submit_beyond_the_waiting_limit_is_refused(full_queue):
+    assert full_queue.full()
+    with pytest.raises(JobQueueFull):
+        full_queue.submit(lambda on_row: (True, None), (), 'transcript')
+    assert full_queue.stats() == {'running': 0, 'waiting': 1, 'limit': 1}
+
+
+def test_a_full_queue_turns_work_away_before_reading_it(full_queue):
+    client = app.test_client()
+    response = client.post('/api/jobs', json={'document_type': 'transcript', 'template_id': 'x', 'records': []})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '60'
+
+    response = client.post('/upload', data={'document_type': 'transcript'})
+    assert response.status_code == 302
+    with client.session_transaction() as session:
+        assert 'busy' in session['_flashes'][0][1]
+
+
+def test_waiting_jobs_start_only_with_enough_memory(monkeypatch):
+    queue = JobQueue(workers=0, min_available=1 << 30)
+    queue._waiting.append(object())
+    monkeypatch.setattr(jobs, 'host_available_memory', lambda: 1 << 20)
+    assert queue._admissible()  # nothing running: never starve
+    queue._running = 1
+    assert not queue._admissible()
+    monkeypatch.setattr(jobs, 'host_available_memory', lambda: 2 << 30)
+    assert queue._admissible()
+
+
+def test_a_job_past_its_output_quota_is_stopped(queue, tmp_path, monkeypatch):
+    monkeypatch.setitem(app.config, 'RETENTION_JOB_MAX_BYTES', 1000)
+    output = tmp_path / 'big.docx'
+    output.write_bytes(b'x' * 600)
+    rows = []
+
+    def target(on_row):
+        for index in range(2, 10):
+            on_row(index, [{'name': f'Student {index}', 'filename': f'{index}.docx', 'type': 'transcript',
+                            'format': 'docx', 'path': str(output)}], None)
+            rows.append(index)
+        return True, None
+    job = queue.submit(target, (), 'transcript')
+    status = poll(app.test_client(), job.id)
+    assert status['status'] == 'failed'
+    assert 'per-job limit of 1,000 bytes' in status['error']
+    assert rows == [2]
+
+
+def test_batches_share_the_worker_budget():
+    budget = WorkerBudget(4)
+    started, finish = threading.Event(), threading.Event()
+
+    def another_batch():
+        with budget.reserve(2):
+            started.set()
+            finish.wait(5)
+    with budget.reserve(3) as first, budget.reserve(3) as second:
+        assert (first, second, budget.in_use) == (3, 1, 4)
+        waiting = threading.Thread(target=another_batch)
+        waiting.start()
+        assert not started.wait(0.2)  # every worker is taken
+    assert started.wait(5) and budget.in_use == 2
+    finish.set()
+    waiting.join(5)
+    assert budget.in_use == 0
@@ -0,0 +1,117 @@
+import os
+import time
+
+import pytest
+
+from docgen import app, jobs, views
+from docgen.rendering import write_bytes
+from docgen.store import file_store
+from docgen.jobs import JobQueue, RetentionSweeper, job_output_root
+
+
+@pytest.fixture
+def sweeper(monkeypatch):
+    sweeper = RetentionSweeper(file_store)
+    monkeypatch.setattr(sweeper, 'start', lambda: None)
+    monkeypatch.setattr(jobs, 'retention_sweeper', sweeper)
+    monkeypatch.setattr(views, 'retention_sweeper', sweeper)
+    return sweeper
+
+
+@pytest.fixture
+def queue(monkeypatch, sweeper):
+    # No runner threads, so submitted jobs stay queued until a test moves them on
+    queue = JobQueue(workers=0)
+    monkeypatch.setattr(jobs, 'job_queue', queue)
+    monkeypatch.setattr(views, 'job_queue', queue)
+    return queue
+
+
+def job_with_file(queue):
+    job = queue.submit(lambda on_row: (True, None), (), 'transcript')
+    path = os.path.join(job_output_root(job.id), 'Transcripts', 'transcript.docx')
+    os.makedirs(os.path.dirname(path))
+    write_bytes(path, b'docx')
+    file_store.record(job, [{'filename': 'transcript.docx', 'type': 'transcript', 'format': 'docx',
+                                    'path': path}], [4])
+    return job, path
+
+
+def test_cleanup_cancels_a_queued_job(queue, sweeper):
+    job, path = job_with_file(queue)
+    response = app.test_client().get(f'/cleanup/{job.id}')
+    assert response.headers['Location'].endswith('/')
+    record = file_store.get_job(job.id)
+    assert record['status'] == 'failed' and 'Cancelled' in record['error']
+    assert not queue.stats()['waiting']
+
+    sweeper.sweep()
+    assert not file_store.has_session(job.id) and not os.path.exists(path)
+
+
+def test_cleanup_waits_for_a_running_job(queue, sweeper):
+    job, path = job_with_file(queue)
+    queue._waiting.clear()
+    job.status = 'running'
+    job.save()
+
+    response = app.test_client().get(f'/cleanup/{job.id}')
+    assert '/results' in response.headers['Location']
+    sweeper.sweep()
+    assert file_store.has_session(job.id) and os.path.exists(path)
+
+    job.status = 'done'
+    job.save()
+    sweeper.sweep()
+    assert not file_store.has_session(job.id) and not os.path.exists(path)
+
+
+def finish(queue, job, finished):
+    queue.cancel(job.id)
+    job.status = 'done'
+    job.finished = finished
+    job.save()
+
+
+def test_sweep_removes_expired_jobs_with_their_uploads(queue, sweeper, monkeypatch):
+    monkeypatch.setattr(file_store, 'ttl', 3600)
+    expired, expired_path = job_with_file(queue)
+    upload = os.path.join(app.config['UPLOAD_FOLDER'], f'{expired.id}_roster.csv')
+    write_bytes(upload, b'ID\n')
+    expired.uploads = [upload]
+    finish(queue, expired, time.time() - 7200)
+    recent, recent_path = job_with_file(queue)
+    finish(queue, recent, time.time())
+
+    sweeper.sweep()
+    assert not file_store.has_session(expired.id)
+    assert not os.path.exists(expired_path) and not os.path.exists(job_output_root(expired.id))
+    assert not os.path.exists(upload)
+    assert file_store.has_session(recent.id) and os.path.exists(recent_path)
+    stats = sweeper.stats()
+    assert (stats['jobs_removed'], stats['files_removed'], stats['uploads_removed']) == (1, 1, 1)
+
+
+def test_size_budget_removes_the_oldest_finished_job(queue, sweeper):
+    oldest, oldest_path = job_with_file(queue)
+    finish(queue, oldest, 1)
+    newer, newer_path = job_with_file(queue)
+    finish(queue, newer, time.time())
+
+    sweeper.max_bytes = file_store.total_bytes() - 1
+    sweeper.sweep()
+    assert not file_store.has_session(oldest.id) and not os.path.exists(oldest_path)
+    assert file_store.has_session(newer.id) and os.path.exists(newer_path)
+
+
+def test_stray_uploads_are_removed_once_old(sweeper):
+    folder = app.config['UPLOAD_FOLDER']
+    stale, fresh = os.path.join(folder, 'stale_roster.csv'), os.path.join(folder, 'fresh_roster.csv')
+    for path in (stale, fresh):
+        write_bytes(path, b'ID\n')
+    old = time.time() - sweeper.upload_max_age - 60
+    os.utime(stale, (old, old))
+
+    sweeper.sweep_uploads()
+    assert not os.path.exists(stale) and os.path.exists(fresh)
+    os.remove(fresh)
@@ -0,0 +1,67 @@
+import openpyxl
+import pytest
+
+from docgen.api import write_record_roster
+from docgen.rosters import _csv_value, iter_roster_records, iter_roster_rows
+
+
+@pytest.mark.parametrize('cell, value', [
+    ('12', 12),
+    ('-3', -3),
+    ('0', 0),
+    ('85.5', 85.5),
+    ('1.0', 1.0),
+    ('', None),
+    # Kept as written: IDs, padded or non-canonical numbers and words
+    ('007', '007'),
+    ('85.50', '85.50'),
+    ('-0', '-0'),
+    (' 12', ' 12'),
+    ('1e5', '1e5'),
+    ('1_000', '1_000'),
+    ('NaN', 'NaN'),
+    ('Infinity', 'Infinity'),
+    ('S0001', 'S0001'),
+])
+def test_csv_value_types_only_canonical_numbers(cell, value):
+    assert _csv_value(cell) == value
+    assert type(_csv_value(cell)) is type(value)
+
+
+def test_csv_roster_rows_are_padded_and_typed(tmp_path):
+    path = tmp_path / 'roster.csv'
+    path.write_text('ID,Name,Grade\n007,Ann,85.5\n12,Bob\n', encoding='utf-8')
+    assert list(iter_roster_rows(str(path))) == [
+        ('ID', 'Name', 'Grade'),
+        ('007', 'Ann', 85.5),
+        (12, 'Bob', None),
+    ]
+
+
+def test_xlsx_roster_is_read_row_by_row(tmp_path):
+    path = str(tmp_path / 'roster.xlsx')
+    workbook = openpyxl.Workbook()
+    workbook.active.append(['ID', 'Name', 'Grade'])
+    for i in range(1000):
+        workbook.active.append([f"S{i:04d}", f"Student {i}", 60 + i % 40])
+    workbook.save(path)
+
+    records = iter_roster_records(path)
+    assert next(records) == (2, ('S0000', 'Student 0', 60))
+    assert next(records) == (3, ('S0001', 'Student 1', 61))
+    assert sum(1 for _ in records) == 998
+
+
+def test_record_roster_keeps_json_types(tmp_path):
+    path = str(tmp_path / 'records.jsonl')
+    records = [{'student_id': '007', 'first_name': '1e5', 'last_name': 'NaN', 'logic': 85.5}]
+    assert write_record_roster(records, 'transcript', path) == 1
+    header, row = iter_roster_rows(path)
+    by_column = dict(zip(header, row))
+    assert [by_column[column] for column in ('student_id', 'first_name', 'last_name', 'logic')] == \
+        ['007', '1e5', 'NaN', 85.5]
+
+
+def test_record_roster_rejects_unknown_fields(tmp_path):
+    with pytest.raises(ValueError, match='unknown fields'):
+        write_record_roster([{'nope': 1}], 'transcript', str(tmp_path / 'records.jsonl'))
@@ -0,0 +1,121 @@
+import gzip
+import hashlib
+import io
+import os
+import zipfile
+
+import docx
+import pytest
+
+from docgen import app
+from docgen.jobs import Job, job_output_root, retention_sweeper
+from docgen.store import file_store
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def stored_docx():
+    """A job with one DOCX output, recorded in the file store"""
+    job = Job('transcript', 1)
+    job.save()
+    folder = os.path.join(job_output_root(job.id), 'Transcript_Doc')
+    os.makedirs(folder)
+    path = os.path.join(folder, 'transcript_Ann.docx')
+    document = docx.Document()
+    for i in range(200):
+        document.add_paragraph(f"Line {i} of a transcript that compresses a little")
+    document.save(path)
+    entry = {'name': 'Ann', 'filename': 'transcript_Ann.docx', 'type': 'transcript', 'format': 'docx', 'path': path}
+    job.record_row(2, [entry], None)
+    yield job.id, entry
+    retention_sweeper.remove_session(job.id)
+
+
+def download(client, stored, **headers):
+    session_id, entry = stored
+    return client.get(f"/download/{session_id}/{entry['filename']}", headers=headers)
+
+
+def test_etag_is_the_content_hash(client, stored_docx):
+    response = download(client, stored_docx)
+    with open(stored_docx[1]['path'], 'rb') as f:
+        content = f.read()
+    assert response.status_code == 200
+    assert response.data == content
+    assert response.headers['ETag'] == f'"{hashlib.sha256(content).hexdigest()}"'
+    assert 'private' in response.headers['Cache-Control']
+    assert response.headers['Accept-Ranges'] == 'bytes'
+
+
+def test_content_hash_is_computed_once(client, stored_docx):
+    session_id, entry = stored_docx
+    etag = download(client, stored_docx).headers['ETag']
+    assert f'"{file_store.find(session_id, entry["filename"])["digest"]}"' == etag
+
+
+def test_if_none_match_gives_304(client, stored_docx):
+    etag = download(client, stored_docx).headers['ETag']
+    response = download(client, stored_docx, **{'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+
+
+def test_range_request(client, stored_docx):
+    full = download(client, stored_docx).data
+    response = download(client, stored_docx, Range='bytes=100-199')
+    assert response.status_code == 206
+    assert response.headers['Content-Range'] == f"bytes 100-199/{len(full)}"
+    assert response.data == full[100:200]
+
+    stale = download(client, stored_docx, Range='bytes=100-199', **{'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.data == full
+
+
+def test_gzip_variant(client, stored_docx, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTPUT_GZIP_MIN_SAVING', 0)
+    plain = download(client, stored_docx)
+    response = download(client, stored_docx, **{'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['ETag'] != plain.headers['ETag']
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain.data
+
+
+def test_accel_redirect_offloads_the_body(client, stored_docx, monkeypatch):
+    monkeypatch.setitem(app.config, 'OUTPUT_SENDFILE', 'x-accel-redirect')
+    response = download(client, stored_docx)
+    session_id, entry = stored_docx
+    assert response.status_code == 200
+    assert response.data == b''
+    assert response.headers['X-Accel-Redirect'].startswith('/protected-outputs/jobs/')
+    assert response.headers['X-Accel-Redirect'].endswith('/Transcript_Doc/transcript_Ann.docx')
+
+    cached = download(client, stored_docx, **{'If-None-Match': response.headers['ETag']})
+    assert cached.status_code == 304
+    assert 'X-Accel-Redirect' not in cached.headers
+
+
+def test_archive_filters_are_validated(client, stored_docx):
+    session_id, _ = stored_docx
+    assert client.get(f"/batch_download/{session_id}?type=transcript%22x").status_code == 400
+    assert client.get(f"/batch_download/{session_id}?format=exe").status_code == 400
+    response = client.get(f"/batch_download/{session_id}?type=transcript&format=DOCX")
+    assert response.status_code == 200
+    assert response.headers['Content-Disposition'].endswith('_transcript_docx.zip')
+
+
+def test_archive_streams_every_matching_file(client, stored_docx):
+    session_id, entry = stored_docx
+    response = client.get(f"/batch_download/{session_id}")
+    assert response.is_streamed
+    with zipfile.ZipFile(io.BytesIO(response.data)) as archive:
+        assert archive.namelist() == [entry['filename']]
+        with open(entry['path'], 'rb') as f:
+            assert archive.read(entry['filename']) == f.read()
+        # A DOCX is a zip already, so it is stored rather than deflated again
+        assert archive.getinfo(entry['filename']).compress_type == zipfile.ZIP_STORED
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+
+from docgen.rendering import docx_template_cache
+from docgen.store import template_registry
+from docgen.warmup import warm_up
+
+from conftest import ROOT
+
+HEAVY_MODULES = ('pandas', 'numpy', 'openpyxl', 'docxtpl', 'PIL.Image')
+
+
+def modules_loaded_by_import(cwd, **env):
+    script = f"import sys, app; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', script], cwd=cwd, capture_output=True, text=True, timeout=120,
+                            env=dict(os.environ, PYTHONPATH=ROOT, PDF_CONVERTER='fake', **env))
+    assert result.returncode == 0, result.stderr
+    return result.stdout.split()
+
+
+def test_importing_the_app_leaves_generation_modules_unloaded(tmp_path):
+    assert modules_loaded_by_import(tmp_path) == []
+
+
+def test_warm_up_on_import_loads_them_before_any_fork(tmp_path):
+    assert modules_loaded_by_import(tmp_path, WARM_UP='1') == list(HEAVY_MODULES)
+
+
+def test_warm_up_preprocesses_the_newest_named_templates(transcript_template):
+    with open(transcript_template, 'rb') as f:
+        record = template_registry.register(f, 'transcript.docx', 'warm-transcript')
+    docx_template_cache.clear()
+
+    assert 'warm-transcript' in warm_up()['templates']
+    digest = docx_template_cache.digest(record['path'])
+    assert digest in docx_template_cache._entries and docx_template_cache._compiled[digest] is not None
+    assert warm_up(max_templates=0)['templates'] == []
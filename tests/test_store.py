@@ -0,0 +1,123 @@
+import io
+import os
+import time
+
+import docx
+import pytest
+
+from docgen.jobs import Job
+from docgen.store import FileStore, TemplateRegistry
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = FileStore(str(tmp_path / 'store.db'), ttl=3600)
+    yield store
+    store.close()
+
+
+def add_job(store, status='done', finished=None, files=()):
+    job = Job('transcript', len(files))
+    job.status = status
+    job.finished = finished
+    store.save_job(job)
+    store.record(job, [dict(f, path=f"/outputs/{job.id}/{f['filename']}") for f in files], [10] * len(files))
+    return job
+
+
+def file_entry(name, file_format):
+    return {'filename': f"{name}.{file_format}", 'type': 'transcript', 'format': file_format}
+
+
+def test_sessions_outlive_the_process(store, tmp_path):
+    job = add_job(store, files=[file_entry('ann', 'docx'), file_entry('ann', 'pdf'), file_entry('bob', 'docx')])
+    store.close()
+
+    reopened = FileStore(str(tmp_path / 'store.db'), ttl=3600)
+    assert reopened.get_job(job.id)['status'] == 'done'
+    assert [f['filename'] for f in reopened.files(job.id)] == ['ann.docx', 'ann.pdf', 'bob.docx']
+    assert [f['filename'] for f in reopened.files(job.id, offset=1, limit=1)] == ['ann.pdf']
+    assert reopened.count(job.id, formats=['docx']) == 2
+    assert reopened.format_counts(job.id) == {'docx': 2, 'pdf': 1}
+    assert reopened.find(job.id, 'bob.docx')['path'].endswith('/bob.docx')
+    reopened.close()
+
+
+def test_only_finished_sessions_past_the_ttl_expire(store):
+    old = time.time() - 7200
+    expired = add_job(store, finished=old)
+    add_job(store, finished=time.time())
+    add_job(store, status='running')
+    assert store.expired() == [expired.id]
+
+
+def test_jobs_without_a_heartbeat_are_failed(store, monkeypatch):
+    with monkeypatch.context() as patch:
+        patch.setattr(time, 'time', lambda: 1000.0)
+        lost = add_job(store, status='running')
+    alive = add_job(store, status='running')
+
+    assert store.fail_lost_jobs(timeout=900) == [lost.id]
+    record = store.get_job(lost.id)
+    assert record['status'] == 'failed' and 'submit it again' in record['error']
+    assert store.job_status(alive.id) == 'running'
+
+
+def test_deleting_a_session_keeps_files_a_later_session_carried_over(store):
+    first = add_job(store, files=[file_entry('ann', 'docx'), file_entry('bob', 'docx')])
+    later = add_job(store)
+    carried = store.files(first.id)[0]
+    store.record(later, [dict(carried, carried=True)], [10])
+
+    assert store.delete(first.id) == [f"/outputs/{first.id}/bob.docx"]
+    assert not store.has_session(first.id)
+    assert store.files(later.id) == [dict(carried, carried=True)]
+
+
+def docx_bytes(text):
+    buffer = io.BytesIO()
+    document = docx.Document()
+    document.add_paragraph(text)
+    document.save(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def registry(store, tmp_path):
+    return TemplateRegistry(store, str(tmp_path / 'templates'))
+
+
+def test_named_templates_are_versioned_by_content(registry):
+    content = docx_bytes("{{ first_name }}")
+    first = registry.register(io.BytesIO(content), 'letter.docx', 'letter')
+    same = registry.register(io.BytesIO(content), 'copy.docx', 'letter')
+    assert (same['id'], same['version']) == (first['id'], 1)
+    assert first['variables'] == ['first_name']
+
+    second = registry.register(io.BytesIO(docx_bytes("{{ last_name }}")), 'letter.docx', 'letter')
+    assert second['version'] == 2
+    assert registry.resolve('letter')['id'] == second['id']
+    assert registry.resolve('letter@1')['id'] == first['id']
+    assert registry.resolve(first['id'])['variables'] == ['first_name']
+    assert registry.resolve('letter@3') is None and registry.resolve('letter@x') is None
+    assert len(os.listdir(registry.folder)) == 2
+
+
+def test_registering_again_refreshes_a_template_for_retention(registry, store, monkeypatch):
+    content = docx_bytes("{{ first_name }}")
+    record = registry.register(io.BytesIO(content), 'letter.docx')
+    cutoff = time.time() + 1
+    assert store.stale_templates(cutoff) == [(record['id'], record['path'])]
+
+    with monkeypatch.context() as patch:
+        patch.setattr(time, 'time', lambda: cutoff + 1)
+        registry.register(io.BytesIO(content), 'again.docx')
+    assert store.stale_templates(cutoff) == []
+
+
+def test_unreadable_templates_are_refused(registry):
+    with pytest.raises(ValueError, match='could not be read'):
+        registry.register(io.BytesIO(b'not a zip'), 'letter.docx')
+    with pytest.raises(ValueError, match='must be .docx'):
+        registry.register(io.BytesIO(b''), 'letter.pdf')
+    assert os.listdir(registry.folder) == []
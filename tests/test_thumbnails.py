@@ -0,0 +1,71 @@
+import os
+
+import pytest
+from PIL import Image
+
+from docgen import app, thumbnails
+from docgen.generators import CertificateRenderer
+from docgen.jobs import Job, job_output_root, retention_sweeper
+from docgen.thumbnails import has_thumbnail, save_thumbnail, thumbnail_path
+
+
+@pytest.fixture
+def certificate_template(tmp_path):
+    path = str(tmp_path / 'certificate.png')
+    Image.new('RGBA', (1200, 800), (0, 0, 0, 0)).save(path)
+    return path
+
+
+@pytest.fixture
+def stored_outputs(tmp_path):
+    """A job with a certificate and a PDF that have no previews yet"""
+    job = Job('certificate', 1)
+    job.save()
+    folder = os.path.join(job_output_root(job.id), 'Certificates')
+    os.makedirs(folder)
+    png = os.path.join(folder, 'certificate_Ann.png')
+    Image.new('RGB', (1200, 800), 'navy').save(png)
+    pdf = os.path.join(folder, 'transcript_Ann.pdf')
+    with open(pdf, 'wb') as f:
+        f.write(b'%PDF-1.4\n%%EOF\n')
+    entries = [{'name': 'Ann', 'filename': os.path.basename(path), 'type': 'certificate',
+                'format': os.path.splitext(path)[1][1:], 'path': path} for path in (png, pdf)]
+    job.record_row(2, entries, None)
+    yield job.id, entries
+    retention_sweeper.remove_session(job.id)
+
+
+def test_transparent_pages_are_flattened_onto_white(tmp_path):
+    path = str(tmp_path / '.thumbs' / 'page.jpg')
+    assert save_thumbnail(Image.new('RGBA', (1600, 1000), (255, 0, 0, 0)), path)
+    with Image.open(path) as thumb:
+        assert thumb.format == 'JPEG' and thumb.mode == 'RGB'
+        assert max(thumb.size) == app.config['THUMBNAIL_SIZE']
+        assert thumb.getpixel((5, 5)) == (255, 255, 255)
+
+
+def test_certificates_are_previewed_as_they_are_rendered(tmp_path, certificate_template):
+    layout = {'fields': [{'column': 'name', 'y': 0.4, 'size': 60, 'font': 'missing-font.ttf'}]}
+    entry = CertificateRenderer(certificate_template, layout).render_to_file(['Ann Lee'], str(tmp_path))
+    with Image.open(thumbnail_path(entry['path'])) as thumb:
+        assert thumb.size[0] == app.config['THUMBNAIL_SIZE']
+
+
+def test_preview_is_made_on_first_view_and_then_cached(stored_outputs):
+    session_id, (png, _) = stored_outputs
+    client = app.test_client()
+    response = client.get(f"/thumb/{session_id}/{png['filename']}")
+    assert response.status_code == 200
+    assert response.mimetype == 'image/jpeg'
+    assert response.cache_control.immutable
+    assert os.path.exists(thumbnail_path(png['path']))
+
+    again = client.get(f"/thumb/{session_id}/{png['filename']}", headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304
+
+
+def test_pdfs_go_without_a_preview_when_they_cannot_be_rasterised(stored_outputs, monkeypatch):
+    monkeypatch.setattr(thumbnails, '_pymupdf', lambda: None)
+    session_id, (_, pdf) = stored_outputs
+    assert not has_thumbnail(pdf)
+    assert app.test_client().get(f"/thumb/{session_id}/{pdf['filename']}").status_code == 404